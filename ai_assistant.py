@@ -1,5 +1,4 @@
-import pandas as pd
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, url_for
 import logging
 from datetime import datetime
 import subprocess
@@ -11,8 +10,13 @@ from validate_data import validate_data
 from generate_reports import generate_fraud_report, generate_waste_report
 from admin_tools import backup_database, manage_users
 from time_series_analysis import perform_time_series_analysis
-from network_analysis import build_network, analyze_network
+from graph_store import build_graph_store, analyze_graph_store
+from collusion_detection import detect_collusion
 from security_audit import run_security_scan, check_database_privileges
+from data_loader import SPENDING_SCHEMA
+from pipeline import Pipeline, Stage
+from job_queue import JobQueue
+from shared_dataset import SharedDataset
 
 # Setting up logging
 logging.basicConfig(filename='ai_assistant.log', level=logging.INFO,
@@ -20,55 +24,75 @@ logging.basicConfig(filename='ai_assistant.log', level=logging.INFO,
 
 app = Flask(__name__)
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
-
-def analyze_and_report():
-    """
-    Perform all analyses and generate reports, then summarize them for the AI assistant.
-    """
-    df = load_data('government_spending_data.csv')
-    
-    # Data Validation
+DATA_PATH = 'government_spending_data.csv'
+# Every worker process maps the same published copy of the data instead of loading its own
+shared_data = SharedDataset(DATA_PATH, publish=False)
+# Reports run in the background so HTTP workers are never blocked for minutes
+job_queue = JobQueue(max_workers=2)
+
+def validation_stage(df):
     validation_results = validate_data(df)
-    validation_summary = f"Data validation found {validation_results.get('missing_values', 0)} missing values and {validation_results.get('duplicates', 0)} duplicates."
-    
-    # Generate Reports
+    return f"Data validation found {validation_results.get('missing_values', 0)} missing values and {validation_results.get('duplicates', 0)} duplicates."
+
+def reports_stage(df):
     report_dir = 'reports_' + datetime.now().strftime("%Y%m%d_%H%M%S")
     generate_fraud_report(df, report_dir)
     generate_waste_report(df, report_dir)
-    report_summary = f"Fraud report and waste report generated. Check {report_dir} for details."
-    
-    # Time Series Analysis
+    return f"Fraud report and waste report generated. Check {report_dir} for details."
+
+def time_series_stage(df):
     perform_time_series_analysis(df)
-    time_series_summary = "Time series analysis completed, showing trends in spending over time."
-    
-    # Network Analysis
-    G = build_network(df)
-    analyze_network(G)
-    network_summary = "Network analysis performed, revealing potential collusion or unusual transaction patterns."
-    
-    # System Administration
+    return "Time series analysis completed, showing trends in spending over time."
+
+def network_stage(df):
+    # Built from the stage's own columns so the memo key covers everything it reads;
+    # the persisted graph store is updated incrementally by network_analysis.py and graph_store.py
+    store = build_graph_store(df)
+    analyze_graph_store(store)
+    return store['edges']
+
+def collusion_stage(df, edges):
+    collusion = detect_collusion(edges)
+    return f"Network analysis performed; {int((collusion['blocks']['collusion_score'] >= 0.5).sum())} dense, exclusive department-vendor blocks flagged for possible collusion."
+
+def admin_stage(df):
     backup_database('government_spending_db', 'backups')
     manage_users('create', 'ai_user', 'read_only')
-    admin_summary = "Database backed up and a new user 'ai_user' with read-only permissions created."
-    
-    # Security and Compliance
+    return "Database backed up and a new user 'ai_user' with read-only permissions created."
+
+def security_stage(df):
     run_security_scan()
     check_database_privileges()
-    security_summary = "Security scan and database privilege check completed."
+    return "Security scan and database privilege check completed."
+
+# Stages only rerun when the columns they read change; backup and security checks run every time
+REPORT_PIPELINE = Pipeline([
+    Stage('validation', validation_stage, columns=list(SPENDING_SCHEMA)),
+    Stage('reports', reports_stage, columns=['department', 'category', 'amount', 'fraud_flag']),
+    Stage('time_series', time_series_stage, columns=['date', 'amount']),
+    Stage('network', network_stage, columns=['department', 'vendor', 'amount', 'date']),
+    Stage('collusion', collusion_stage, inputs=['network']),
+    Stage('admin', admin_stage, cache=False),
+    Stage('security', security_stage, cache=False),
+])
+
+def analyze_and_report(progress=None):
+    """
+    Perform all analyses and generate reports, then summarize them for the AI assistant.
+    
+    Independent stages run concurrently through REPORT_PIPELINE on the shared,
+    memory-mapped dataset, and stages whose inputs are unchanged are answered from cache.
+    
+    :param progress: Optional callback progress(fraction, message) called as stages finish
+    """
+    data, _ = shared_data.frame(REPORT_PIPELINE.columns())
+    outputs = REPORT_PIPELINE.run(data, progress=progress)
+    validation_summary = outputs['validation']
+    report_summary = outputs['reports']
+    time_series_summary = outputs['time_series']
+    network_summary = outputs['collusion']
+    admin_summary = outputs['admin']
+    security_summary = outputs['security']
     
     # Combine all summaries
     full_summary = f"{validation_summary}\n{report_summary}\n{time_series_summary}\n{network_summary}\n{admin_summary}\n{security_summary}"
@@ -84,11 +108,53 @@ def analyze_and_report():
 def index():
     return render_template('assistant_response.html')
 
+def submit_report_job():
+    """
+    Queue a report job, keyed by the published version of the shared dataset so unchanged data is answered from cache.
+    
+    :return: Job id
+    """
+    _, sha256 = shared_data.table()
+    cache_key = 'report-' + sha256
+    return job_queue.submit('report', analyze_and_report, cache_key=cache_key)
+
+def job_accepted(job_id):
+    """
+    202 response pointing the client at a queued job.
+    """
+    job = job_queue.get(job_id)
+    body = {'job_id': job_id, 'status': job['status'], 'status_url': url_for('job_status', job_id=job_id),
+            'events_url': url_for('job_events', job_id=job_id)}
+    if job['status'] == 'done':
+        # Cached results are returned straight away
+        body['response'] = job['result']
+        return jsonify(body)
+    body['response'] = 'Report queued. Progress will follow.'
+    return jsonify(body), 202
+
+def register_job_routes(app):
+    """
+    Add the job polling and progress streaming endpoints to a Flask app.
+    """
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'unknown job'}), 404
+        return jsonify(job)
+    
+    @app.route('/jobs/<job_id>/events')
+    def job_events(job_id):
+        return Response(job_queue.stream(job_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+register_job_routes(app)
+
 @app.route('/ask_ai', methods=['POST'])
 def ask_ai():
     query = request.form.get('query')
     if query.lower() == 'report':
-        response = analyze_and_report()
+        return job_accepted(submit_report_job())
     else:
         response = "I can provide a detailed report on the current state of the project. Type 'report' to get it."
     
@@ -130,7 +196,20 @@ if __name__ == '__main__':
                     })
                     .then(response => response.json())
                     .then(data => {
-                        document.getElementById('response').innerText = data.response;
+                        const output = document.getElementById('response');
+                        output.innerText = data.response;
+                        if (data.events_url && data.status !== 'done') {
+                            const events = new EventSource(data.events_url);
+                            events.addEventListener('progress', e => {
+                                const job = JSON.parse(e.data);
+                                output.innerText = `${job.message} (${Math.round(job.progress * 100)}%)`;
+                            });
+                            events.addEventListener('result', e => {
+                                const job = JSON.parse(e.data);
+                                output.innerText = job.status === 'done' ? job.result : `Report failed: ${job.error}`;
+                                events.close();
+                            });
+                        }
                     });
                 });
             </script>
@@ -153,6 +232,7 @@ import speech_recognition as sr  # For speech-to-text
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # For session management
+register_job_routes(app)
 
 # Initialize TTS engine
 engine = pyttsx3.init()
@@ -192,7 +272,12 @@ def chat():
     
     response = ""
     if query.lower() == 'report':
-        response = analyze_and_report()
+        job_id = submit_report_job()
+        job = job_queue.get(job_id)
+        if job['status'] != 'done':
+            session['chat_history'].append({'user': query, 'ai': f'Report queued as job {job_id}.'})
+            return job_accepted(job_id)
+        response = job['result']
     else:
         response = "I can provide a detailed report on the current state of the project. Type or say 'report' to get it."
     
@@ -254,6 +339,14 @@ if __name__ == '__main__':
                         updateChat('user', document.getElementById('query').value);
                         updateChat('ai', data.response);
                         document.getElementById('query').value = '';
+                        if (data.events_url && data.status !== 'done') {
+                            const events = new EventSource(data.events_url);
+                            events.addEventListener('result', e => {
+                                const job = JSON.parse(e.data);
+                                updateChat('ai', job.status === 'done' ? job.result : `Report failed: ${job.error}`);
+                                events.close();
+                            });
+                        }
                     });
                 });
 
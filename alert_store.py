@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import logging
+from datetime import datetime
+
+# Durable table of records flagged by the scheduled fraud checks. The
+# (source_file, record_index) key makes re-running a batch idempotent.
+# The same database holds the dashboard event log: small, sequence-numbered
+# deltas pushed to open dashboards, which resume from the last sequence number
+# they saw after reconnecting.
+
+ALERT_DB = 'alerts.db'
+# Number of dashboard events kept; clients further behind reload the full summary
+EVENT_RETENTION = 10_000
+# Newest alerts carried by one alert event; the dashboard only lists recent ones
+EVENT_ALERT_LIMIT = 20
+_ALERT_COLUMNS = ['alert_id', 'source_file', 'record_index', 'transaction_id', 'detected_at']
+
+
+def _create_alert_table(conn):
+    # Record indices restart at 0 whenever the source file is replaced, so an
+    # alert is identified by the file generation as well as its index
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fraud_alerts (
+            alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_file TEXT NOT NULL,
+            generation TEXT NOT NULL DEFAULT '',
+            record_index INTEGER NOT NULL,
+            transaction_id INTEGER,
+            detected_at TEXT NOT NULL,
+            UNIQUE (source_file, generation, record_index)
+        )
+    ''')
+
+
+def connect(db_path=ALERT_DB):
+    """
+    Open the alert database, creating the alert table if needed.
+
+    :param db_path: Path to the SQLite database
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(fraud_alerts)')]
+    if columns and 'generation' not in columns:
+        # Tables created before file generations were tracked: existing alerts keep an empty generation
+        with conn:
+            conn.execute('ALTER TABLE fraud_alerts RENAME TO fraud_alerts_unversioned')
+            _create_alert_table(conn)
+            conn.execute('''
+                INSERT INTO fraud_alerts (alert_id, source_file, generation, record_index, transaction_id, detected_at)
+                SELECT alert_id, source_file, '', record_index, transaction_id, detected_at FROM fraud_alerts_unversioned
+            ''')
+            conn.execute('DROP TABLE fraud_alerts_unversioned')
+    _create_alert_table(conn)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    ''')
+    return conn
+
+
+def record_alerts(source_file, record_indices, transaction_ids=None, generation='', db_path=ALERT_DB):
+    """
+    Insert flagged records into the alert table, ignoring ones already recorded.
+
+    :param source_file: File the records were read from
+    :param record_indices: Row positions of the flagged records in the source file
+    :param transaction_ids: Optional transaction ids aligned with record_indices
+    :param generation: Generation of the source file the indices refer to, from its watermark
+    :param db_path: Path to the SQLite database
+    :return: Number of new alerts written
+    """
+    detected_at = datetime.now().isoformat()
+    if transaction_ids is None:
+        transaction_ids = [None] * len(record_indices)
+    rows = [(source_file, generation or '', int(idx), None if tid is None else int(tid), detected_at)
+            for idx, tid in zip(record_indices, transaction_ids)]
+    conn = connect(db_path)
+    try:
+        with conn:
+            last_id = conn.execute('SELECT COALESCE(MAX(alert_id), 0) FROM fraud_alerts').fetchone()[0]
+            before = conn.total_changes
+            conn.executemany('''
+                INSERT OR IGNORE INTO fraud_alerts (source_file, generation, record_index, transaction_id, detected_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            written = conn.total_changes - before
+            if written:
+                # Push the new alerts to open dashboards in the same transaction that records them
+                new_alerts = conn.execute('''
+                    SELECT alert_id, source_file, record_index, transaction_id, detected_at
+                    FROM fraud_alerts WHERE alert_id > ? ORDER BY alert_id DESC LIMIT ?
+                ''', (last_id, EVENT_ALERT_LIMIT)).fetchall()
+                count = conn.execute('SELECT COUNT(*) FROM fraud_alerts').fetchone()[0]
+                _insert_event(conn, 'alerts', {'abuseIncidents': count, 'alerts': [dict(zip(_ALERT_COLUMNS, row)) for row in new_alerts]})
+    finally:
+        conn.close()
+    logging.info(f"{written} new alerts recorded in {db_path}")
+    return written
+
+
+def alert_summary(limit=20, db_path=ALERT_DB):
+    """
+    Number of recorded alerts and the most recent ones, for the dashboard.
+
+    :param limit: Number of recent alerts returned
+    :param db_path: Path to the SQLite database
+    :return: Tuple of (alert count, list of alert dictionaries, newest first)
+    """
+    conn = connect(db_path)
+    try:
+        count = conn.execute('SELECT COUNT(*) FROM fraud_alerts').fetchone()[0]
+        rows = conn.execute('''
+            SELECT alert_id, source_file, record_index, transaction_id, detected_at
+            FROM fraud_alerts ORDER BY alert_id DESC LIMIT ?
+        ''', (limit,)).fetchall()
+    finally:
+        conn.close()
+    return count, [dict(zip(_ALERT_COLUMNS, row)) for row in rows]
+
+
+def _insert_event(conn, event, payload):
+    cursor = conn.execute('INSERT INTO dashboard_events (event, payload, created_at) VALUES (?, ?, ?)',
+                          (event, json.dumps(payload, default=str), datetime.now().isoformat()))
+    conn.execute('DELETE FROM dashboard_events WHERE seq <= ?', (cursor.lastrowid - EVENT_RETENTION,))
+    return cursor.lastrowid
+
+
+def publish_event(event, payload, db_path=ALERT_DB):
+    """
+    Append a delta to the dashboard event log.
+
+    :param event: Event type, e.g. 'summary' or 'alerts'
+    :param payload: JSON-serializable dictionary of the values that changed
+    :param db_path: Path to the SQLite database
+    :return: Sequence number of the event
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            seq = _insert_event(conn, event, payload)
+    finally:
+        conn.close()
+    return seq
+
+
+def events_since(seq, limit=500, db_path=ALERT_DB):
+    """
+    Dashboard events after a sequence number.
+
+    :param seq: Last sequence number the client has seen
+    :param limit: Maximum number of events returned
+    :param db_path: Path to the SQLite database
+    :return: Tuple of (list of (seq, event, payload JSON) tuples, whether events after seq were already pruned)
+    """
+    conn = connect(db_path)
+    try:
+        oldest = conn.execute('SELECT MIN(seq) FROM dashboard_events').fetchone()[0]
+        rows = conn.execute('SELECT seq, event, payload FROM dashboard_events WHERE seq > ? ORDER BY seq LIMIT ?',
+                            (seq, limit)).fetchall()
+    finally:
+        conn.close()
+    return rows, oldest is not None and oldest > seq + 1
+
+
+def latest_event_seq(db_path=ALERT_DB):
+    """
+    Sequence number of the newest dashboard event, 0 if there is none.
+    """
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM dashboard_events").fetchone()[0]
+    finally:
+        conn.close()
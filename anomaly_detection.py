@@ -1,34 +1,34 @@
+import os
+import json
+import hashlib
+import joblib
 import pandas as pd
+import numpy as np
 from sklearn.ensemble import IsolationForest
-import matplotlib.pyplot as plt
 import logging
 from sklearn.preprocessing import StandardScaler
+from concurrent.futures import ProcessPoolExecutor
+
+from data_loader import iter_batches, stratified_sample, temp_path
+from chart_rendering import render_chart, MAX_SCATTER_POINTS
+from model_registry import REGISTRY_DIR, training_fingerprint, save_artifact, load_artifact
 
 # Setting up logging
 logging.basicConfig(filename='anomaly_detection.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
+ANOMALY_PARAMS = {'contamination': 0.1, 'random_state': 42}
+SEGMENT_MODEL_DIR = os.path.join(REGISTRY_DIR, 'anomaly_segments')
+POOLED_SEGMENT = '__pooled__'
 
-def detect_anomalies(df, features):
+def detect_anomalies(df, features, params=ANOMALY_PARAMS, n_jobs=-1):
     """
     Detect anomalies in the data using Isolation Forest.
     
     :param df: Input DataFrame
     :param features: List of features to consider for anomaly detection
+    :param params: IsolationForest hyperparameters
+    :param n_jobs: Number of cores used to fit the forest
     :return: DataFrame with anomaly scores and predictions
     """
     # Preprocess data
@@ -36,16 +36,314 @@ def detect_anomalies(df, features):
     scaled_data = scaler.fit_transform(df[features])
     
     # Train Isolation Forest
-    iso_forest = IsolationForest(contamination=0.1, random_state=42)
-    anomalies = iso_forest.fit_predict(scaled_data)
+    iso_forest = IsolationForest(n_jobs=n_jobs, **params)
+    iso_forest.fit(scaled_data)
     
-    # Add anomaly scores and predictions to DataFrame
+    # Add anomaly scores and predictions to DataFrame; predictions are the negative scores,
+    # so the forest is only traversed once
     df['anomaly_score'] = iso_forest.decision_function(scaled_data)
-    df['anomaly'] = [1 if x == -1 else 0 for x in anomalies]
+    df['anomaly'] = (df['anomaly_score'] < 0).astype(np.int8)
     
     logging.info("Anomaly detection completed")
     return df
 
+def fit_anomaly_model(data_path, features, params=ANOMALY_PARAMS, sample_size=250_000, stratify='department',
+                      n_jobs=-1):
+    """
+    Fit the scaler and Isolation Forest once on a bounded stratified sample and persist them.
+    
+    A model already saved for the same data and parameters is loaded instead of refitted.
+    
+    :param data_path: Path to the transaction data file
+    :param features: List of features to consider for anomaly detection
+    :param params: IsolationForest hyperparameters
+    :param sample_size: Number of rows sampled for fitting
+    :param stratify: Column whose values are sampled in proportion
+    :param n_jobs: Number of cores used to fit the forest
+    :return: Tuple of (fitted IsolationForest, fitted StandardScaler)
+    """
+    run_params = {'model': 'isolation_forest', 'features': list(features), 'sample_size': sample_size,
+                  'stratify': stratify, **params}
+    fingerprint = training_fingerprint(data_path, run_params)
+    artifact = load_artifact(fingerprint)
+    if artifact is not None:
+        return artifact['model'], artifact['preprocessor']
+    
+    try:
+        sample, strata = stratified_sample(data_path, features, stratify, sample_size=sample_size)
+        scaler = StandardScaler()
+        scaled_data = scaler.fit_transform(sample[features])
+        iso_forest = IsolationForest(n_jobs=n_jobs, **params)
+        iso_forest.fit(scaled_data)
+        # Scoring runs one chunk per worker process, so each forest stays single-threaded there
+        iso_forest.set_params(n_jobs=1)
+    except Exception as e:
+        logging.error(f"Error fitting anomaly model: {str(e)}")
+        raise
+    
+    metrics = {'sample_rows': len(sample), 'strata': len(strata), 'offset': float(iso_forest.offset_)}
+    save_artifact(fingerprint, iso_forest, scaler, metrics, run_params)
+    logging.info(f"Anomaly model fitted on a sample of {len(sample)} rows")
+    return iso_forest, scaler
+
+_worker_model = None
+
+def _init_scoring_worker(model, scaler):
+    # The forest is shipped once per worker instead of once per chunk
+    global _worker_model
+    _worker_model = (model, scaler)
+
+def _score_chunk(chunk, features):
+    model, scaler = _worker_model
+    scores = model.decision_function(scaler.transform(chunk[features]))
+    return chunk.assign(anomaly_score=scores, anomaly=(scores < 0).astype(np.int8))
+
+def score_anomalies(data_path, model, scaler, features, output_path='anomaly_detection_results.csv',
+                    batch_size=100_000, n_workers=None, sample_size=MAX_SCATTER_POINTS, seed=42):
+    """
+    Score a dataset chunk by chunk with a fitted model, appending results to a CSV file.
+    
+    Chunks are scored in a bounded window of worker processes and written in
+    file order, so memory stays flat however many rows are scored. A uniform
+    sample of scored rows is kept for plotting.
+    
+    :param data_path: Path to the transaction data file
+    :param model: Fitted IsolationForest
+    :param scaler: Fitted StandardScaler
+    :param features: List of features the model was fitted on
+    :param output_path: CSV file the scored rows are written to
+    :param batch_size: Number of rows per chunk
+    :param n_workers: Number of worker processes; defaults to one per CPU
+    :param sample_size: Number of scored rows kept for plotting
+    :param seed: Seed for the plotting sample
+    :return: Tuple of (sample of scored rows, number of rows scored, number of anomalies)
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    sample = None
+    rows = anomalies = 0
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    
+    def consume(scored):
+        nonlocal sample, rows, anomalies
+        scored.to_csv(output_path, mode='a', header=rows == 0, index=False)
+        rows += len(scored)
+        anomalies += int(scored['anomaly'].sum())
+        candidates = scored.assign(_key=rng.random(len(scored)))
+        merged = candidates if sample is None else pd.concat([sample, candidates])
+        sample = merged.nsmallest(sample_size, '_key')
+    
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_scoring_worker,
+                             initargs=(model, scaler)) as executor:
+        # Keep a bounded number of chunks in flight so memory stays flat
+        pending = []
+        for chunk in iter_batches(data_path, batch_size=batch_size):
+            pending.append(executor.submit(_score_chunk, chunk, features))
+            if len(pending) >= 2 * n_workers:
+                consume(pending.pop(0).result())
+        for future in pending:
+            consume(future.result())
+    
+    logging.info(f"Scored {rows} rows, {anomalies} anomalies written to {output_path}")
+    sample = sample.drop(columns='_key') if sample is not None else pd.DataFrame(columns=list(features) + ['anomaly_score', 'anomaly'])
+    return sample, rows, anomalies
+
+def segment_fingerprint(values, params):
+    """
+    Fingerprint a segment's training data independently of row order.
+    
+    :param values: DataFrame of the segment's feature columns
+    :param params: IsolationForest hyperparameters
+    :return: Hex digest
+    """
+    row_hashes = np.sort(pd.util.hash_pandas_object(values, index=False).to_numpy())
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(json.dumps({'features': list(values.columns), 'params': params}, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def _read_segment_manifest(model_dir):
+    try:
+        with open(os.path.join(model_dir, 'manifest.json'), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def _fit_and_score_segment(values, params, cached):
+    # Runs in a worker process: refit only when no cached model matches, then score once
+    if cached is None:
+        scaler = StandardScaler().fit(values)
+        model = IsolationForest(n_jobs=1, **params).fit(scaler.transform(values))
+    else:
+        scaler, model = cached
+    scores = model.decision_function(scaler.transform(values))
+    return scaler, model, scores
+
+def _segment_codes(df, segment_columns):
+    """
+    Number every row's segment without building a key string per row.
+    
+    :param df: Input DataFrame
+    :param segment_columns: Columns defining a segment
+    :return: Tuple of (segment number per row, numpy array of segment names, numpy array of segment sizes)
+    """
+    grouped = df.groupby(list(segment_columns), sort=False, dropna=False, observed=True)
+    sizes = grouped.size()
+    names = np.array([' | '.join(map(str, key if isinstance(key, tuple) else (key,))) for key in sizes.index], dtype=object)
+    return grouped.ngroup().to_numpy(), names, sizes.to_numpy()
+
+def detect_anomalies_by_segment(df, features, segment_columns=('department',), min_group_size=500,
+                                params=ANOMALY_PARAMS, n_workers=None, model_dir=SEGMENT_MODEL_DIR):
+    """
+    Detect anomalies with a separate Isolation Forest per segment.
+    
+    Segments smaller than min_group_size are scored by one pooled model fitted
+    on all of their rows together. Segments are fitted and scored concurrently
+    in a process pool, and models are cached per segment, so only segments
+    whose data changed since the last run are refitted.
+    
+    :param df: Input DataFrame
+    :param features: List of features to consider for anomaly detection
+    :param segment_columns: Columns defining a segment, e.g. ('department',) or ('department', 'category')
+    :param min_group_size: Minimum number of rows for a segment to get its own model
+    :param params: IsolationForest hyperparameters
+    :param n_workers: Number of worker processes; defaults to one per CPU
+    :param model_dir: Directory holding the per-segment model cache
+    :return: DataFrame with anomaly scores, predictions and the segment that scored each row
+    """
+    codes, names, sizes = _segment_codes(df, segment_columns)
+    segment_keys = np.where(sizes >= min_group_size, names, POOLED_SEGMENT)[codes]
+    
+    os.makedirs(model_dir, exist_ok=True)
+    manifest = _read_segment_manifest(model_dir)
+    scores = np.empty(len(df), dtype=np.float64)
+    refitted = []
+    n_workers = n_workers or os.cpu_count() or 1
+    feature_frame = df[features]
+    
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {}
+            for key, positions in pd.Series(np.arange(len(df))).groupby(segment_keys, sort=False):
+                values = feature_frame.iloc[positions.to_numpy()]
+                fingerprint = segment_fingerprint(values, params)
+                entry = manifest.get(key)
+                cached = None
+                if entry and entry['fingerprint'] == fingerprint:
+                    cached = joblib.load(os.path.join(model_dir, entry['file']))
+                futures[key] = (positions.to_numpy(), fingerprint, cached is None,
+                                executor.submit(_fit_and_score_segment, values, params, cached))
+            
+            for key, (positions, fingerprint, is_new, future) in futures.items():
+                scaler, model, segment_scores = future.result()
+                scores[positions] = segment_scores
+                if is_new:
+                    file_name = f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.joblib"
+                    joblib.dump((scaler, model), os.path.join(model_dir, file_name))
+                    manifest[key] = {'fingerprint': fingerprint, 'file': file_name, 'rows': len(positions)}
+                    refitted.append(key)
+    except Exception as e:
+        logging.error(f"Error in segmented anomaly detection: {str(e)}")
+        raise
+    
+    manifest_path = os.path.join(model_dir, 'manifest.json')
+    tmp_path = temp_path(manifest_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    
+    df = df.assign(anomaly_score=scores, anomaly=(scores < 0).astype(np.int8), anomaly_segment=segment_keys)
+    logging.info(f"Segmented anomaly detection over {len(futures)} segments, {len(refitted)} refitted")
+    return df
+
+def _init_segment_worker(models):
+    global _worker_model
+    _worker_model = models
+
+def _score_segment_chunk(chunk, features, segment_columns):
+    models = _worker_model
+    codes, names, _ = _segment_codes(chunk, segment_columns)
+    # Segments without their own model were too small and are scored by the pooled one
+    segment_keys = np.array([name if name in models else POOLED_SEGMENT for name in names], dtype=object)[codes]
+    scores = np.empty(len(chunk), dtype=np.float64)
+    for key, positions in pd.Series(np.arange(len(chunk))).groupby(segment_keys, sort=False):
+        scaler, model = models[key]
+        scores[positions.to_numpy()] = model.decision_function(scaler.transform(chunk[features].iloc[positions.to_numpy()]))
+    return chunk.assign(anomaly_score=scores, anomaly=(scores < 0).astype(np.int8), anomaly_segment=segment_keys)
+
+def score_anomalies_by_segment(data_path, features, segment_columns=('department',), columns=None, min_group_size=500,
+                               fit_rows=50_000, params=ANOMALY_PARAMS, output_path='segment_anomaly_results.csv',
+                               batch_size=100_000, n_workers=None, seed=42, model_dir=SEGMENT_MODEL_DIR):
+    """
+    Per-segment anomaly detection over a whole dataset with bounded memory.
+    
+    A first pass over the Parquet cache counts every segment and keeps a
+    uniform sample of at most fit_rows rows per segment; segments smaller than
+    min_group_size are kept whole, so the pooled model sees all of their rows.
+    The segment models are fitted (or reused) on those samples with
+    detect_anomalies_by_segment, then a second pass scores the data chunk by
+    chunk in a bounded window of worker processes and appends it to a CSV file.
+    
+    :param data_path: Path to the transaction data file
+    :param features: List of features to consider for anomaly detection
+    :param segment_columns: Columns defining a segment, e.g. ('department',) or ('department', 'category')
+    :param columns: Extra columns written with the scores, e.g. ['transaction_id']
+    :param min_group_size: Minimum number of rows for a segment to get its own model
+    :param fit_rows: Maximum number of rows per segment used for fitting
+    :param params: IsolationForest hyperparameters
+    :param output_path: CSV file the scored rows are written to
+    :param batch_size: Number of rows per chunk
+    :param n_workers: Number of worker processes; defaults to one per CPU
+    :param seed: Seed for the fitting sample
+    :param model_dir: Directory holding the per-segment model cache
+    :return: Tuple of (number of rows scored, number of anomalies)
+    """
+    segment_columns = list(segment_columns)
+    read_columns = list(dict.fromkeys(list(columns or []) + segment_columns + list(features)))
+    fit_rows = max(fit_rows, min_group_size)
+    n_workers = n_workers or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    
+    reservoir = None
+    for batch in iter_batches(data_path, segment_columns + list(features), batch_size):
+        batch = batch.assign(_key=rng.random(len(batch)))
+        merged = batch if reservoir is None else pd.concat([reservoir, batch], ignore_index=True)
+        codes, _, _ = _segment_codes(merged, segment_columns)
+        rank = merged['_key'].groupby(codes, sort=False).rank(method='first')
+        reservoir = merged[rank.to_numpy() <= fit_rows]
+    if reservoir is None:
+        logging.info(f"No rows to score in {data_path}")
+        return 0, 0
+    
+    fitted = detect_anomalies_by_segment(reservoir.drop(columns='_key'), features, segment_columns, min_group_size,
+                                         params, n_workers, model_dir)
+    manifest = _read_segment_manifest(model_dir)
+    models = {key: joblib.load(os.path.join(model_dir, manifest[key]['file']))
+              for key in pd.unique(fitted['anomaly_segment'])}
+    
+    rows = anomalies = 0
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    
+    def consume(scored):
+        nonlocal rows, anomalies
+        scored.to_csv(output_path, mode='a', header=rows == 0, index=False)
+        rows += len(scored)
+        anomalies += int(scored['anomaly'].sum())
+    
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_segment_worker, initargs=(models,)) as executor:
+        # Keep a bounded number of chunks in flight so memory stays flat
+        pending = []
+        for chunk in iter_batches(data_path, read_columns, batch_size):
+            pending.append(executor.submit(_score_segment_chunk, chunk, features, segment_columns))
+            if len(pending) >= 2 * n_workers:
+                consume(pending.pop(0).result())
+        for future in pending:
+            consume(future.result())
+    
+    logging.info(f"Scored {rows} rows over {len(models)} segments, {anomalies} anomalies written to {output_path}")
+    return rows, anomalies
+
 def visualize_anomalies(df, feature):
     """
     Visualize anomalies in a scatter plot.
@@ -53,28 +351,26 @@ def visualize_anomalies(df, feature):
     :param df: DataFrame with anomaly detection results
     :param feature: Feature to plot against anomaly score
     """
-    plt.figure(figsize=(10, 6))
-    scatter = plt.scatter(df[feature], df['anomaly_score'], c=df['anomaly'], cmap='viridis')
-    plt.colorbar(scatter)
-    plt.xlabel(feature)
-    plt.ylabel('Anomaly Score')
-    plt.title(f'Anomaly Detection: {feature} vs Anomaly Score')
-    plt.savefig('anomaly_detection.png')
-    plt.close()
+    render_chart('scatter', 'anomaly_detection.png', df[[feature, 'anomaly_score', 'anomaly']], x=feature,
+                 y='anomaly_score', c='anomaly', cmap='viridis', colorbar=True, xlabel=feature,
+                 ylabel='Anomaly Score', title=f'Anomaly Detection: {feature} vs Anomaly Score')
 
 def main():
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
     
     features = ['amount', 'transaction_count']  # Example features
-    df_with_anomalies = detect_anomalies(df, features)
+    model, scaler = fit_anomaly_model(data_path, features)
+    
+    # Score every row in chunks and save results
+    scored_sample, _, _ = score_anomalies(data_path, model, scaler, features)
     
     # Visualize anomalies
     for feature in features:
-        visualize_anomalies(df_with_anomalies, feature)
+        visualize_anomalies(scored_sample, feature)
     
-    # Save results
-    df_with_anomalies.to_csv('anomaly_detection_results.csv', index=False)
+    # Department-specific models: what is normal for one department can be an outlier for another
+    score_anomalies_by_segment(data_path, features, segment_columns=('department',),
+                               columns=['transaction_id', 'department', 'category'])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import fcntl
+import pickle
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')  # Headless backend, also inside worker processes
+import matplotlib.pyplot as plt
+from matplotlib.cbook import boxplot_stats
+from matplotlib.collections import LineCollection
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from data_loader import CACHE_DIR, temp_path
+
+# Shared rendering service for every report figure. Figures are described as
+# jobs (kind, output path, data, spec), rendered in a process pool, and skipped
+# when the image on disk was produced from the same data and spec.
+
+RENDER_MANIFEST = 'render_manifest.json'
+MAX_KDE_BINS = 512
+MAX_SCATTER_POINTS = 200_000
+MAX_FLIERS_PER_BOX = 1_000
+# pyplot is not thread-safe; in-process renders from concurrent pipeline stages take turns
+_PYPLOT_LOCK = threading.Lock()
+# Concurrent stages and processes update the render manifest one at a time
+_MANIFEST_LOCK = threading.Lock()
+
+
+def chart_job(kind, output_path, data, **spec):
+    """
+    Describe one figure to render.
+
+    :param kind: Renderer name: 'histogram', 'bar', 'pie', 'scatter', 'boxplot', 'heatmap', 'decomposition' or 'network'
+    :param output_path: Path of the PNG to write
+    :param data: DataFrame, Series or array with the plotted data
+    :param spec: Renderer options such as title, axis labels and column names
+    :return: Job dictionary for render_charts
+    """
+    return {'kind': kind, 'output_path': output_path, 'data': data, 'spec': spec}
+
+
+def _hash_data(data):
+    digest = hashlib.sha256()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        names = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr(names).encode('utf-8'))
+    elif isinstance(data, np.ndarray):
+        digest.update(np.ascontiguousarray(data).tobytes())
+    elif isinstance(data, dict):
+        for key in sorted(data):
+            digest.update(f'{key}:{_hash_data(data[key])}'.encode('utf-8'))
+    else:
+        digest.update(pickle.dumps(data))
+    return digest.hexdigest()
+
+
+def job_hash(job):
+    """
+    Content hash of a job's plotted data and plot spec.
+
+    :param job: Job dictionary from chart_job
+    :return: Hex digest
+    """
+    spec = json.dumps({'kind': job['kind'], 'spec': job['spec']}, sort_keys=True, default=str)
+    return hashlib.sha256((spec + _hash_data(job['data'])).encode('utf-8')).hexdigest()
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, RENDER_MANIFEST), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _update_manifest(cache_dir, entries):
+    # Read, update and write under a thread lock and a file lock, so no concurrent update is lost
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, RENDER_MANIFEST)
+    with _MANIFEST_LOCK, open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            manifest = _read_manifest(cache_dir)
+            manifest.update(entries)
+            tmp_path = temp_path(path)
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _finish(fig, spec, output_path):
+    ax = fig.axes[0]
+    if 'title' in spec:
+        ax.set_title(spec['title'])
+    if 'xlabel' in spec:
+        ax.set_xlabel(spec['xlabel'])
+    if 'ylabel' in spec:
+        ax.set_ylabel(spec['ylabel'])
+    if 'rotation' in spec:
+        ax.tick_params(axis='x', labelrotation=spec['rotation'])
+    if spec.get('tight_layout'):
+        fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def _render_histogram(data, spec, output_path):
+    # Histogram and KDE are both computed from fine bins, so cost is one pass over the values
+    values = pd.Series(data).to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[np.isfinite(values)]
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (10, 6)))
+    if values.size:
+        low, high = values.min(), values.max()
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        fine_counts, edges = np.histogram(values, bins=MAX_KDE_BINS, range=(low, high))
+        bins = spec.get('bins', 32)
+        coarse_counts = fine_counts.reshape(bins, -1).sum(axis=1) if MAX_KDE_BINS % bins == 0 else np.histogram(values, bins=bins, range=(low, high))[0]
+        coarse_edges = np.linspace(low, high, bins + 1)
+        ax.stairs(coarse_counts, coarse_edges, fill=True, alpha=0.5)
+
+        if spec.get('kde', True) and values.size > 1 and values.std() > 0:
+            # Binned Gaussian KDE with Scott's bandwidth
+            fine_width = edges[1] - edges[0]
+            bandwidth = 1.06 * values.std() * values.size ** (-1 / 5)
+            radius = max(1, int(np.ceil(4 * bandwidth / fine_width)))
+            offsets = np.arange(-radius, radius + 1) * fine_width
+            kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+            density = np.convolve(fine_counts, kernel / kernel.sum(), mode='same')
+            centers = (edges[:-1] + edges[1:]) / 2
+            ax.plot(centers, density * (coarse_edges[1] - coarse_edges[0]) / fine_width)
+    _finish(fig, spec, output_path)
+
+
+def _render_bar(data, spec, output_path):
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (12, 6)))
+    y = spec['y']
+    if isinstance(y, (list, tuple)):
+        data.plot(kind='bar', x=spec['x'], y=list(y), ax=ax)
+    else:
+        ax.bar(data[spec['x']].astype(str), data[y])
+    _finish(fig, spec, output_path)
+
+
+def _render_pie(data, spec, output_path):
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (12, 6)))
+    ax.pie(data[spec['values']], labels=data[spec['labels']], autopct='%1.1f%%')
+    _finish(fig, spec, output_path)
+
+
+def _render_scatter(data, spec, output_path):
+    if len(data) > MAX_SCATTER_POINTS:
+        data = data.sample(MAX_SCATTER_POINTS, random_state=0)
+    data = data.reset_index(drop=True)
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (10, 6)))
+    sizes = None
+    if 'size' in spec:
+        size = data[spec['size']].to_numpy(dtype=np.float64)
+        low, high = spec.get('sizes', (20, 200))
+        span = np.nanmax(size) - np.nanmin(size) if size.size else 0
+        sizes = low + (size - np.nanmin(size)) / span * (high - low) if span > 0 else np.full(size.shape, low)
+    if 'hue' in spec:
+        for label, group in data.groupby(spec['hue']):
+            group_sizes = None if sizes is None else sizes[group.index]
+            ax.scatter(group[spec['x']], group[spec['y']], s=group_sizes, label=label)
+        ax.legend(fontsize='small')
+    else:
+        scatter = ax.scatter(data[spec['x']], data[spec['y']], s=sizes,
+                             c=data[spec['c']] if 'c' in spec else None, cmap=spec.get('cmap'))
+        if spec.get('colorbar'):
+            fig.colorbar(scatter)
+    _finish(fig, spec, output_path)
+
+
+def _render_boxplot(data, spec, output_path):
+    # Box statistics are computed exactly per group; only the drawn outliers are capped
+    stats = []
+    for label, values in data.groupby(spec['x'])[spec['y']]:
+        box = boxplot_stats(values.dropna().to_numpy(), labels=[label])[0]
+        if len(box['fliers']) > MAX_FLIERS_PER_BOX:
+            box['fliers'] = np.random.default_rng(0).choice(box['fliers'], MAX_FLIERS_PER_BOX, replace=False)
+        stats.append(box)
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (12, 6)))
+    ax.bxp(stats)
+    _finish(fig, spec, output_path)
+
+
+def _render_heatmap(data, spec, output_path):
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (10, 8)))
+    sns.heatmap(data, annot=spec.get('annot', False), cmap=spec.get('cmap', 'coolwarm'),
+                vmin=spec.get('vmin'), vmax=spec.get('vmax'), ax=ax)
+    _finish(fig, spec, output_path)
+
+
+def _render_decomposition(data, spec, output_path):
+    fig, axes = plt.subplots(len(data.columns), 1, figsize=spec.get('figsize', (12, 16)))
+    for ax, column in zip(np.atleast_1d(axes), data.columns):
+        data[column].plot(ax=ax)
+        ax.set_title(column)
+    fig.tight_layout()
+    fig.savefig(output_path)
+    plt.close(fig)
+
+
+def _render_network(data, spec, output_path):
+    # data holds 'positions' (node, x, y) and 'edges' (source, target) tables
+    positions = data['positions'].set_index('node')
+    edges = data['edges']
+    fig, ax = plt.subplots(figsize=spec.get('figsize', (12, 12)))
+    segments = np.stack([positions.loc[edges['source'], ['x', 'y']].to_numpy(),
+                         positions.loc[edges['target'], ['x', 'y']].to_numpy()], axis=1)
+    ax.add_collection(LineCollection(segments, colors='gray', linewidths=0.5))
+    ax.scatter(positions['x'], positions['y'], s=spec.get('node_size', 500), c='lightblue', zorder=2)
+    labels = spec.get('labels')
+    for node in positions.index if labels is None else labels:
+        ax.annotate(str(node), positions.loc[node, ['x', 'y']], fontsize=8, fontweight='bold', ha='center', va='center')
+    ax.set_axis_off()
+    _finish(fig, spec, output_path)
+
+
+_RENDERERS = {
+    'histogram': _render_histogram,
+    'bar': _render_bar,
+    'pie': _render_pie,
+    'scatter': _render_scatter,
+    'boxplot': _render_boxplot,
+    'heatmap': _render_heatmap,
+    'decomposition': _render_decomposition,
+    'network': _render_network,
+}
+
+
+def _render_job(job):
+    _RENDERERS[job['kind']](job['data'], job['spec'], job['output_path'])
+    return job['output_path']
+
+
+def render_charts(jobs, n_workers=None, cache_dir=CACHE_DIR):
+    """
+    Render figure jobs, in parallel, skipping those whose image is already up to date.
+
+    :param jobs: List of job dictionaries from chart_job
+    :param n_workers: Number of worker processes; defaults to one per CPU, capped by the number of jobs
+    :param cache_dir: Directory holding the render manifest
+    :return: List of output paths that were rendered
+    """
+    manifest = _read_manifest(cache_dir)
+    pending = []
+    for job in jobs:
+        digest = job_hash(job)
+        key = os.path.abspath(job['output_path'])
+        if manifest.get(key) == digest and os.path.exists(job['output_path']):
+            continue
+        pending.append((key, digest, job))
+
+    if n_workers is None:
+        n_workers = min(len(pending), os.cpu_count() or 1)
+    if len(pending) <= 1 or n_workers <= 1:
+        with _PYPLOT_LOCK:
+            rendered = [_render_job(job) for _, _, job in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rendered = list(executor.map(_render_job, [job for _, _, job in pending]))
+
+    if pending:
+        _update_manifest(cache_dir, {key: digest for key, digest, _ in pending})
+    logging.info(f"Rendered {len(rendered)} charts, {len(jobs) - len(rendered)} unchanged charts skipped")
+    return rendered
+
+
+def render_chart(kind, output_path, data, **spec):
+    """
+    Render a single figure through the cache.
+
+    :return: List with the output path if it was rendered, empty if it was up to date
+    """
+    return render_charts([chart_job(kind, output_path, data, **spec)], n_workers=1)
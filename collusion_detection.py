@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import logging
+
+# Collusion analysis on the department-vendor bipartite graph. Everything works
+# on a sparse department x vendor matrix built from the aggregated edge table
+# (network_analysis.build_edge_table), so vendor projections and community
+# labels never need a dense vendor x vendor matrix.
+
+# Departments linked to more vendors than this are left out of the vendor
+# projection: they co-occur with everyone and would add O(degree^2) pairs
+MAX_PROJECTION_DEGREE = 1_000
+
+
+def build_biadjacency_matrix(edges, weight='total_amount'):
+    """
+    Build the sparse department x vendor matrix from an edge table.
+
+    :param edges: Edge table with department, vendor and weight columns
+    :param weight: Edge table column used as the matrix value
+    :return: Tuple of (scipy CSR matrix, pandas Index of departments, pandas Index of vendors)
+    """
+    rows, departments = pd.factorize(edges['department'])
+    cols, vendors = pd.factorize(edges['vendor'])
+    values = edges[weight].to_numpy(dtype=np.float64)
+    # Duplicate pairs are summed by the COO -> CSR conversion
+    matrix = sp.coo_matrix((values, (rows, cols)), shape=(len(departments), len(vendors))).tocsr()
+    return matrix, pd.Index(departments), pd.Index(vendors)
+
+
+def vendor_cooccurrence(B, vendors, max_department_degree=MAX_PROJECTION_DEGREE, min_shared=2, top_k=100, block_size=4096):
+    """
+    Find vendor pairs that serve unusually overlapping sets of departments.
+
+    The vendor projection B^T B is computed as sparse products over blocks of
+    vendor columns, keeping only the top_k pairs after each block, so memory is
+    bounded by one block of the projection.
+
+    :param B: Sparse department x vendor matrix
+    :param vendors: pandas Index of vendor names matching B's columns
+    :param max_department_degree: Departments with more vendors are skipped in the projection
+    :param min_shared: Minimum number of shared departments for a pair to be reported
+    :param top_k: Number of pairs to keep
+    :param block_size: Number of vendors per block of the projection
+    :return: DataFrame with vendor_1, vendor_2, shared_departments and jaccard, highest jaccard first
+    """
+    binary = (B != 0).astype(np.float32).tocsr()
+    vendor_degree = np.asarray(binary.sum(axis=0)).ravel()
+    department_degree = np.diff(binary.indptr)
+    hubs = department_degree > max_department_degree
+    if hubs.any():
+        logging.info(f"{hubs.sum()} hub departments left out of the vendor projection")
+        binary = sp.diags((~hubs).astype(np.float32)) @ binary
+        binary.eliminate_zeros()
+    binary_t = binary.T.tocsr()
+
+    best_i = np.zeros(0, dtype=np.int64)
+    best_j = np.zeros(0, dtype=np.int64)
+    best_counts = np.zeros(0, dtype=np.float32)
+    best_jaccard = np.zeros(0, dtype=np.float64)
+    for start in range(0, binary.shape[1], block_size):
+        shared = (binary_t[start:start + block_size] @ binary).tocoo()
+        i = shared.row.astype(np.int64) + start
+        keep = (shared.col > i) & (shared.data >= min_shared)
+        i, j, counts = i[keep], shared.col[keep].astype(np.int64), shared.data[keep]
+        jaccard = counts / (vendor_degree[i] + vendor_degree[j] - counts)
+        best_i = np.concatenate([best_i, i])
+        best_j = np.concatenate([best_j, j])
+        best_counts = np.concatenate([best_counts, counts])
+        best_jaccard = np.concatenate([best_jaccard, jaccard])
+        if best_jaccard.size > top_k:
+            keep = np.argpartition(-best_jaccard, top_k)[:top_k]
+            best_i, best_j, best_counts, best_jaccard = best_i[keep], best_j[keep], best_counts[keep], best_jaccard[keep]
+
+    order = np.lexsort((-best_counts, -best_jaccard))
+    return pd.DataFrame({
+        'vendor_1': vendors[best_i[order]],
+        'vendor_2': vendors[best_j[order]],
+        'shared_departments': best_counts[order].astype(np.int64),
+        'jaccard': best_jaccard[order],
+    })
+
+
+def _propagate(matrix, labels):
+    # Each row takes the label with the largest total edge weight among its neighbours
+    codes, compact = np.unique(labels, return_inverse=True)
+    one_hot = sp.csr_matrix((np.ones(len(compact)), (np.arange(len(compact)), compact)), shape=(len(compact), len(codes)))
+    votes = (matrix @ one_hot).tocsr()
+    best = np.asarray(votes.argmax(axis=1)).ravel()
+    has_neighbours = np.diff(votes.indptr) > 0
+    return np.where(has_neighbours, codes[best], -1)
+
+
+def detect_communities(B, max_iter=20):
+    """
+    Label propagation on the bipartite graph, using sparse matrix products.
+
+    Departments start with their own label; vendors and departments then
+    alternately adopt the heaviest label among their neighbours. Alternating
+    the two sides avoids the label oscillation synchronous propagation shows
+    on bipartite graphs.
+
+    :param B: Sparse department x vendor matrix
+    :param max_iter: Maximum number of propagation rounds
+    :return: Tuple of (department labels, vendor labels) as integer arrays
+    """
+    BT = B.T.tocsr()
+    department_labels = np.arange(B.shape[0])
+    vendor_labels = _propagate(BT, department_labels)
+    for iteration in range(max_iter):
+        new_departments = _propagate(B, vendor_labels)
+        new_departments = np.where(new_departments >= 0, new_departments, department_labels)
+        new_vendors = _propagate(BT, new_departments)
+        converged = np.array_equal(new_departments, department_labels) and np.array_equal(new_vendors, vendor_labels)
+        department_labels, vendor_labels = new_departments, new_vendors
+        if converged:
+            break
+    logging.info(f"Label propagation found {len(np.unique(department_labels))} communities in {iteration + 1} rounds")
+    return department_labels, vendor_labels
+
+
+def score_blocks(B, department_labels, vendor_labels, departments, vendors):
+    """
+    Score each community as a department-vendor block.
+
+    density is the share of possible department-vendor pairs in the block that
+    trade, and density_lift compares it with the density of the whole matrix.
+    exclusivity is the share of the block vendors' total amount that comes
+    from the block's own departments. collusion_score combines the two for
+    blocks spanning more than one department.
+
+    :param B: Sparse department x vendor matrix of amounts
+    :param department_labels: Community label per department
+    :param vendor_labels: Community label per vendor
+    :param departments: pandas Index of department names
+    :param vendors: pandas Index of vendor names
+    :return: DataFrame with one row per community, most suspicious first
+    """
+    coo = B.tocoo()
+    labels, department_codes = np.unique(department_labels, return_inverse=True)
+    # Vendors without a community map to -1 and count towards no block
+    vendor_codes = pd.Index(labels).get_indexer(vendor_labels)
+    n_blocks = len(labels)
+
+    n_departments = np.bincount(department_codes, minlength=n_blocks)
+    n_vendors = np.bincount(vendor_codes[vendor_codes >= 0], minlength=n_blocks)
+    row_block = department_codes[coo.row]
+    col_block = vendor_codes[coo.col]
+    inside = row_block == col_block
+    internal_edges = np.bincount(row_block[inside], minlength=n_blocks)
+    internal_amount = np.bincount(row_block[inside], weights=coo.data[inside], minlength=n_blocks)
+    vendor_amount = np.bincount(col_block[col_block >= 0], weights=coo.data[col_block >= 0], minlength=n_blocks)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = np.nan_to_num(internal_edges / (n_departments * n_vendors))
+        exclusivity = np.nan_to_num(internal_amount / vendor_amount)
+    global_density = B.nnz / max(B.shape[0] * B.shape[1], 1)
+
+    members = pd.Series(departments).groupby(department_codes).agg(lambda names: ', '.join(map(str, names[:10])))
+    blocks = pd.DataFrame({
+        'community': labels,
+        'departments': members.reindex(range(n_blocks)).to_numpy(),
+        'n_departments': n_departments,
+        'n_vendors': n_vendors,
+        'internal_edges': internal_edges,
+        'internal_amount': internal_amount,
+        'density': density,
+        'density_lift': density / global_density if global_density else 0.0,
+        'exclusivity': exclusivity,
+    })
+    # A single department with its own vendors is ordinary; collusion needs several departments sharing vendors
+    blocks['collusion_score'] = blocks['density'] * blocks['exclusivity'] * (blocks['n_departments'] > 1)
+    return blocks.sort_values(['collusion_score', 'internal_amount'], ascending=False).reset_index(drop=True)
+
+
+def detect_collusion(edges, output_dir='.', top_k=100, min_shared=2, max_department_degree=MAX_PROJECTION_DEGREE):
+    """
+    Run the collusion stage on an aggregated department-vendor edge table.
+
+    Writes vendor_cooccurrence.csv, collusion_blocks.csv and vendor_communities.csv to output_dir.
+
+    :param edges: Edge table from network_analysis.build_edge_table
+    :param output_dir: Directory for the result files
+    :param top_k: Number of co-occurring vendor pairs to keep
+    :param min_shared: Minimum number of shared departments for a vendor pair
+    :param max_department_degree: Departments with more vendors are skipped in the vendor projection
+    :return: Dictionary with 'pairs', 'blocks' and 'communities' DataFrames
+    """
+    try:
+        B, departments, vendors = build_biadjacency_matrix(edges)
+        pairs = vendor_cooccurrence(B, vendors, max_department_degree, min_shared, top_k)
+        department_labels, vendor_labels = detect_communities(B)
+        blocks = score_blocks(B, department_labels, vendor_labels, departments, vendors)
+        communities = pd.DataFrame({'vendor': vendors, 'community': vendor_labels})
+
+        pairs.to_csv(f'{output_dir}/vendor_cooccurrence.csv', index=False)
+        blocks.to_csv(f'{output_dir}/collusion_blocks.csv', index=False)
+        communities.to_csv(f'{output_dir}/vendor_communities.csv', index=False)
+        logging.info(f"Collusion stage scored {len(blocks)} blocks over {len(departments)} departments and {len(vendors)} vendors")
+        return {'pairs': pairs, 'blocks': blocks, 'communities': communities}
+    except Exception as e:
+        logging.error(f"Error in collusion detection: {str(e)}")
+        raise
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.cluster.hierarchy import linkage, fcluster, leaves_list
+from scipy.spatial.distance import squareform
+import logging
+
+# Correlation analysis for wide frames such as the one-hot encoded features
+# produced by preprocessing. Correlations are computed block by block, so only
+# block_size x block_size values exist at a time, and only the strongest pairs
+# are kept instead of the full n x n matrix.
+
+
+def _is_binary(col):
+    values = col.to_numpy()
+    return bool(np.all((values == 0) | (values == 1)))
+
+
+def prepare_matrix(df, sparse=True):
+    """
+    Build the float32 matrix used for correlation, with per-column means and standard deviations.
+
+    Continuous columns are standardized. With sparse=True, 0/1 indicator columns
+    are kept as sparse columns and corrected analytically, so dummies are never densified.
+
+    :param df: DataFrame of numeric columns
+    :param sparse: Keep indicator columns sparse
+    :return: Tuple of (matrix, column names, means, standard deviations)
+    """
+    numeric = df.select_dtypes(include=[np.number, 'bool'])
+    binary = [col for col in numeric.columns if sparse and _is_binary(numeric[col])]
+    dense = [col for col in numeric.columns if col not in set(binary)]
+
+    dense_values = numeric[dense].to_numpy(dtype=np.float32)
+    dense_means = np.nanmean(dense_values, axis=0) if dense else np.zeros(0, dtype=np.float32)
+    dense_values -= dense_means
+    dense_stds = np.nanstd(dense_values, axis=0) if dense else np.zeros(0, dtype=np.float32)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dense_values /= np.where(dense_stds > 0, dense_stds, 1)
+    np.nan_to_num(dense_values, copy=False)
+
+    if not binary:
+        return dense_values, dense, np.zeros(len(dense)), np.where(dense_stds > 0, 1.0, 0.0)
+
+    binary_matrix = sp.csc_matrix(numeric[binary].to_numpy(dtype=np.float32))
+    p = np.asarray(binary_matrix.mean(axis=0)).ravel()
+    matrix = sp.hstack([sp.csc_matrix(dense_values), binary_matrix], format='csc')
+    means = np.concatenate([np.zeros(len(dense)), p])
+    stds = np.concatenate([np.where(dense_stds > 0, 1.0, 0.0), np.sqrt(p * (1 - p))])
+    return matrix, dense + binary, means, stds
+
+
+def _correlation_block(matrix, means, stds, rows, cols, n):
+    gram = matrix[:, rows].T @ matrix[:, cols]
+    gram = gram.toarray() if sp.issparse(gram) else np.asarray(gram)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (gram / n - np.outer(means[rows], means[cols])) / np.outer(stds[rows], stds[cols])
+    return np.nan_to_num(corr, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def top_correlated_pairs(df, k=50, block_size=512, sparse=True):
+    """
+    Find the k most strongly correlated column pairs without building the full matrix.
+
+    :param df: DataFrame of numeric columns
+    :param k: Number of pairs to keep
+    :param block_size: Number of columns per block
+    :param sparse: Keep indicator columns sparse
+    :return: DataFrame with feature_1, feature_2 and correlation, strongest first
+    """
+    matrix, names, means, stds = prepare_matrix(df, sparse)
+    n = matrix.shape[0]
+    starts = range(0, len(names), block_size)
+    best_i = np.zeros(0, dtype=np.int64)
+    best_j = np.zeros(0, dtype=np.int64)
+    best_r = np.zeros(0, dtype=np.float64)
+
+    for a in starts:
+        rows = np.arange(a, min(a + block_size, len(names)))
+        for b in starts:
+            if b < a:
+                continue
+            cols = np.arange(b, min(b + block_size, len(names)))
+            corr = _correlation_block(matrix, means, stds, rows, cols, n)
+            ii, jj = np.meshgrid(rows, cols, indexing='ij')
+            mask = ii < jj
+            ii, jj, rr = ii[mask], jj[mask], corr[mask]
+            if rr.size > k:
+                keep = np.argpartition(-np.abs(rr), k)[:k]
+                ii, jj, rr = ii[keep], jj[keep], rr[keep]
+            best_i = np.concatenate([best_i, ii])
+            best_j = np.concatenate([best_j, jj])
+            best_r = np.concatenate([best_r, rr])
+            if best_r.size > k:
+                keep = np.argpartition(-np.abs(best_r), k)[:k]
+                best_i, best_j, best_r = best_i[keep], best_j[keep], best_r[keep]
+
+    order = np.argsort(-np.abs(best_r), kind='stable')
+    names = np.asarray(names, dtype=object)
+    return pd.DataFrame({
+        'feature_1': names[best_i[order]],
+        'feature_2': names[best_j[order]],
+        'correlation': best_r[order],
+    })
+
+
+def cluster_features(df, features, cluster_threshold=0.5, sparse=True):
+    """
+    Cluster a bounded set of features by correlation.
+
+    :param df: DataFrame of numeric columns
+    :param features: Features to cluster
+    :param cluster_threshold: Minimum absolute correlation for features to share a cluster
+    :param sparse: Keep indicator columns sparse
+    :return: Tuple of (correlation matrix in clustered order, DataFrame of feature clusters)
+    """
+    features = list(features)
+    matrix, names, means, stds = prepare_matrix(df[features], sparse)
+    idx = np.arange(len(names))
+    corr = _correlation_block(matrix, means, stds, idx, idx, matrix.shape[0])
+    np.fill_diagonal(corr, 1.0)
+    corr_df = pd.DataFrame(corr, index=names, columns=names)
+    if len(names) < 2:
+        return corr_df, pd.DataFrame({'feature': names, 'cluster': [1] * len(names)})
+
+    distance = squareform(1 - np.abs(corr), checks=False)
+    tree = linkage(np.clip(distance, 0, None), method='average')
+    clusters = fcluster(tree, t=1 - cluster_threshold, criterion='distance')
+    order = leaves_list(tree)
+    ordered = corr_df.iloc[order, order]
+    summary = pd.DataFrame({'feature': names, 'cluster': clusters}).sort_values(['cluster', 'feature'])
+    return ordered, summary.reset_index(drop=True)
+
+
+def correlation_summary(df, k=50, max_heatmap_columns=30, block_size=512, sparse=True, cluster_threshold=0.5):
+    """
+    Compute the top-k correlated pairs and a clustered view of the features involved.
+
+    :param df: DataFrame of numeric columns
+    :param k: Number of pairs to keep
+    :param max_heatmap_columns: Maximum number of features in the clustered view
+    :param block_size: Number of columns per block
+    :param sparse: Keep indicator columns sparse
+    :param cluster_threshold: Minimum absolute correlation for features to share a cluster
+    :return: Dictionary with 'top_pairs', 'heatmap' (clustered correlation matrix) and 'clusters'
+    """
+    top_pairs = top_correlated_pairs(df, k=k, block_size=block_size, sparse=sparse)
+    features = pd.unique(top_pairs[['feature_1', 'feature_2']].to_numpy().ravel())[:max_heatmap_columns]
+    heatmap, clusters = cluster_features(df, features, cluster_threshold, sparse)
+    logging.info(f"Correlation summary computed over {df.shape[1]} columns, {len(top_pairs)} top pairs kept")
+    return {'top_pairs': top_pairs, 'heatmap': heatmap, 'clusters': clusters}
@@ -1,66 +1,39 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import logging
 from datetime import datetime
 
+from data_loader import load_data
+from chart_rendering import chart_job, render_charts
+from county_facts import build_county_facts, load_county_facts, county_tables
+
 # Setting up logging
 logging.basicConfig(filename='county_corruption_analysis.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
-
-def analyze_county_corruption(df):
+def analyze_county_corruption(df, facts=None):
     """
     Analyze county-level corruption indicators including salaries, total worth, fees, fines, and commissions.
     
     :param df: DataFrame with county financial data
+    :param facts: County fact tables from load_county_facts; built from df if omitted
     :return: Dictionary with analysis results
     """
-    results = {}
+    if facts is None:
+        county, commission = build_county_facts(df)
+        facts = {'county': county, 'commission': commission}
     
-    # Salaries and Total Worth Analysis
-    results['salary_stats'] = df.groupby('county')['salary'].agg(['mean', 'median', 'max']).reset_index()
-    results['total_worth_stats'] = df.groupby('county')['total_worth'].agg(['mean', 'median', 'max']).reset_index()
-    
-    # Fees and Fines Analysis
-    fees_fines = df.groupby('county')[['fees', 'fines']].sum().reset_index()
-    results['fees_fines'] = fees_fines
-    
-    # Commission Analysis
-    commissions = df[df['commission_type'].isin(['Liquor', 'Cannabis'])].groupby(['county', 'commission_type'])['commission_income'].sum().unstack().fillna(0)
-    results['commissions'] = commissions
-    
-    # Correlation between enforcement actions and court outcomes
-    enforcement_court_corr = df[['enforcement_actions', 'court_outcomes']].corr().iloc[0, 1]
-    results['enforcement_court_correlation'] = enforcement_court_corr
+    # Salaries, Total Worth, Fees, Fines, Commissions and the enforcement/court correlation all come from the fact table
+    results = county_tables(facts)
+    fees_fines = results['fees_fines']
     
     # Visualization
-    plt.figure(figsize=(12, 6))
-    sns.scatterplot(data=df, x='salary', y='total_worth', hue='county', size='fees', sizes=(20, 200))
-    plt.title('Salary vs Total Worth by County with Fee Size')
-    plt.savefig('salary_vs_worth.png')
-    plt.close()
-    
-    plt.figure(figsize=(12, 6))
-    fees_fines.plot(kind='bar', x='county', y=['fees', 'fines'], figsize=(12, 6))
-    plt.title('Fees and Fines by County')
-    plt.ylabel('Amount ($)')
-    plt.savefig('fees_fines_by_county.png')
-    plt.close()
+    render_charts([
+        chart_job('scatter', 'salary_vs_worth.png', df[['salary', 'total_worth', 'county', 'fees']], x='salary',
+                  y='total_worth', hue='county', size='fees', sizes=(20, 200), figsize=(12, 6),
+                  title='Salary vs Total Worth by County with Fee Size'),
+        chart_job('bar', 'fees_fines_by_county.png', fees_fines, x='county', y=['fees', 'fines'],
+                  title='Fees and Fines by County', ylabel='Amount ($)'),
+    ])
     
     logging.info("County-level corruption analysis completed")
     return results
@@ -68,7 +41,7 @@ def analyze_county_corruption(df):
 def main():
     data_path = 'county_financial_data.csv'
     df = load_data(data_path)
-    analysis_results = analyze_county_corruption(df)
+    analysis_results = analyze_county_corruption(df, load_county_facts(data_path, df))
     
     # Save results to CSV for further analysis or reporting
     for key, value in analysis_results.items():
@@ -1,25 +1,20 @@
-import pandas as pd
 from textblob import TextBlob
 import logging
 
+from county_facts import load_county_facts, county_tables
+
 # Setting up logging
 logging.basicConfig(filename='county_corruption_narrative.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_analysis_results():
+def load_analysis_results(data_path='county_financial_data.csv'):
     """
-    Load the results from the previous analysis.
+    Load the county analysis results from the county fact table.
     
+    :param data_path: Path to the county financial data file the facts were built from
     :return: Dictionary with analysis results
     """
-    results = {}
-    for file in ['salary_stats.csv', 'total_worth_stats.csv', 'fees_fines.csv', 'commissions.csv']:
-        try:
-            results[file.replace('.csv', '')] = pd.read_csv(file)
-        except FileNotFoundError:
-            logging.error(f"File not found: {file}")
-    
-    return results
+    return county_tables(load_county_facts(data_path))
 
 def generate_narrative(results):
     """
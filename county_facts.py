@@ -0,0 +1,201 @@
+import os
+import logging
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CACHE_DIR, load_data, file_fingerprint, temp_path
+
+# County fact table shared by the county and hidden-corruption analyses and the
+# reports built on them. Every per-county and per-county x commission_type
+# metric comes out of one grouped pass over the source rows and is persisted as
+# Parquet next to the data cache, keyed by the content hash of the source file.
+
+FACT_COLUMNS = ['county', 'salary', 'total_worth', 'fees', 'fines', 'public_service_spending', 'business_grants',
+                'business_loans', 'commission_type', 'commission_income', 'enforcement_actions', 'court_outcomes']
+COMMISSION_TYPES = ['Liquor', 'Cannabis']
+# Bumped when the fact table columns change, so tables cached in an older layout are rebuilt
+FACTS_LAYOUT = 2
+
+
+def build_county_facts(df):
+    """
+    Compute every county metric in one grouped pass.
+
+    Commission metrics are computed per commission type by masking the
+    commission columns per type before grouping, so the same pass also yields
+    the county x commission_type facts. Enforcement and court outcomes are
+    kept as per-county means and sums of centered products, so their
+    correlation can be recomputed from the table for any set of counties
+    without the cancellation of raw moment sums.
+
+    :param df: DataFrame with county financial data; columns missing from the source are skipped
+    :return: Tuple of (county facts DataFrame, commission facts DataFrame)
+    """
+    work = pd.DataFrame({'county': df['county']})
+    aggregations = {'rows': ('county', 'size')}
+    for col in ('salary', 'total_worth'):
+        if col in df.columns:
+            work[col] = df[col]
+            aggregations.update({f'{col}_mean': (col, 'mean'), f'{col}_median': (col, 'median'), f'{col}_max': (col, 'max')})
+    for col in ('fees', 'fines', 'public_service_spending'):
+        if col in df.columns:
+            work[col] = df[col]
+            aggregations[col] = (col, 'sum')
+    if {'fees', 'fines'} <= set(df.columns):
+        work['fee_fine_total'] = df['fees'] + df['fines']
+        aggregations['fee_fine_total'] = ('fee_fine_total', 'sum')
+    has_support = {'business_grants', 'business_loans'} <= set(df.columns)
+    if has_support:
+        work['business_support'] = df['business_grants'] + df['business_loans']
+        aggregations['business_support'] = ('business_support', 'sum')
+
+    if {'enforcement_actions', 'court_outcomes'} <= set(df.columns):
+        both = df['enforcement_actions'].notna() & df['court_outcomes'].notna()
+        x = df['enforcement_actions'].where(both).astype(np.float64)
+        y = df['court_outcomes'].where(both).astype(np.float64)
+        # Deviations from each county's own means, so the products stay small for large-magnitude values
+        dx = x - x.groupby(df['county']).transform('mean')
+        dy = y - y.groupby(df['county']).transform('mean')
+        work = work.assign(corr_n=both.astype(np.int64), corr_mean_x=x, corr_mean_y=y,
+                           corr_m2_x=dx * dx, corr_m2_y=dy * dy, corr_cxy=dx * dy)
+        aggregations.update({'corr_n': ('corr_n', 'sum'), 'corr_mean_x': ('corr_mean_x', 'mean'),
+                             'corr_mean_y': ('corr_mean_y', 'mean')})
+        aggregations.update({col: (col, 'sum') for col in ('corr_m2_x', 'corr_m2_y', 'corr_cxy')})
+
+    commission_types = []
+    if {'commission_type', 'commission_income'} <= set(df.columns):
+        commission_types = sorted(df['commission_type'].dropna().unique())
+        for commission_type in commission_types:
+            is_type = df['commission_type'] == commission_type
+            work[f'rows__{commission_type}'] = is_type.astype(np.int64)
+            work[f'commission_income__{commission_type}'] = df['commission_income'].where(is_type)
+            aggregations[f'rows__{commission_type}'] = (f'rows__{commission_type}', 'sum')
+            aggregations[f'commission_income__{commission_type}'] = (f'commission_income__{commission_type}', 'sum')
+            if has_support:
+                work[f'business_support__{commission_type}'] = work['business_support'].where(is_type)
+                aggregations[f'business_support__{commission_type}'] = (f'business_support__{commission_type}', 'sum')
+
+    facts = work.groupby('county', sort=True).agg(**aggregations).reset_index()
+
+    # Split the per-type columns into the long county x commission_type table
+    per_type = []
+    for commission_type in commission_types:
+        columns = {f'rows__{commission_type}': 'rows', f'commission_income__{commission_type}': 'commission_income',
+                   f'business_support__{commission_type}': 'business_support'}
+        part = facts[['county'] + [col for col in columns if col in facts.columns]].rename(columns=columns)
+        part.insert(1, 'commission_type', commission_type)
+        per_type.append(part[part['rows'] > 0])
+    commission_facts = pd.concat(per_type, ignore_index=True) if per_type else pd.DataFrame(columns=['county', 'commission_type', 'rows', 'commission_income'])
+    facts = facts.drop(columns=[col for col in facts.columns if '__' in col])
+    return facts, commission_facts
+
+
+def facts_paths(data_path, cache_dir=CACHE_DIR):
+    """
+    Parquet paths of the fact tables for the current content of a source file.
+
+    :return: Tuple of (county facts path, commission facts path)
+    """
+    digest = file_fingerprint(data_path, cache_dir)['sha256'][:16]
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    facts_dir = os.path.join(cache_dir, 'county_facts')
+    return (os.path.join(facts_dir, f'{stem}-{digest}.v{FACTS_LAYOUT}.county.parquet'),
+            os.path.join(facts_dir, f'{stem}-{digest}.v{FACTS_LAYOUT}.commission.parquet'))
+
+
+def load_county_facts(data_path, df=None, cache_dir=CACHE_DIR):
+    """
+    Load the fact tables for a source file, building and persisting them if the file changed.
+
+    :param data_path: Path to the county financial data file
+    :param df: Already loaded source rows, used instead of reading the file when the facts must be built
+    :param cache_dir: Directory holding the data cache
+    :return: Dictionary with 'county' and 'commission' fact DataFrames
+    """
+    county_path, commission_path = facts_paths(data_path, cache_dir)
+    if os.path.exists(county_path) and os.path.exists(commission_path):
+        return {'county': pd.read_parquet(county_path), 'commission': pd.read_parquet(commission_path)}
+
+    try:
+        if df is None:
+            df = load_data(data_path)
+        facts, commission_facts = build_county_facts(df[[col for col in FACT_COLUMNS if col in df.columns]])
+    except Exception as e:
+        logging.error(f"Error building county facts for {data_path}: {str(e)}")
+        raise
+
+    os.makedirs(os.path.dirname(county_path), exist_ok=True)
+    # Commission facts first: the county table's presence marks a complete build
+    for table, path in ((commission_facts, commission_path), (facts, county_path)):
+        tmp_path = temp_path(path)
+        table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    logging.info(f"County facts for {len(facts)} counties saved to {county_path}")
+    return {'county': facts, 'commission': commission_facts}
+
+
+def enforcement_court_correlation(facts):
+    """
+    Pearson correlation between enforcement actions and court outcomes, from the stored county moments.
+
+    The counties' centered moments are merged with Chan's parallel update:
+    each county adds its own co-moment plus the spread of its means around
+    the overall means, weighted by its row count.
+
+    :param facts: County facts DataFrame
+    :return: Correlation coefficient, or NaN if it is undefined
+    """
+    facts = facts[facts['corr_n'] > 0]
+    n = facts['corr_n'].to_numpy(dtype=np.float64)
+    mean_x, mean_y = facts['corr_mean_x'].to_numpy(), facts['corr_mean_y'].to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dx = mean_x - np.sum(n * mean_x) / n.sum()
+        dy = mean_y - np.sum(n * mean_y) / n.sum()
+        cov = facts['corr_cxy'].sum() + np.sum(n * dx * dy)
+        var_x = facts['corr_m2_x'].sum() + np.sum(n * dx * dx)
+        var_y = facts['corr_m2_y'].sum() + np.sum(n * dy * dy)
+        return float(cov / np.sqrt(var_x * var_y))
+
+
+def county_tables(facts):
+    """
+    Result tables of the county corruption analysis, read off the fact tables.
+
+    :param facts: Dictionary from load_county_facts
+    :return: Dictionary with salary_stats, total_worth_stats, fees_fines, commissions and enforcement_court_correlation
+    """
+    county = facts['county']
+    stats = ['mean', 'median', 'max']
+    results = {
+        'salary_stats': county[['county'] + [f'salary_{s}' for s in stats]].set_axis(['county'] + stats, axis=1),
+        'total_worth_stats': county[['county'] + [f'total_worth_{s}' for s in stats]].set_axis(['county'] + stats, axis=1),
+        'fees_fines': county[['county', 'fees', 'fines']],
+    }
+    commission = facts['commission']
+    results['commissions'] = (commission[commission['commission_type'].isin(COMMISSION_TYPES)]
+                              .pivot(index='county', columns='commission_type', values='commission_income').fillna(0))
+    if 'corr_n' in county.columns:
+        results['enforcement_court_correlation'] = enforcement_court_correlation(county)
+    return results
+
+
+def local_tables(facts):
+    """
+    Result tables of the hidden corruption analysis that depend only on county aggregates.
+
+    :param facts: Dictionary from load_county_facts
+    :return: Dictionary with fee_fine_vs_service and <type>_commission_analysis tables
+    """
+    county = facts['county']
+    results = {}
+    fee_fine = county[['county', 'fee_fine_total', 'public_service_spending']].set_axis(
+        ['county', 'fee_fine_ratio', 'service_spending'], axis=1)
+    results['fee_fine_vs_service'] = fee_fine.assign(discrepancy=fee_fine['fee_fine_ratio'] - fee_fine['service_spending'])
+
+    commission = facts['commission']
+    for commission_type in COMMISSION_TYPES:
+        subset = commission.loc[commission['commission_type'] == commission_type, ['county', 'commission_income', 'business_support']]
+        results[f'{commission_type.lower()}_commission_analysis'] = subset.assign(
+            support_ratio=subset['business_support'] / subset['commission_income']).reset_index(drop=True)
+    return results
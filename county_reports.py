@@ -0,0 +1,191 @@
+import os
+import re
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from textblob import TextBlob
+from textblob.sentiments import PatternAnalyzer
+
+from data_loader import CACHE_DIR, temp_path
+from county_facts import load_county_facts, COMMISSION_TYPES
+
+# Setting up logging
+logging.basicConfig(filename='county_reports.log', level=logging.INFO,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+REPORT_DIR = 'county_reports'
+REPORT_MANIFEST = os.path.join(CACHE_DIR, 'county_reports_manifest.json')
+# Bump when the report wording changes so every county is regenerated
+TEMPLATE_VERSION = 1
+COUNTIES_PER_TASK = 100
+
+def build_county_summary(county_facts=None, local_facts=None):
+    """
+    Join the county and local fact tables into one row of report inputs per county.
+
+    Percentile ranks against all other counties are computed column-wise, so
+    each report can say how its county compares without rescanning anything.
+
+    :param county_facts: Fact tables of the county financial data, from load_county_facts
+    :param local_facts: Fact tables of the local financial data, from load_county_facts
+    :return: DataFrame indexed by county
+    """
+    parts = []
+    if county_facts is not None:
+        county = county_facts['county'].set_index('county')
+        parts.append(county[['rows', 'salary_mean', 'salary_max', 'total_worth_mean', 'total_worth_max', 'fees', 'fines']])
+        commission = county_facts['commission']
+        income = commission.pivot(index='county', columns='commission_type', values='commission_income')
+        parts.append(income.reindex(columns=COMMISSION_TYPES).add_suffix('_commission_income').rename(columns=str.lower))
+    if local_facts is not None:
+        local = local_facts['county'].set_index('county')
+        parts.append(local[['fee_fine_total', 'public_service_spending']].assign(
+            service_gap=local['fee_fine_total'] - local['public_service_spending']))
+        commission = local_facts['commission']
+        support = commission.assign(support_ratio=commission['business_support'] / commission['commission_income'])
+        ratios = support.pivot(index='county', columns='commission_type', values='support_ratio')
+        parts.append(ratios.reindex(columns=COMMISSION_TYPES).add_suffix('_support_ratio').rename(columns=str.lower))
+
+    summary = pd.concat(parts, axis=1).sort_index()
+    summary = summary.loc[:, ~summary.columns.duplicated()]
+    for col in ('salary_max', 'total_worth_max', 'fees', 'fines', 'service_gap',
+                'liquor_commission_income', 'cannabis_commission_income'):
+        if col in summary.columns:
+            # Rounded to the precision the reports print, so small shifts elsewhere do not mark a county as changed
+            summary[f'{col}_pct'] = summary[col].rank(pct=True).round(2)
+    summary.index.name = 'county'
+    return summary
+
+def _sentence(condition, text):
+    return [text] if condition else []
+
+def compose_county_report(county, row):
+    """
+    Build the narrative of one county from its summary row.
+
+    :param county: County name
+    :param row: Dictionary of the county's summary values
+    :return: Report text without the sentiment line
+    """
+    def has(key):
+        value = row.get(key)
+        return value is not None and not (isinstance(value, float) and np.isnan(value))
+
+    report = [f"Transparency report for {county} county."]
+    report += _sentence(has('salary_max') and has('salary_max_pct'),
+                        f"The highest official salary is ${row.get('salary_max', 0):,.2f} (average ${row.get('salary_mean', 0):,.2f}), "
+                        f"higher than in {row.get('salary_max_pct', 0):.0%} of counties.")
+    report += _sentence(has('total_worth_max') and has('total_worth_max_pct'),
+                        f"The largest reported total worth of an official is ${row.get('total_worth_max', 0):,.2f}, "
+                        f"higher than in {row.get('total_worth_max_pct', 0):.0%} of counties.")
+    report += _sentence(has('fees') and has('fines'),
+                        f"The county collected ${row.get('fees', 0):,.2f} in fees and ${row.get('fines', 0):,.2f} in fines, "
+                        f"ranking above {row.get('fees_pct', 0):.0%} and {row.get('fines_pct', 0):.0%} of counties respectively.")
+    if has('service_gap'):
+        if row['service_gap'] > 0:
+            report.append(f"Fee and fine collection exceeds public service spending by ${row['service_gap']:,.2f}, "
+                          f"a wider gap than in {row.get('service_gap_pct', 0):.0%} of counties, which raises questions about where the funds go.")
+        else:
+            report.append(f"Public service spending exceeds fee and fine collection by ${-row['service_gap']:,.2f}.")
+    for commission_type in COMMISSION_TYPES:
+        key = commission_type.lower()
+        report += _sentence(has(f'{key}_commission_income'),
+                            f"The {key} commission brought in ${row.get(f'{key}_commission_income', 0):,.2f}.")
+        if has(f'{key}_support_ratio'):
+            report.append(f"For every dollar of {key} commission income, ${row[f'{key}_support_ratio']:.2f} was returned to local businesses.")
+    return "\n\n".join(report)
+
+_analyzer = None
+
+def _init_worker():
+    # One sentiment analyzer per worker process, reused for every county it renders
+    global _analyzer
+    _analyzer = PatternAnalyzer()
+    _analyzer.analyze("warm up")
+
+def _render_counties(items, output_dir):
+    if _analyzer is None:
+        _init_worker()
+    written = []
+    for county, row in items:
+        text = compose_county_report(county, row)
+        sentiment = TextBlob(text, analyzer=_analyzer).sentiment.polarity
+        sentiment_text = "concerned" if sentiment < 0 else "neutral" if sentiment == 0 else "optimistic"
+        text += f"\n\nSentiment of this report: {sentiment_text}"
+        path = os.path.join(output_dir, report_file_name(county))
+        with open(path, 'w') as file:
+            file.write(text)
+        written.append(county)
+    return written
+
+def report_file_name(county):
+    """
+    File name of a county's report, safe for any county name.
+    """
+    return re.sub(r'[^\w.-]+', '_', str(county)) + '.txt'
+
+def _row_hashes(summary):
+    hashes = pd.util.hash_pandas_object(summary, index=True)
+    return {str(county): f'{TEMPLATE_VERSION}:{value}' for county, value in hashes.items()}
+
+def generate_county_reports(summary, output_dir=REPORT_DIR, n_workers=None, manifest_path=REPORT_MANIFEST):
+    """
+    Write one report per county, rendering in a process pool and skipping unchanged counties.
+
+    A county is regenerated when its summary row, or the report template,
+    changed since the last run, or when its report file is missing.
+
+    :param summary: DataFrame from build_county_summary
+    :param output_dir: Directory for the per-county report files
+    :param n_workers: Number of worker processes; defaults to one per CPU
+    :param manifest_path: JSON file recording the summary row hash of every written report
+    :return: List of counties whose report was written
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    hashes = _row_hashes(summary)
+    changed = [county for county in summary.index
+               if manifest.get(str(county)) != hashes[str(county)]
+               or not os.path.exists(os.path.join(output_dir, report_file_name(county)))]
+    rows = summary.loc[changed].to_dict(orient='index')
+    items = list(rows.items())
+    tasks = [items[i:i + COUNTIES_PER_TASK] for i in range(0, len(items), COUNTIES_PER_TASK)]
+
+    written = []
+    try:
+        if len(tasks) <= 1 or n_workers == 1:
+            for task in tasks:
+                written += _render_counties(task, output_dir)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as executor:
+                for result in executor.map(_render_counties, tasks, [output_dir] * len(tasks)):
+                    written += result
+    except Exception as e:
+        logging.error(f"Error generating county reports: {str(e)}")
+        raise
+
+    manifest.update({str(county): hashes[str(county)] for county in written})
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    tmp_path = temp_path(manifest_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    logging.info(f"Wrote {len(written)} county reports, {len(summary) - len(written)} unchanged")
+    return written
+
+def main():
+    county_facts = load_county_facts('county_financial_data.csv')
+    local_facts = load_county_facts('local_financial_data.csv')
+    summary = build_county_summary(county_facts, local_facts)
+    generate_county_reports(summary)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import glob
+import logging
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+# Shared ingestion for every analysis stage. Each CSV is parsed once with an
+# explicit schema and converted to a Parquet cache; stages then read only the
+# columns they need from that cache instead of re-parsing the CSV.
+
+CACHE_DIR = 'data_cache'
+
+SPENDING_SCHEMA = {
+    'transaction_id': pa.int64(),
+    'date': pa.timestamp('s'),
+    'department': pa.string(),
+    'category': pa.string(),
+    'vendor': pa.string(),
+    'amount': pa.float64(),
+    'transaction_count': pa.float64(),
+    'description': pa.string(),
+    'fraud_flag': pa.int8(),
+}
+
+COUNTY_SCHEMA = {
+    'county': pa.string(),
+    'salary': pa.float64(),
+    'total_worth': pa.float64(),
+    'fees': pa.float64(),
+    'fines': pa.float64(),
+    'commission_type': pa.string(),
+    'commission_income': pa.float64(),
+    'enforcement_actions': pa.float64(),
+    'court_outcomes': pa.float64(),
+}
+
+LOCAL_FINANCIAL_SCHEMA = {
+    'county': pa.string(),
+    'salary': pa.float64(),
+    'total_worth': pa.float64(),
+    'fees': pa.float64(),
+    'fines': pa.float64(),
+    'public_service_spending': pa.float64(),
+    'business_grants': pa.float64(),
+    'business_loans': pa.float64(),
+    'commission_type': pa.string(),
+    'commission_income': pa.float64(),
+}
+
+SCHEMAS = {
+    'spending': SPENDING_SCHEMA,
+    'county': COUNTY_SCHEMA,
+    'local_financial': LOCAL_FINANCIAL_SCHEMA,
+}
+
+# Default dataset for the file names used throughout the scripts
+DATASET_FILES = {
+    'government_spending_data.csv': 'spending',
+    'county_financial_data.csv': 'county',
+    'local_financial_data.csv': 'local_financial',
+}
+
+_MANIFEST_FILE = 'manifest.json'
+_HASH_BLOCK_SIZE = 1 << 20
+# Prefix length hashed to detect a watermarked file being replaced rather than appended to
+_HEAD_LENGTH = 65536
+
+
+def temp_path(path):
+    """
+    Unique temporary file next to path, for writing a file that is then moved into place with os.replace.
+
+    Concurrent writers each get their own temporary file, so none of them can
+    move another's half-written file into place.
+
+    :param path: Final path of the file being written
+    :return: Path of the created, empty temporary file
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    return tmp_path
+
+
+def _read_manifest(cache_dir):
+    path = os.path.join(cache_dir, _MANIFEST_FILE)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, _MANIFEST_FILE)
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _content_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(file_path, cache_dir=CACHE_DIR):
+    """
+    Fingerprint a source file by size, mtime and content hash.
+
+    The content hash is only recomputed when the size or mtime recorded in the
+    cache manifest no longer match the file on disk.
+
+    :param file_path: Path to the source file
+    :param cache_dir: Directory holding the cache manifest
+    :return: Dictionary with 'size', 'mtime' and 'sha256'
+    """
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    manifest = _read_manifest(cache_dir)
+    entry = manifest.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+        return entry
+
+    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': _content_hash(file_path)}
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _read_manifest(cache_dir)
+    manifest[key] = entry
+    _write_manifest(cache_dir, manifest)
+    return entry
+
+
+def resolve_schema(file_path, dataset=None):
+    """
+    Resolve the explicit schema for a source file.
+
+    :param file_path: Path to the CSV file
+    :param dataset: 'spending', 'county' or 'local_financial'; inferred from the file name if omitted
+    :return: Dictionary mapping column names to Arrow types, or None if unknown
+    """
+    if dataset is None:
+        dataset = DATASET_FILES.get(os.path.basename(file_path))
+    if dataset is None:
+        return None
+    return SCHEMAS[dataset]
+
+
+def cache_path(file_path, cache_dir=CACHE_DIR):
+    """
+    Return the Parquet cache path for the current contents of a CSV file.
+
+    :param file_path: Path to the CSV file
+    :param cache_dir: Directory holding the Parquet cache
+    :return: Path of the cached Parquet file
+    """
+    fingerprint = file_fingerprint(file_path, cache_dir)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{fingerprint['sha256'][:16]}.parquet")
+
+
+def convert_to_parquet(file_path, output_path, schema=None, block_size=64 << 20):
+    """
+    Stream a CSV file into a Parquet file using an explicit column schema.
+
+    :param file_path: Path to the CSV file
+    :param output_path: Path of the Parquet file to write
+    :param schema: Dictionary mapping column names to Arrow types
+    :param block_size: Number of bytes parsed per CSV block
+    """
+    read_options = pv.ReadOptions(block_size=block_size)
+    convert_options = pv.ConvertOptions(column_types=schema or {})
+    tmp_path = temp_path(output_path)
+    try:
+        reader = pv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+        with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        os.replace(tmp_path, output_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def ensure_cached(file_path, dataset=None, cache_dir=CACHE_DIR):
+    """
+    Convert a CSV file to its Parquet cache if the cache is missing or stale.
+
+    :param file_path: Path to the CSV file
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param cache_dir: Directory holding the Parquet cache
+    :return: Path of the cached Parquet file
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    parquet_path = cache_path(file_path, cache_dir)
+    if not os.path.exists(parquet_path):
+        convert_to_parquet(file_path, parquet_path, resolve_schema(file_path, dataset))
+        logging.info(f"Converted {file_path} to columnar cache {parquet_path}")
+        # Caches of earlier contents of the same file are superseded
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        for old_path in glob.glob(os.path.join(cache_dir, f'{glob.escape(stem)}-' + '?' * 16 + '.parquet')):
+            if old_path != parquet_path:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+    return parquet_path
+
+
+def load_data(file_path, columns=None, dataset=None, cache_dir=CACHE_DIR):
+    """
+    Load data from a CSV file into a pandas DataFrame through the Parquet cache.
+
+    :param file_path: Path to the CSV file
+    :param columns: Columns to load; all columns if omitted
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param cache_dir: Directory holding the Parquet cache
+    :return: pandas DataFrame
+    """
+    try:
+        parquet_path = ensure_cached(file_path, dataset, cache_dir)
+        data = pq.read_table(parquet_path, columns=columns).to_pandas()
+        logging.info(f"Data loaded successfully from {file_path}")
+        return data
+    except Exception as e:
+        logging.error(f"Failed to load data: {str(e)}")
+        raise
+
+
+def iter_batches(file_path, columns=None, batch_size=100_000, dataset=None, cache_dir=CACHE_DIR):
+    """
+    Stream a CSV file's cached columns in fixed-size batches with bounded memory.
+
+    :param file_path: Path to the CSV file
+    :param columns: Columns to load; all columns if omitted
+    :param batch_size: Number of rows per batch
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param cache_dir: Directory holding the Parquet cache
+    :return: Iterator of pandas DataFrames
+    """
+    parquet_file = pq.ParquetFile(ensure_cached(file_path, dataset, cache_dir))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def _allocate_strata(counts, sample_size, min_per_stratum=100):
+    """
+    Split a sample budget over strata in proportion to their size.
+
+    Strata whose proportional share is below min_per_stratum get that minimum
+    (or all of their rows); the rest of the budget goes to the other strata in
+    proportion, rounded by largest remainder so the quotas add up exactly.
+
+    :param counts: pandas Series of row counts per stratum
+    :param sample_size: Target number of sampled rows
+    :param min_per_stratum: Minimum number of rows per stratum
+    :return: pandas Series of rows to sample per stratum; sums to sample_size unless the minimums need more
+    """
+    counts = counts.astype(np.int64)
+    if counts.sum() <= sample_size:
+        return counts
+    floors = np.minimum(counts, min_per_stratum)
+    boosted = pd.Series(False, index=counts.index)
+    while True:
+        free = ~boosted
+        budget = max(sample_size - int(floors[boosted].sum()), 0)
+        share = counts[free] * budget / max(int(counts[free].sum()), 1)
+        below = share < floors[free]
+        if not below.any():
+            break
+        boosted[below[below].index] = True
+    quota = floors.where(boosted, 0)
+    allocated = np.floor(share).astype(np.int64)
+    # Hand the rows lost to rounding down to the largest remainders
+    extra = budget - int(allocated.sum())
+    if extra > 0:
+        order = np.argsort(-(share - allocated).to_numpy(), kind='stable')[:extra]
+        allocated.iloc[order] += 1
+    quota[free] = np.minimum(allocated, counts[free])
+    return quota.astype(np.int64)
+
+
+def stratified_sample(file_path, columns, stratify, sample_size=100_000, min_per_stratum=100, batch_size=100_000,
+                      seed=42, dataset=None, cache_dir=CACHE_DIR):
+    """
+    Draw a bounded stratified random sample in two streaming passes.
+
+    The first pass reads only the stratify column to count the strata, which
+    fixes every stratum's quota (see _allocate_strata). The second pass gives
+    each row a random key and keeps, per stratum, the quota smallest keys seen
+    so far: a uniform sample of the stratum's rows. Memory stays bounded by
+    the sample itself plus one batch.
+
+    :param file_path: Path to the CSV file
+    :param columns: Columns to load; the stratify column is added if missing
+    :param stratify: Column whose values define the strata
+    :param sample_size: Target number of sampled rows
+    :param min_per_stratum: Minimum number of rows kept per stratum
+    :param batch_size: Number of rows per batch
+    :param seed: Seed for the random keys
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param cache_dir: Directory holding the Parquet cache
+    :return: Tuple of (sampled DataFrame, pandas Series of row counts per stratum)
+    """
+    columns = list(dict.fromkeys(list(columns) + [stratify]))
+    counts = pd.Series(dtype=np.int64)
+    for batch in iter_batches(file_path, [stratify], batch_size, dataset, cache_dir):
+        counts = counts.add(batch[stratify].value_counts(dropna=False), fill_value=0)
+    counts = counts.astype(np.int64)
+    if counts.empty:
+        return pd.DataFrame(columns=columns), counts
+    quota = _allocate_strata(counts, sample_size, min_per_stratum)
+
+    rng = np.random.default_rng(seed)
+    reservoir = None
+    for batch in iter_batches(file_path, columns, batch_size, dataset, cache_dir):
+        batch = batch.assign(_key=rng.random(len(batch)))
+        merged = batch if reservoir is None else pd.concat([reservoir, batch], ignore_index=True)
+        limit = quota.to_numpy()[quota.index.get_indexer(merged[stratify])]
+        rank = merged.groupby(stratify, dropna=False, sort=False)['_key'].rank(method='first')
+        reservoir = merged[rank.to_numpy() <= limit]
+    sample = reservoir.drop(columns='_key').reset_index(drop=True)
+    logging.info(f"Stratified sample of {len(sample)} rows drawn from {int(counts.sum())} rows of {file_path}")
+    return sample, counts
+
+
+def _record_ends(block):
+    """
+    Offsets just past every CSV record terminator in a block that starts at a record boundary.
+
+    A newline ends a record only outside quotes, i.e. where an even number of
+    quote characters precede it; escaped quotes ("") keep the parity.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    outside_quotes = np.cumsum(data == ord('"')) % 2 == 0
+    return np.flatnonzero((data == ord('\n')) & outside_quotes) + 1
+
+
+def _watermark_path(state_name, cache_dir):
+    return os.path.join(cache_dir, 'watermarks', f'{state_name}.json')
+
+
+def _head_hash(file_path, length):
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read(length)).hexdigest()
+
+
+def read_watermark(state_name, cache_dir=CACHE_DIR):
+    """
+    Read a persisted watermark.
+
+    :param state_name: Name of the consumer owning the watermark
+    :param cache_dir: Directory holding the watermarks
+    :return: Watermark dictionary, or None if the consumer has not run yet
+    """
+    try:
+        with open(_watermark_path(state_name, cache_dir), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def commit_watermark(state_name, watermark, cache_dir=CACHE_DIR):
+    """
+    Atomically persist a watermark once the rows before it have been processed.
+
+    :param state_name: Name of the consumer owning the watermark
+    :param watermark: Watermark dictionary returned by iter_appended_rows
+    :param cache_dir: Directory holding the watermarks
+    """
+    path = _watermark_path(state_name, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def reset_watermark(state_name, cache_dir=CACHE_DIR):
+    """
+    Forget a consumer's watermark, so its next read starts from the beginning of the file.
+
+    :param state_name: Name of the consumer owning the watermark
+    :param cache_dir: Directory holding the watermarks
+    """
+    try:
+        os.remove(_watermark_path(state_name, cache_dir))
+    except FileNotFoundError:
+        pass
+
+
+def iter_appended_rows(file_path, state_name, dataset=None, block_size=64 << 20, cache_dir=CACHE_DIR):
+    """
+    Yield rows appended to a CSV file since the consumer's last committed watermark.
+
+    The watermark records the byte offset of the last complete record read, so
+    each call only parses new data. If the file was replaced or truncated the
+    watermark is reset and the whole file is read again as a new generation:
+    row indices restart at 0, and the watermark's 'generation' changes.
+
+    :param file_path: Path to the CSV file
+    :param state_name: Name of the consumer owning the watermark
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param block_size: Maximum number of bytes parsed per yielded batch
+    :param cache_dir: Directory holding the watermarks
+    :return: Iterator of (DataFrame, watermark); commit each watermark after processing its batch
+    """
+    schema = resolve_schema(file_path, dataset) or {}
+    size = os.path.getsize(file_path)
+    watermark = read_watermark(state_name, cache_dir)
+    if (watermark is None or watermark['file'] != os.path.abspath(file_path) or watermark['offset'] > size
+            or watermark['head_hash'] != _head_hash(file_path, min(watermark['offset'], _HEAD_LENGTH))):
+        if watermark is not None:
+            logging.warning(f"Watermark for {state_name} no longer matches {file_path}; rescanning from the start")
+        watermark = None
+    elif 'generation' not in watermark:
+        # Watermarks written before generations were tracked
+        watermark['generation'] = ''
+
+    with open(file_path, 'rb') as f:
+        if watermark is None:
+            head = b''
+            while True:
+                chunk = f.read(_HEAD_LENGTH)
+                head += chunk
+                ends = _record_ends(head)
+                if len(ends) or not chunk:
+                    break
+            header_length = int(ends[0]) if len(ends) else len(head)
+            header = next(csv.reader(io.StringIO(head[:header_length].decode('utf-8-sig'))))
+            # A new generation of the file: record indices restart at 0, so consumers key on both
+            watermark = {'file': os.path.abspath(file_path), 'header': header,
+                         'offset': header_length, 'rows': 0, 'generation': uuid.uuid4().hex,
+                         'head_hash': _head_hash(file_path, header_length)}
+        f.seek(watermark['offset'])
+        remainder = b''
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            # Only parse complete records; a partially written last record waits for the next run
+            ends = _record_ends(block)
+            end = int(ends[-1]) if len(ends) else 0
+            block, remainder = block[:end], block[end:]
+            if not block:
+                continue
+            table = pv.read_csv(io.BytesIO(block),
+                                read_options=pv.ReadOptions(column_names=watermark['header']),
+                                parse_options=pv.ParseOptions(newlines_in_values=True),
+                                convert_options=pv.ConvertOptions(column_types=schema))
+            batch = table.to_pandas()
+            batch.index = pd.RangeIndex(watermark['rows'], watermark['rows'] + len(batch))
+            offset = watermark['offset'] + len(block)
+            watermark = dict(watermark, offset=offset, rows=watermark['rows'] + len(batch),
+                             head_hash=_head_hash(file_path, min(offset, _HEAD_LENGTH)))
+            yield batch, watermark
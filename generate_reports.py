@@ -1,28 +1,14 @@
-import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime
 import os
 import logging
 
+from data_loader import load_data
+from chart_rendering import render_chart
+
 # Setting up logging
 logging.basicConfig(filename='reports.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
-
 def generate_fraud_report(df, output_dir):
     """
     Generate a detailed report on fraud detection.
@@ -38,15 +24,9 @@ def generate_fraud_report(df, output_dir):
     fraud_summary.to_csv(os.path.join(output_dir, 'fraud_summary.csv'), index=False)
     
     # Visual fraud report
-    plt.figure(figsize=(12, 6))
-    plt.bar(fraud_summary['department'], fraud_summary['fraud_count'])
-    plt.title('Fraudulent Cases by Department')
-    plt.xlabel('Department')
-    plt.ylabel('Number of Fraudulent Cases')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, 'fraud_distribution.png'))
-    plt.close()
+    render_chart('bar', os.path.join(output_dir, 'fraud_distribution.png'), fraud_summary,
+                 x='department', y='fraud_count', title='Fraudulent Cases by Department',
+                 xlabel='Department', ylabel='Number of Fraudulent Cases', rotation=45, tight_layout=True)
     
     logging.info(f"Fraud report generated and saved to {output_dir}")
 
@@ -64,17 +44,14 @@ def generate_waste_report(df, output_dir):
     waste_by_category.to_csv(os.path.join(output_dir, 'waste_by_category.csv'), index=False)
     
     # Visual waste report
-    plt.figure(figsize=(12, 6))
-    plt.pie(waste_by_category['amount'], labels=waste_by_category['category'], autopct='%1.1f%%')
-    plt.title('Distribution of Waste by Category')
-    plt.savefig(os.path.join(output_dir, 'waste_pie_chart.png'))
-    plt.close()
+    render_chart('pie', os.path.join(output_dir, 'waste_pie_chart.png'), waste_by_category,
+                 values='amount', labels='category', title='Distribution of Waste by Category')
     
     logging.info(f"Waste report generated and saved to {output_dir}")
 
 def main():
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
+    df = load_data(data_path, columns=['department', 'category', 'amount', 'fraud_flag'])
     report_dir = 'reports_' + datetime.now().strftime("%Y%m%d_%H%M%S")
     
     generate_fraud_report(df, report_dir)
@@ -0,0 +1,376 @@
+import json
+import os
+import fcntl
+import logging
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from collusion_detection import detect_collusion
+from data_loader import CACHE_DIR, iter_appended_rows, read_watermark, commit_watermark, reset_watermark, temp_path
+from network_analysis import build_edge_table, compute_betweenness, draw_network, log_top_nodes
+
+# Setting up logging
+logging.basicConfig(filename='graph_store.log', level=logging.INFO,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+# On-disk transaction graph kept up to date across daily runs. The graph is
+# stored as an aggregated department-vendor edge table plus a node table with
+# degree, connected component and betweenness. Each run applies only the rows
+# appended since the last run, recomputes betweenness only for the components
+# those rows touched and rewrites only the partition files that changed.
+
+GRAPH_STORE_DIR = os.path.join(CACHE_DIR, 'graph_store')
+# Components up to this size get exact betweenness, larger ones are sampled
+EXACT_BETWEENNESS_MAX_NODES = 2000
+# Number of files each table is split into; a run rewrites only the ones it changed
+GRAPH_PARTITIONS = 16
+
+_EDGE_AGGREGATIONS = {
+    'total_amount': 'sum',
+    'transaction_count': 'sum',
+    'max_amount': 'max',
+    'first_date': 'min',
+    'last_date': 'max',
+}
+
+
+def _empty_store():
+    return {
+        'edges': pd.DataFrame({**{col: pd.Series(dtype=object) for col in ['department', 'vendor']},
+                               **{col: pd.Series(dtype=object) for col in _EDGE_AGGREGATIONS},
+                               'partition': pd.Series(dtype=np.int64)}),
+        'nodes': pd.DataFrame({'kind': pd.Series(dtype=object), 'degree': pd.Series(dtype=np.int64),
+                               'component': pd.Series(dtype=np.int64), 'betweenness_raw': pd.Series(dtype=np.float64),
+                               'betweenness_error': pd.Series(dtype=np.float64), 'partition': pd.Series(dtype=np.int64)},
+                              index=pd.Index([], name='node', dtype=object)),
+        'meta': {'version': 0, 'watermark': None, 'edge_parts': {}, 'node_parts': {}, 'retired': []},
+        # Partitions changed since the last save; a fresh store rewrites every partition
+        'dirty': {'edges': set(range(GRAPH_PARTITIONS)), 'nodes': set(range(GRAPH_PARTITIONS))},
+    }
+
+
+def _partition(values):
+    # Stable across runs and processes, unlike Python's salted hash()
+    return (pd.util.hash_array(np.asarray(values, dtype=object)) % GRAPH_PARTITIONS).astype(np.int64)
+
+
+def load_graph_store(store_dir=GRAPH_STORE_DIR):
+    """
+    Load the persisted graph store.
+
+    :param store_dir: Directory holding the graph store
+    :return: Dictionary with 'edges' and 'nodes' DataFrames and 'meta'; empty if nothing was stored yet
+    """
+    try:
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty_store()
+    store = _empty_store()
+    if 'edges_file' in meta:
+        # Single-file store from before partitioning: every partition is written on the next save
+        edges = pd.read_parquet(os.path.join(store_dir, meta['edges_file']))
+        nodes = pd.read_parquet(os.path.join(store_dir, meta['nodes_file']))
+        edges['partition'] = _partition(edges['vendor'])
+        nodes['partition'] = _partition(nodes.index)
+        meta = dict(meta, edge_parts={}, node_parts={}, retired=[meta.pop('edges_file'), meta.pop('nodes_file')])
+    else:
+        edge_parts = [pd.read_parquet(os.path.join(store_dir, name)) for name in meta['edge_parts'].values()]
+        node_parts = [pd.read_parquet(os.path.join(store_dir, name)) for name in meta['node_parts'].values()]
+        edges = pd.concat(edge_parts, ignore_index=True) if edge_parts else store['edges']
+        nodes = pd.concat(node_parts) if node_parts else store['nodes']
+        store['dirty'] = {'edges': set(), 'nodes': set()}
+    return dict(store, edges=edges, nodes=nodes, meta=meta)
+
+
+def save_graph_store(store, store_dir=GRAPH_STORE_DIR):
+    """
+    Persist the partitions of the graph store changed since the last save.
+
+    Edges are partitioned by vendor and nodes by name, and each saved version
+    writes new files only for its dirty partitions. meta.json is replaced last,
+    so a crash never leaves a mixed version; the files it replaced are kept
+    until the next save for readers still loading the previous version.
+
+    :param store: Graph store dictionary
+    :param store_dir: Directory holding the graph store
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    meta = dict(store['meta'])
+    meta['version'] = meta.get('version', 0) + 1
+    meta['edge_parts'], meta['node_parts'] = dict(meta.get('edge_parts', {})), dict(meta.get('node_parts', {}))
+    expired, retired = meta.get('retired', []), []
+    for table, parts, index in [('edges', meta['edge_parts'], False), ('nodes', meta['node_parts'], True)]:
+        frame = store[table]
+        for part in sorted(store['dirty'][table]):
+            name = f"{table}-{meta['version']}-{part}.parquet"
+            frame[frame['partition'].to_numpy() == part].to_parquet(os.path.join(store_dir, name), index=index)
+            if str(part) in parts:
+                retired.append(parts[str(part)])
+            parts[str(part)] = name
+    meta['retired'] = retired
+    meta_path = os.path.join(store_dir, 'meta.json')
+    tmp_path = temp_path(meta_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2, default=str)
+    os.replace(tmp_path, meta_path)
+    for name in expired:
+        try:
+            os.remove(os.path.join(store_dir, name))
+        except FileNotFoundError:
+            pass
+    logging.info(f"Graph store version {meta['version']} wrote {len(store['dirty']['edges'])} edge and "
+                 f"{len(store['dirty']['nodes'])} node partitions")
+    store['meta'] = meta
+    store['dirty'] = {'edges': set(), 'nodes': set()}
+
+
+def _edge_positions(store):
+    # Row position of every stored department-vendor pair, kept up to date by apply_delta
+    if 'positions' not in store:
+        edges = store['edges']
+        store['positions'] = dict(zip(zip(edges['department'], edges['vendor']), range(len(edges))))
+    return store['positions']
+
+
+def apply_delta(store, batch):
+    """
+    Fold a batch of new transactions into the stored edge aggregates, degrees and components.
+
+    Only the pairs in the batch are touched: existing pairs are looked up by key
+    and updated in place, new pairs are appended.
+
+    :param store: Graph store dictionary, updated in place
+    :param batch: DataFrame of new transactions
+    :return: Set of component ids whose structure changed
+    """
+    key = ['department', 'vendor']
+    delta = build_edge_table(batch)
+    if delta.empty:
+        return set()
+    delta[key] = delta[key].astype(object)
+    delta['partition'] = _partition(delta['vendor'])
+    edges = store['edges']
+    positions = _edge_positions(store)
+    aggregations = {col: agg for col, agg in _EDGE_AGGREGATIONS.items() if col in delta.columns}
+    rows = np.fromiter((positions.get(pair, -1) for pair in zip(delta['department'], delta['vendor'])),
+                       dtype=np.int64, count=len(delta))
+    is_new = rows < 0
+    if not is_new.all():
+        existing = rows[~is_new]
+        current = edges.iloc[existing][list(aggregations)].reset_index(drop=True)
+        update = delta.loc[~is_new, list(aggregations)].reset_index(drop=True)
+        merged = pd.concat([current, update]).groupby(level=0).agg(aggregations)
+        for col in aggregations:
+            edges.iloc[existing, edges.columns.get_loc(col)] = merged[col].to_numpy()
+    new_pairs = delta.loc[is_new, key]
+    if len(new_pairs):
+        positions.update(zip(zip(new_pairs['department'], new_pairs['vendor']), range(len(edges), len(edges) + len(new_pairs))))
+        edges = pd.concat([edges, delta[is_new]], ignore_index=True) if len(edges) else delta[is_new].reset_index(drop=True)
+    store['edges'] = edges
+    store['dirty']['edges'].update(delta['partition'].unique().tolist())
+    if new_pairs.empty:
+        return set()
+
+    # Degrees only change for endpoints of department-vendor pairs not seen before
+    nodes = store['nodes']
+    endpoints = pd.concat([
+        pd.DataFrame({'node': new_pairs['department'], 'kind': 'department'}),
+        pd.DataFrame({'node': new_pairs['vendor'], 'kind': 'vendor'}),
+    ], ignore_index=True)
+    increments = endpoints.groupby('node', sort=False).agg(kind=('kind', 'first'), degree=('kind', 'size'))
+    added = increments.index.difference(nodes.index)
+    if len(added):
+        next_component = int(nodes['component'].max()) + 1 if len(nodes) else 0
+        nodes = pd.concat([nodes, pd.DataFrame({
+            'kind': increments.loc[added, 'kind'],
+            'degree': np.zeros(len(added), dtype=np.int64),
+            'component': np.arange(next_component, next_component + len(added), dtype=np.int64),
+            'betweenness_raw': 0.0,
+            'betweenness_error': 0.0,
+            'partition': _partition(added),
+        }, index=added.rename('node'))])
+    nodes.loc[increments.index, 'degree'] += increments['degree'].to_numpy()
+
+    # Merge the components joined by the new edges (union-find over component ids)
+    joins = nx.Graph()
+    joins.add_edges_from(zip(nodes.loc[new_pairs['department'], 'component'].to_numpy(),
+                             nodes.loc[new_pairs['vendor'], 'component'].to_numpy()))
+    relabel = {}
+    for group in nx.connected_components(joins):
+        target = min(group)
+        relabel.update({component: target for component in group})
+    mask = nodes['component'].isin(list(relabel))
+    nodes.loc[mask, 'component'] = nodes.loc[mask, 'component'].map(relabel)
+    store['dirty']['nodes'].update(nodes.loc[mask | nodes.index.isin(increments.index), 'partition'].unique().tolist())
+    store['nodes'] = nodes
+    return set(relabel.values())
+
+
+def recompute_betweenness(store, components, epsilon=0.05, n_workers=None):
+    """
+    Recompute betweenness for the given components only.
+
+    Betweenness never crosses components, so each component is solved on its own
+    and stored unnormalized; normalization to the full graph happens on read.
+
+    :param store: Graph store dictionary, updated in place
+    :param components: Component ids to recompute
+    :param epsilon: Target betweenness error for components too large for the exact computation
+    :param n_workers: Number of worker processes for betweenness
+    """
+    nodes, edges = store['nodes'], store['edges']
+    edge_components = nodes['component'].reindex(edges['department']).to_numpy()
+    dirty = edges[np.isin(edge_components, list(components))]
+    for component, component_edges in dirty.groupby(edge_components[np.isin(edge_components, list(components))]):
+        G = nx.from_pandas_edgelist(component_edges, 'department', 'vendor')
+        n = G.number_of_nodes()
+        mode = 'exact' if n <= EXACT_BETWEENNESS_MAX_NODES else 'approximate'
+        betweenness, error_bound = compute_betweenness(G, mode=mode, epsilon=epsilon, n_workers=n_workers)
+        # Back to unnormalized pair counts so scores stay comparable once the graph grows
+        scale = (n - 1) * (n - 2) / 2
+        nodes.loc[list(betweenness), 'betweenness_raw'] = np.fromiter(betweenness.values(), dtype=np.float64) * scale
+        nodes.loc[list(betweenness), 'betweenness_error'] = error_bound * scale
+        store['dirty']['nodes'].update(nodes.loc[list(betweenness), 'partition'].unique().tolist())
+    logging.info(f"Betweenness recomputed for {len(components)} changed components")
+
+
+def degree_centrality(store):
+    """
+    Degree centrality of every stored node.
+
+    :return: pandas Series indexed by node
+    """
+    n = len(store['nodes'])
+    return store['nodes']['degree'] / (n - 1) if n > 1 else store['nodes']['degree'] * 0.0
+
+
+def betweenness_centrality(store):
+    """
+    Normalized betweenness centrality of every stored node, with the largest error bound.
+
+    :return: Tuple of (pandas Series indexed by node, error bound)
+    """
+    n = len(store['nodes'])
+    scale = 2 / ((n - 1) * (n - 2)) if n > 2 else 0.0
+    return store['nodes']['betweenness_raw'] * scale, float(store['nodes']['betweenness_error'].max() * scale) if n else 0.0
+
+
+def build_graph_store(df, epsilon=0.05, n_workers=None):
+    """
+    Build an in-memory graph store from already loaded transactions, without touching the persisted one.
+
+    :param df: DataFrame with department, vendor, amount and optionally date columns
+    :param epsilon: Target betweenness error for large components
+    :param n_workers: Number of worker processes for betweenness
+    :return: Graph store dictionary
+    """
+    store = _empty_store()
+    apply_delta(store, df)
+    if len(store['nodes']):
+        recompute_betweenness(store, set(store['nodes']['component'].unique()), epsilon=epsilon, n_workers=n_workers)
+    return store
+
+
+def update_graph_store(data_path, store_dir=GRAPH_STORE_DIR, state_name='graph_store', epsilon=0.05, n_workers=None):
+    """
+    Apply the transactions appended since the last run to the graph store.
+
+    :param data_path: Path to the transaction data file
+    :param store_dir: Directory holding the graph store
+    :param state_name: Name of the persisted watermark
+    :param epsilon: Target betweenness error for large components
+    :param n_workers: Number of worker processes for betweenness
+    :return: Updated graph store dictionary
+    """
+    # Updates are serialized across processes, so their partition and meta writes never interleave
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return _update_graph_store(data_path, store_dir, state_name, epsilon, n_workers)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_graph_store(data_path, store_dir, state_name, epsilon, n_workers):
+    store = load_graph_store(store_dir)
+    # The store records the watermark it includes; catch up if the last run stopped before committing it
+    stored_watermark = store['meta'].get('watermark')
+    watermark = read_watermark(state_name)
+    if stored_watermark and (watermark is None or stored_watermark['offset'] > watermark['offset']):
+        commit_watermark(state_name, stored_watermark)
+    elif not stored_watermark and watermark is not None:
+        # No store holds the rows before the watermark (e.g. the store directory was removed): start over
+        reset_watermark(state_name)
+
+    changed = set()
+    last_watermark = None
+    for batch, last_watermark in iter_appended_rows(data_path, state_name):
+        if len(batch) and batch.index[0] == 0 and not store['edges'].empty:
+            # The data file was replaced, so the stored graph no longer describes it
+            logging.warning(f"{data_path} was rewritten; rebuilding the graph store from scratch")
+            store = dict(_empty_store(), meta=store['meta'])
+            changed = set()
+        changed |= apply_delta(store, batch)
+    if last_watermark is None:
+        logging.info("Graph store is up to date")
+        return store
+
+    changed &= set(store['nodes']['component'].unique())
+    if changed:
+        recompute_betweenness(store, changed, epsilon=epsilon, n_workers=n_workers)
+    store['meta']['watermark'] = last_watermark
+    save_graph_store(store, store_dir)
+    commit_watermark(state_name, last_watermark)
+    logging.info(f"Graph store updated to {len(store['nodes'])} nodes and {len(store['edges'])} edges")
+    return store
+
+
+def render_subgraph(store, top_n=10, max_nodes=200):
+    """
+    Build a small NetworkX graph around the highest-degree nodes straight from the edge table.
+
+    :param store: Graph store dictionary
+    :param top_n: Number of highest-degree nodes to start from
+    :param max_nodes: Maximum number of nodes in the subgraph
+    :return: NetworkX graph object
+    """
+    edges = store['edges']
+    top = store['nodes']['degree'].nlargest(top_n).index
+    around = edges[edges['department'].isin(top) | edges['vendor'].isin(top)].nlargest(len(edges), 'total_amount')
+    selected = list(top)
+    for node in pd.unique(around[['department', 'vendor']].to_numpy().ravel()):
+        if len(selected) >= max_nodes:
+            break
+        if node not in set(top):
+            selected.append(node)
+    sub_edges = edges[edges['department'].isin(selected) & edges['vendor'].isin(selected)]
+    return nx.from_pandas_edgelist(sub_edges, 'department', 'vendor')
+
+
+def analyze_graph_store(store, max_render_nodes=200):
+    """
+    Report the stored network metrics and draw a bounded view of the network.
+
+    :param store: Graph store dictionary
+    :param max_render_nodes: Maximum number of nodes drawn in the network plot
+    """
+    degree = degree_centrality(store)
+    betweenness, error_bound = betweenness_centrality(store)
+    H = render_subgraph(store, max_nodes=max_render_nodes)
+    draw_network(H, degree.reindex(list(H)).to_dict(), max_nodes=max_render_nodes)
+    log_top_nodes(degree.to_dict(), betweenness.to_dict(), error_bound)
+
+
+def main():
+    data_path = 'government_spending_data.csv'
+    store = update_graph_store(data_path)
+    analyze_graph_store(store)
+    detect_collusion(store['edges'])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,93 +1,188 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.stats import zscore
 import logging
 from datetime import datetime
 
+from data_loader import load_data, iter_batches
+from chart_rendering import chart_job, render_charts
+from county_facts import build_county_facts, load_county_facts, local_tables
+
 # Setting up logging
 logging.basicConfig(filename='hidden_corruption_analysis.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
+# A z-score above 3 needs a group of more than 10 rows; smaller groups are compared with everyone
+MIN_GROUP_SIZE = 30
+
+def compute_scores(df, columns, group_by=None, method='zscore', min_group_size=MIN_GROUP_SIZE):
     """
-    Load data from a CSV file into a pandas DataFrame.
+    Score many columns at once against their peer group.
+    
+    'zscore' uses the group mean and population standard deviation, 'robust'
+    uses the group median and the median absolute deviation scaled to match
+    the standard deviation of normal data. Groups with no spread score NaN.
+    A group of n rows can never score above (n-1)/sqrt(n), so groups smaller
+    than min_group_size are scored against the whole population instead.
     
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
+    :param df: DataFrame with the data; not modified
+    :param columns: Columns to score
+    :param group_by: Column (or list of columns) defining peer groups, e.g. 'county'; None for the whole population
+    :param method: 'zscore' or 'robust'
+    :param min_group_size: Minimum number of values for a group to be its own peer group; None to always use groups
+    :return: DataFrame of scores with the same index and columns as df[columns]
     """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
+    values = df[columns].astype(np.float64)
+    # Without peer groups the whole population is one group
+    keys = [df[col] for col in np.atleast_1d(group_by)] if group_by is not None else np.zeros(len(df), dtype=np.int8)
+    
+    def transform(frame, func, **kwargs):
+        return frame.groupby(keys, sort=False).transform(func, **kwargs)
+    
+    if method == 'zscore':
+        center, spread = transform(values, 'mean'), transform(values, 'std', ddof=0)
+    elif method == 'robust':
+        center = transform(values, 'median')
+        spread = 1.4826 * transform((values - center).abs(), 'median')
+    else:
+        raise ValueError(f"Unknown scoring method: {method}")
+    scores = (values - center) / spread.where(spread > 0)
+    if group_by is not None and min_group_size:
+        small = transform(values, 'count') < min_group_size
+        if small.to_numpy().any():
+            scores = scores.mask(small, compute_scores(df, columns, None, method))
+    return scores
 
-def detect_anomalies(df, column, threshold=3):
+def detect_anomalies(df, columns, threshold=3, group_by=None, method='zscore', min_group_size=MIN_GROUP_SIZE):
     """
-    Detect anomalies in a given column using z-score method.
+    Detect anomalies in one or more columns using z-scores or robust scores.
+    
+    The input frame is left untouched. For a single column the result has
+    z_score and is_anomaly columns; for several columns each gets its own
+    <column>_z_score and <column>_is_anomaly, plus is_anomaly for any column.
     
     :param df: DataFrame with the data
-    :param column: Column to analyze for anomalies
+    :param columns: Column or list of columns to analyze for anomalies
+    :param threshold: Score threshold for anomaly detection
+    :param group_by: Column (or list of columns) defining peer groups; None compares against everyone
+    :param method: 'zscore' or 'robust'
+    :param min_group_size: Groups with fewer rows are compared against everyone; None to always use groups
+    :return: Copy of the DataFrame with the score and anomaly columns added
+    """
+    if isinstance(columns, str):
+        scores = compute_scores(df, [columns], group_by, method, min_group_size)[columns]
+        return df.assign(z_score=scores, is_anomaly=scores.abs() > threshold)
+    
+    scores = compute_scores(df, list(columns), group_by, method, min_group_size)
+    flags = scores.abs() > threshold
+    return df.assign(**{f'{col}_z_score': scores[col] for col in columns},
+                     **{f'{col}_is_anomaly': flags[col] for col in columns},
+                     is_anomaly=flags.any(axis=1))
+
+def detect_anomalies_streaming(file_path, columns, threshold=3, group_by=None, batch_size=100_000,
+                               min_group_size=MIN_GROUP_SIZE):
+    """
+    Z-score anomaly detection over a file too large to load, in two streaming passes.
+    
+    The first pass accumulates per-group counts, means and sums of squared
+    deviations, merging batches with Chan's parallel form of Welford's update;
+    the second pass scores each batch and keeps only anomalous rows. Groups
+    smaller than min_group_size are scored against the whole population.
+    
+    :param file_path: Path to the data file
+    :param columns: Columns to analyze for anomalies
     :param threshold: Z-score threshold for anomaly detection
-    :return: DataFrame with an additional column indicating anomalies
+    :param group_by: Column (or list of columns) defining peer groups; None compares against everyone
+    :param batch_size: Number of rows per batch
+    :param min_group_size: Groups with fewer rows are compared against everyone; None to always use groups
+    :return: DataFrame of anomalous rows with <column>_z_score columns
     """
-    df['z_score'] = zscore(df[column])
-    df['is_anomaly'] = (df['z_score'] > threshold) | (df['z_score'] < -threshold)
-    return df
+    columns = list(columns)
+    keys = list(np.atleast_1d(group_by)) if group_by is not None else []
+    load_columns = keys + columns
+    stats = None
+    
+    for batch in iter_batches(file_path, columns=load_columns, batch_size=batch_size):
+        grouped = batch.groupby(keys, sort=False) if keys else batch.assign(_all=0).groupby('_all')
+        values = grouped[columns]
+        batch_stats = pd.concat({'count': values.count(), 'mean': values.mean(), 'm2': values.var(ddof=0) * values.count()}, axis=1)
+        batch_stats = batch_stats.fillna(0.0)
+        if stats is None:
+            stats = batch_stats
+            continue
+        stats, batch_stats = stats.align(batch_stats, join='outer', fill_value=0.0)
+        n_a, n_b = stats['count'], batch_stats['count']
+        total = n_a + n_b
+        delta = batch_stats['mean'] - stats['mean']
+        merged = pd.concat({
+            'count': total,
+            'mean': stats['mean'] + delta * (n_b / total).fillna(0.0),
+            'm2': stats['m2'] + batch_stats['m2'] + delta ** 2 * (n_a * n_b / total).fillna(0.0),
+        }, axis=1)
+        stats = merged
+    
+    if stats is None:
+        return pd.DataFrame(columns=load_columns)
+    means = stats['mean']
+    stds = np.sqrt(stats['m2'] / stats['count'])
+    if keys and min_group_size:
+        # Population moments from the group moments, for groups too small to be scored on their own
+        counts = stats['count']
+        overall_mean = (counts * means).sum() / counts.sum()
+        overall_std = np.sqrt((stats['m2'] + counts * (means - overall_mean) ** 2).sum() / counts.sum())
+        small = (counts < min_group_size).to_numpy()
+        means = means.mask(small, np.broadcast_to(overall_mean.to_numpy(), means.shape))
+        stds = stds.mask(small, np.broadcast_to(overall_std.to_numpy(), stds.shape))
+    
+    anomalies = []
+    for batch in iter_batches(file_path, columns=load_columns, batch_size=batch_size):
+        if keys:
+            index = pd.MultiIndex.from_frame(batch[keys]) if len(keys) > 1 else pd.Index(batch[keys[0]])
+        else:
+            index = pd.Index(np.zeros(len(batch), dtype=np.int64))
+        center = means.reindex(index).to_numpy()
+        spread = stds.reindex(index).to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scores = (batch[columns].to_numpy(dtype=np.float64) - center) / np.where(spread > 0, spread, np.nan)
+        flags = np.abs(scores) > threshold
+        rows = flags.any(axis=1)
+        if rows.any():
+            scored = batch[rows].assign(**{f'{col}_z_score': scores[rows, i] for i, col in enumerate(columns)})
+            anomalies.append(scored)
+    
+    logging.info(f"Streaming z-score detection over {file_path} found {sum(map(len, anomalies))} anomalous rows")
+    return pd.concat(anomalies, ignore_index=True) if anomalies else pd.DataFrame(columns=load_columns + [f'{col}_z_score' for col in columns])
 
-def analyze_hidden_corruption(df):
+def analyze_hidden_corruption(df, facts=None):
     """
     Perform detailed analysis to uncover hidden corruption at the local level.
     
     :param df: DataFrame with local financial data
+    :param facts: County fact tables from load_county_facts; built from df if omitted
     :return: Dictionary with detailed analysis results
     """
     results = {}
+    if facts is None:
+        county, commission = build_county_facts(df)
+        facts = {'county': county, 'commission': commission}
+    
+    # Anomaly Detection in Salaries and Total Worth, each official compared with their own county
+    scored = detect_anomalies(df, ['salary', 'total_worth'], group_by='county')
+    for column, key in (('salary', 'salary_anomalies'), ('total_worth', 'worth_anomalies')):
+        flagged = scored[scored[f'{column}_is_anomaly']]
+        results[key] = flagged[['county', column, f'{column}_z_score']].rename(columns={f'{column}_z_score': 'z_score'})
     
-    # Anomaly Detection in Salaries
-    df = detect_anomalies(df, 'salary')
-    results['salary_anomalies'] = df[df['is_anomaly']][['county', 'salary', 'z_score']]
-    
-    # Anomaly Detection in Total Worth
-    df = detect_anomalies(df, 'total_worth')
-    results['worth_anomalies'] = df[df['is_anomaly']][['county', 'total_worth', 'z_score']]
-    
-    # Analyze Discrepancy in Fee/Fine Collection vs Public Services
-    df['fee_fine_ratio'] = df['fees'] + df['fines']
-    df['service_spending'] = df['public_service_spending']  # Assuming this column exists
-    results['fee_fine_vs_service'] = df.groupby('county').agg({
-        'fee_fine_ratio': 'sum',
-        'service_spending': 'sum'
-    }).reset_index()
-    results['fee_fine_vs_service']['discrepancy'] = results['fee_fine_vs_service']['fee_fine_ratio'] - results['fee_fine_vs_service']['service_spending']
-    
-    # Analyze Commission Income vs Local Business Support
-    df['business_support'] = df['business_grants'] + df['business_loans']  # Assuming these columns exist
-    commission_types = ['Liquor', 'Cannabis']
-    for commission_type in commission_types:
-        subset = df[df['commission_type'] == commission_type]
-        results[f'{commission_type.lower()}_commission_analysis'] = subset.groupby('county').agg({
-            'commission_income': 'sum',
-            'business_support': 'sum'
-        }).reset_index()
-        results[f'{commission_type.lower()}_commission_analysis']['support_ratio'] = results[f'{commission_type.lower()}_commission_analysis']['business_support'] / results[f'{commission_type.lower()}_commission_analysis']['commission_income']
+    # Fee/Fine Collection vs Public Services and Commission Income vs Local Business Support
+    # come from the county fact table
+    results.update(local_tables(facts))
     
     # Visualizations
-    plt.figure(figsize=(12, 6))
-    sns.boxplot(x='county', y='salary', data=df)
-    plt.title('Salary Distribution by County')
-    plt.xticks(rotation=45)
-    plt.savefig('salary_distribution.png')
-    plt.close()
-    
-    plt.figure(figsize=(12, 6))
-    sns.scatterplot(data=results['fee_fine_vs_service'], x='fee_fine_ratio', y='service_spending', hue='county')
-    plt.title('Fee/Fine Collection vs Public Service Spending')
-    plt.savefig('fee_fine_vs_service.png')
-    plt.close()
+    render_charts([
+        chart_job('boxplot', 'salary_distribution.png', df[['county', 'salary']], x='county', y='salary',
+                  title='Salary Distribution by County', rotation=45),
+        chart_job('scatter', 'fee_fine_vs_service.png', results['fee_fine_vs_service'], x='fee_fine_ratio',
+                  y='service_spending', hue='county', figsize=(12, 6),
+                  title='Fee/Fine Collection vs Public Service Spending'),
+    ])
     
     logging.info("Hidden corruption analysis completed")
     return results
@@ -95,7 +190,7 @@ def analyze_hidden_corruption(df):
 def main():
     data_path = 'local_financial_data.csv'
     df = load_data(data_path)
-    analysis_results = analyze_hidden_corruption(df)
+    analysis_results = analyze_hidden_corruption(df, load_county_facts(data_path, df))
     
     # Save results to CSV for further analysis or reporting
     for key, value in analysis_results.items():
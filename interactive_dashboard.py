@@ -1,28 +1,275 @@
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request, Response
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import base64
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
 import os
 import logging
 
+from shared_dataset import SharedDataset
+from olap_cube import CUBE_DIR, DIMENSIONS, load_cube, update_cube, dashboard_summary
+from alert_store import alert_summary, events_since, latest_event_seq
+
 # Setting up logging
 logging.basicConfig(filename='interactive_dashboard.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
 app = Flask(__name__)
 
-def load_data(file_path):
+DATA_PATH = 'government_spending_data.csv'
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10_000
+EXPORT_BATCH_SIZE = 50_000
+MIN_GZIP_BYTES = 1024
+EVENT_POLL_INTERVAL = 1.0
+EVENT_HEARTBEAT_SECONDS = 15
+# Event streams are closed after this long; browsers reconnect and resume from Last-Event-ID
+EVENT_STREAM_SECONDS = 300
+# Each open stream holds a server thread, so a worker serves at most this many; more get 503
+MAX_EVENT_STREAMS = 64
+# Recent events kept in memory for the streams of this worker
+EVENT_BUFFER_SIZE = 1000
+# Row orders of recent filter/sort queries, so paging through a result does not re-sort it
+MAX_CACHED_QUERIES = 32
+
+_FILTER_OPS = {
+    'eq': lambda col, value: col == value,
+    'ne': lambda col, value: col != value,
+    'lt': lambda col, value: col < value,
+    'le': lambda col, value: col <= value,
+    'gt': lambda col, value: col > value,
+    'ge': lambda col, value: col >= value,
+    'in': lambda col, value: col.isin(value),
+    'contains': lambda col, value: col.astype(str).str.contains(value, case=False, regex=False),
+}
+
+shared_data = SharedDataset(DATA_PATH, publish=False)
+_dataset_lock = threading.Lock()
+_dataset = {'sha256': None, 'frame': None, 'queries': OrderedDict()}
+_cube_lock = threading.Lock()
+_cube = {'version': None, 'cube': None}
+_event_streams = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+
+class EventFeed:
     """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
+    One poller of the dashboard event log per worker, shared by all of its open streams.
+
+    A background thread reads new events from the alert database every
+    poll_interval seconds into a bounded buffer and wakes the waiting streams
+    through a condition, so the database is polled once per worker rather
+    than once per client. Streams that are further behind than the buffer
+    read their backlog from the database directly.
+    """
+
+    def __init__(self, poll_interval=EVENT_POLL_INTERVAL, buffer_size=EVENT_BUFFER_SIZE):
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=buffer_size)
+        self._latest = None
+        self._thread = None
+
+    def _poll(self):
+        while True:
+            try:
+                rows, _ = events_since(self._latest)
+                if rows:
+                    with self._condition:
+                        self._events.extend(rows)
+                        self._latest = rows[-1][0]
+                        self._condition.notify_all()
+            except Exception as e:
+                logging.error(f"Error polling dashboard events: {str(e)}")
+            time.sleep(self.poll_interval)
+
+    def _start(self):
+        with self._condition:
+            if self._thread is None:
+                self._latest = latest_event_seq()
+                self._thread = threading.Thread(target=self._poll, name='event-feed', daemon=True)
+                self._thread.start()
+
+    def wait(self, last_seq, timeout):
+        """
+        Events after a sequence number, waiting up to timeout seconds for one to arrive.
+
+        :param last_seq: Last sequence number the client has seen
+        :param timeout: Seconds to wait when there is no newer event
+        :return: Tuple of (list of (seq, event, payload JSON) tuples, whether events after last_seq were already pruned)
+        """
+        self._start()
+        with self._condition:
+            oldest = self._events[0][0] if self._events else self._latest + 1
+            if last_seq + 1 >= oldest or last_seq >= self._latest:
+                if self._latest <= last_seq:
+                    self._condition.wait(timeout)
+                return [row for row in self._events if row[0] > last_seq], False
+        # Further behind than the buffer: read the backlog from the database
+        return events_since(last_seq)
+
+
+_event_feed = EventFeed()
+
+def get_dataset():
+    """
+    The dashboard's view of the data, shared with every other worker process through a memory-mapped file.
+
+    A new version is mapped, and the cached query orders dropped, only when the file content changes.
+
+    :return: Tuple of (DataFrame, content hash of the file it was loaded from)
+    """
+    frame, sha256 = shared_data.frame()
+    with _dataset_lock:
+        if _dataset['sha256'] != sha256:
+            _dataset.update(sha256=sha256, frame=frame, queries=OrderedDict())
+            logging.info(f"Dashboard dataset switched to version {sha256[:16]} ({len(frame)} rows)")
+        return _dataset['frame'], sha256
+
+def get_cube():
+    """
+    The rollup cube, reloaded only when an update published a new version.
+
+    On a fresh deployment, where no cube was published yet, the cube is built
+    from the data file first.
+
+    :return: Cube dictionary from olap_cube.load_cube
+    """
+    try:
+        with open(os.path.join(CUBE_DIR, 'meta.json'), 'r') as f:
+            version = json.load(f)['version']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        version = 0
+    with _cube_lock:
+        if _cube['version'] != version or version == 0:
+            cube = load_cube(CUBE_DIR)
+            if cube['meta']['version'] == 0:
+                logging.info("No rollup cube published yet; building it from the data file")
+                cube = update_cube(DATA_PATH, CUBE_DIR)
+            # The version actually loaded, which may be newer than the one read above
+            _cube.update(version=cube['meta']['version'], cube=cube)
+        return _cube['cube']
+
+class QueryError(ValueError):
+    pass
+
+def parse_query(args, df):
+    """
+    Read projection, filters and sort order from request arguments.
+
+    columns=a,b selects columns; filter=column:op:value (repeatable, op one of
+    eq, ne, lt, le, gt, ge, in, contains; 'in' takes values separated by |);
+    sort=a,-b sorts ascending by a then descending by b.
+
+    :param args: Request arguments
+    :param df: Dataset the query runs against
+    :return: Dictionary with 'columns', 'filters' and 'sort'
+    """
+    columns = [c for c in args.get('columns', '').split(',') if c] or list(df.columns)
+    filters = []
+    for spec in args.getlist('filter'):
+        parts = spec.split(':', 2)
+        if len(parts) != 3 or parts[1] not in _FILTER_OPS:
+            raise QueryError(f"Invalid filter '{spec}'")
+        filters.append(tuple(parts))
+    sort = [s for s in args.get('sort', '').split(',') if s]
+    unknown = [c for c in columns + [f[0] for f in filters] + [s.lstrip('-') for s in sort] if c not in df.columns]
+    if unknown:
+        raise QueryError(f"Unknown columns: {', '.join(sorted(set(unknown)))}")
+    return {'columns': columns, 'filters': filters, 'sort': sort}
+
+def _typed_value(column, value):
+    # Compare against the column's own type so '100' filters a numeric column numerically
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.to_numeric(pd.Series(value), errors='raise').to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return pd.to_datetime(pd.Series(value)).to_numpy()
+    return np.asarray(value, dtype=object)
+
+def row_order(df, sha256, query):
+    """
+    Row positions matching the query's filters, in its sort order, cached per data version.
+
+    :return: numpy array of row positions
+    """
+    key = _query_hash(query)
+    with _dataset_lock:
+        cached = _dataset['queries'].get(key) if _dataset['sha256'] == sha256 else None
+        if cached is not None:
+            _dataset['queries'].move_to_end(key)
+            return cached
+
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, raw in query['filters']:
+        try:
+            if op == 'contains':
+                value = raw
+            elif op == 'in':
+                value = _typed_value(df[column], raw.split('|'))
+            else:
+                value = _typed_value(df[column], [raw])[0]
+        except (ValueError, TypeError):
+            raise QueryError(f"Invalid value '{raw}' for column '{column}'")
+        mask &= _FILTER_OPS[op](df[column], value).to_numpy(dtype=bool, na_value=False)
+    positions = np.flatnonzero(mask)
+
+    if query['sort']:
+        by = [s.lstrip('-') for s in query['sort']]
+        ascending = [not s.startswith('-') for s in query['sort']]
+        # Stable sort so rows with equal keys keep file order and pages never overlap
+        keys = df[by].iloc[positions].reset_index(drop=True)
+        positions = positions[keys.sort_values(by, ascending=ascending, kind='stable').index.to_numpy()]
+
+    with _dataset_lock:
+        if _dataset['sha256'] == sha256:
+            _dataset['queries'][key] = positions
+            while len(_dataset['queries']) > MAX_CACHED_QUERIES:
+                _dataset['queries'].popitem(last=False)
+    return positions
+
+def _query_hash(query):
+    return hashlib.sha256(json.dumps([query['filters'], query['sort']]).encode('utf-8')).hexdigest()[:16]
+
+def encode_cursor(sha256, query, offset):
+    payload = json.dumps({'v': sha256[:16], 'q': _query_hash(query), 'o': offset})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sha256, query):
+    """
+    Offset encoded in a cursor issued for the same query.
+
+    :raises QueryError: if the cursor is malformed or was issued for another query
+    :return: Offset into the query's row order, or None if the data changed since the cursor was issued
     """
     try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        offset = int(payload['o'])
+        version, query_hash = payload['v'], payload['q']
+    except (ValueError, KeyError, TypeError):
+        raise QueryError("Invalid cursor")
+    if query_hash != _query_hash(query):
+        raise QueryError("Cursor belongs to a different query")
+    return offset if version == sha256[:16] else None
+
+def _records_json(frame):
+    # Columnar serialization straight to JSON text, without building Python dicts per row
+    return frame.to_json(orient='records', date_format='iso')
+
+def _compressed(body, mimetype, etag):
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and len(body) >= MIN_GZIP_BYTES:
+        response.set_data(gzip.compress(body.encode('utf-8') if isinstance(body, str) else body, compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 @app.route('/')
 def index():
@@ -30,10 +277,179 @@ def index():
 
 @app.route('/data')
 def get_data():
-    df = load_data('government_spending_data.csv')
-    # Convert DataFrame to a list of dictionaries for JSON serialization
-    data = df.to_dict(orient='records')
-    return jsonify(data)
+    """
+    One page of the dataset.
+
+    Supports columns, filter and sort (see parse_query), limit (page size) and
+    cursor (from next_cursor of the previous page). Responses carry an ETag
+    derived from the data version and query, and are gzip-compressed when the
+    client accepts it.
+    """
+    df, sha256 = get_dataset()
+    etag = hashlib.sha256(f'{sha256}?{request.query_string.decode()}'.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+
+    try:
+        query = parse_query(request.args, df)
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        offset = decode_cursor(request.args['cursor'], sha256, query) if 'cursor' in request.args else 0
+    except (QueryError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if offset is None:
+        return jsonify({'error': 'The data changed since this cursor was issued; restart from the first page'}), 410
+
+    try:
+        positions = row_order(df, sha256, query)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    page = positions[offset:offset + limit]
+    next_offset = offset + len(page)
+    next_cursor = encode_cursor(sha256, query, next_offset) if next_offset < len(positions) else None
+
+    body = '{"data":%s,"columns":%s,"total":%d,"next_cursor":%s}' % (
+        _records_json(df[query['columns']].iloc[page]), json.dumps(query['columns']), len(positions), json.dumps(next_cursor))
+    return _compressed(body, 'application/json', etag)
+
+def abuse_event(alert):
+    """
+    Dashboard entry of one alert from the alert table.
+    """
+    description = f"Record {alert['record_index']} of {os.path.basename(alert['source_file'])} flagged"
+    if alert['transaction_id'] is not None:
+        description += f" (transaction {alert['transaction_id']})"
+    return {'description': description, 'timestamp': alert['detected_at']}
+
+@app.route('/summary')
+def get_summary():
+    """
+    Dashboard widget data for one slice, answered from the rollup cube and the alert table.
+
+    The slice is chosen with year, month, department, category and vendor
+    arguments; omitted dimensions are aggregated over.
+    """
+    filters = {}
+    for dim in DIMENSIONS:
+        value = request.args.get(dim)
+        if value is not None:
+            try:
+                filters[dim] = int(value) if dim in ('year', 'month') else value
+            except ValueError:
+                return jsonify({'error': f"Invalid {dim} '{value}'"}), 400
+    # Read before the data, so events raced by this snapshot are replayed rather than missed
+    event_seq = latest_event_seq()
+    summary = dashboard_summary(get_cube(), filters)
+    abuse_count, alerts = alert_summary()
+    summary['abuseIncidents'] = abuse_count
+    summary['abuseEvents'] = [abuse_event(alert) for alert in alerts]
+    summary['eventSeq'] = event_seq
+    body = json.dumps(summary)
+    etag = hashlib.sha256(body.encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': f'"{etag}"'})
+    return _compressed(body, 'application/json', etag)
+
+@app.route('/events')
+def stream_events():
+    """
+    Server-sent dashboard deltas, each with its sequence number as the event id.
+
+    'summary' events carry the overall aggregates a cube update changed, so
+    clients showing a slice reload their slice from /summary instead of
+    applying them; 'alerts' events carry the newest alerts, and 'reset' tells
+    the client to reload /summary because the deltas it missed are no longer
+    kept. Clients resume with the Last-Event-ID header, or start after the
+    eventSeq of a /summary snapshot with the since argument.
+
+    Each open stream holds a server thread for up to EVENT_STREAM_SECONDS, so
+    a worker accepts at most MAX_EVENT_STREAMS at once and answers further
+    ones with 503; browsers retry them after the Retry-After delay. All
+    streams of a worker share one poller of the event log (EventFeed).
+    """
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('since') or latest_event_seq())
+    except ValueError:
+        return jsonify({'error': 'Invalid event id'}), 400
+    if not _event_streams.acquire(blocking=False):
+        return Response(status=503, headers={'Retry-After': '30'})
+
+    def events(last_seq):
+        yield "retry: 3000\n\n"
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < EVENT_STREAM_SECONDS:
+            rows, pruned = _event_feed.wait(last_seq, timeout=EVENT_HEARTBEAT_SECONDS)
+            if pruned:
+                last_seq = latest_event_seq()
+                yield f"id: {last_seq}\nevent: reset\ndata: {{}}\n\n"
+                continue
+            for seq, event, payload in rows:
+                if event == 'alerts':
+                    alerts = json.loads(payload)
+                    payload = json.dumps({'abuseIncidents': alerts['abuseIncidents'],
+                                          'abuseEvents': [abuse_event(alert) for alert in alerts['alerts']]})
+                yield f"id: {seq}\nevent: {event}\ndata: {payload}\n\n"
+                last_seq = seq
+                last_sent = time.monotonic()
+            if not rows and time.monotonic() - last_sent >= EVENT_HEARTBEAT_SECONDS:
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+
+    response = Response(events(last_seq), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Released when the server closes the response, even if the stream never started
+    response.call_on_close(_event_streams.release)
+    return response
+
+@app.route('/data/export')
+def export_data():
+    """
+    Stream the whole query result as NDJSON (format=ndjson) or an Arrow IPC stream (format=arrow).
+
+    Rows are produced batch by batch, so the export is never held in memory.
+    """
+    df, sha256 = get_dataset()
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'arrow'):
+        return jsonify({'error': f"Unknown export format '{export_format}'"}), 400
+    try:
+        query = parse_query(request.args, df)
+        positions = row_order(df, sha256, query)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    projected = df[query['columns']]
+    use_gzip = export_format == 'ndjson' and 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    def ndjson_batches():
+        compressor = zlib.compressobj(5, zlib.DEFLATED, 31) if use_gzip else None
+        for start in range(0, len(positions), EXPORT_BATCH_SIZE):
+            chunk = projected.iloc[positions[start:start + EXPORT_BATCH_SIZE]].to_json(orient='records', lines=True, date_format='iso')
+            chunk = chunk if chunk.endswith('\n') else chunk + '\n'
+            yield compressor.compress(chunk.encode('utf-8')) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+
+    def arrow_batches():
+        # The IPC writer appends to an in-memory buffer that is drained after every batch
+        buffer = io.BytesIO()
+        writer = None
+        for start in range(0, max(len(positions), 1), EXPORT_BATCH_SIZE):
+            batch = pa.RecordBatch.from_pandas(projected.iloc[positions[start:start + EXPORT_BATCH_SIZE]], preserve_index=False)
+            if writer is None:
+                writer = pa.ipc.new_stream(buffer, batch.schema)
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        writer.close()
+        yield buffer.getvalue()
+
+    headers = {'Content-Disposition': f'attachment; filename=spending.{"arrows" if export_format == "arrow" else "ndjson"}'}
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+    if export_format == 'arrow':
+        return Response(arrow_batches(), mimetype='application/vnd.apache.arrow.stream', headers=headers)
+    return Response(ndjson_batches(), mimetype='application/x-ndjson', headers=headers)
 
 if __name__ == '__main__':
     # Ensure the templates directory exists
@@ -56,10 +472,10 @@ if __name__ == '__main__':
             <h1>Interactive DOGE Dashboard</h1>
             <div id="dataDisplay"></div>
             <script>
-                fetch('/data')
+                fetch('/data?limit=100')
                     .then(response => response.json())
-                    .then(data => {
-                        document.getElementById('dataDisplay').innerHTML = `<pre>${JSON.stringify(data, null, 2)}</pre>`;
+                    .then(page => {
+                        document.getElementById('dataDisplay').innerHTML = `<p>Showing ${page.data.length} of ${page.total} records</p><pre>${JSON.stringify(page.data, null, 2)}</pre>`;
                     });
             </script>
         </body>
@@ -0,0 +1,268 @@
+import json
+import os
+import glob
+import time
+import uuid
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from data_loader import CACHE_DIR, temp_path
+
+# Background jobs for long-running work triggered from the web apps. Job state
+# lives in one JSON file per job, so any server process can report on a job, and
+# finished results are cached by a caller-supplied key such as the fingerprint
+# of the input data. The job running for each cache key is recorded in the job
+# directory too, so a job submitted to one process is not started again by another.
+# Finished jobs are removed after JOB_RETENTION_SECONDS; their cached results stay.
+
+JOB_DIR = os.path.join(CACHE_DIR, 'jobs')
+TERMINAL_STATES = ('done', 'failed')
+# How long finished and failed jobs stay available to clients
+JOB_RETENTION_SECONDS = 24 * 3600
+# Seconds between sweeps for expired jobs
+PRUNE_INTERVAL_SECONDS = 600
+# Tells this process apart from an earlier one that had the same pid
+_PROCESS_TOKEN = uuid.uuid4().hex
+
+
+def _owner_alive(owner):
+    # A job is only running while the process that owns it is alive
+    if not owner:
+        return False
+    if owner['pid'] == os.getpid():
+        return owner['token'] == _PROCESS_TOKEN
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """
+    Run jobs on a worker pool and track their state on disk.
+
+    A job function is called with a progress(fraction, message) callback as
+    its first argument and must return a JSON-serializable result. Jobs left
+    queued or running by a process that has since exited are marked failed
+    when a queue starts, and finished jobs are removed once they are older
+    than the retention period.
+    """
+
+    def __init__(self, max_workers=2, job_dir=JOB_DIR, retention=JOB_RETENTION_SECONDS):
+        self.job_dir = job_dir
+        self.retention = retention
+        self._last_prune = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._owner = {'pid': os.getpid(), 'token': _PROCESS_TOKEN}
+        os.makedirs(os.path.join(job_dir, 'results'), exist_ok=True)
+        os.makedirs(os.path.join(job_dir, 'active'), exist_ok=True)
+        self._fail_orphaned_jobs()
+        with self._store_lock():
+            self._prune_jobs()
+
+    @contextmanager
+    def _store_lock(self):
+        # Serializes job bookkeeping across the threads and processes sharing the job directory
+        with self._lock, open(os.path.join(self.job_dir, 'active', '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _active_path(self, cache_key):
+        return os.path.join(self.job_dir, 'active', f'{cache_key}.json')
+
+    def _active_job(self, cache_key):
+        # Id of the live job recorded for a cache key, or None if there is none or its process died
+        try:
+            with open(self._active_path(cache_key), 'r') as f:
+                job_id = json.load(f)['job_id']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+        job = self._read(job_id)
+        if job is None or job['status'] in TERMINAL_STATES or not _owner_alive(job.get('owner')):
+            return None
+        return job_id
+
+    def _fail_orphaned_jobs(self):
+        failed = 0
+        with self._store_lock():
+            for path in glob.glob(os.path.join(self.job_dir, '*.json')):
+                job = self._read(os.path.splitext(os.path.basename(path))[0])
+                if job is None or job['status'] in TERMINAL_STATES or _owner_alive(job.get('owner')):
+                    continue
+                self._update(job, status='failed', error='The process running the job exited before it finished',
+                             message='Failed', finished_at=datetime.now().isoformat())
+                failed += 1
+            for path in glob.glob(os.path.join(self.job_dir, 'active', '*.json')):
+                if self._active_job(os.path.splitext(os.path.basename(path))[0]) is None:
+                    os.remove(path)
+        if failed:
+            logging.warning(f"Marked {failed} jobs left behind by exited processes as failed")
+
+    def _prune_jobs(self):
+        # Callers hold the store lock
+        cutoff = datetime.now() - timedelta(seconds=self.retention)
+        pruned = 0
+        for path in glob.glob(os.path.join(self.job_dir, '*.json')):
+            job = self._read(os.path.splitext(os.path.basename(path))[0])
+            if job is None or job['status'] not in TERMINAL_STATES or not job.get('finished_at'):
+                continue
+            if datetime.fromisoformat(job['finished_at']) < cutoff:
+                try:
+                    os.remove(path)
+                    pruned += 1
+                except FileNotFoundError:
+                    pass
+        self._last_prune = time.monotonic()
+        if pruned:
+            logging.info(f"Removed {pruned} jobs finished more than {self.retention} seconds ago")
+
+    def _job_path(self, job_id):
+        return os.path.join(self.job_dir, f'{job_id}.json')
+
+    def _result_path(self, cache_key):
+        return os.path.join(self.job_dir, 'results', f'{cache_key}.json')
+
+    def _write(self, job):
+        path = self._job_path(job['id'])
+        tmp_path = temp_path(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, path)
+
+    def _update(self, job, **changes):
+        job.update(changes)
+        self._write(job)
+
+    def _read(self, job_id):
+        # Full job record, including the owning process
+        try:
+            with open(self._job_path(os.path.basename(job_id)), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, job_id):
+        """
+        Current state of a job, as shown to clients.
+
+        :param job_id: Job id returned by submit
+        :return: Job dictionary without the owning process, or None for an unknown or expired id
+        """
+        job = self._read(job_id)
+        if job is not None:
+            job.pop('owner', None)
+        return job
+
+    def cached_result(self, cache_key):
+        """
+        Result of an earlier job with the same cache key, or None.
+        """
+        try:
+            with open(self._result_path(cache_key), 'r') as f:
+                return json.load(f)['result']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def submit(self, name, func, cache_key=None, **kwargs):
+        """
+        Queue a job, or answer it from the result cache.
+
+        A job whose cache key already has a result finishes immediately; a job
+        whose cache key matches one still queued or running, in this or any
+        other process, returns that job's id.
+
+        :param name: Job name shown to clients
+        :param func: Function to run, called as func(progress, **kwargs)
+        :param cache_key: Key identifying the job's inputs; results are not cached if None
+        :return: Job id
+        """
+        now = datetime.now().isoformat()
+        with self._store_lock():
+            if time.monotonic() - self._last_prune > PRUNE_INTERVAL_SECONDS:
+                self._prune_jobs()
+            active_id = self._active_job(cache_key) if cache_key is not None else None
+            if active_id is not None:
+                return active_id
+            job = {'id': uuid.uuid4().hex, 'name': name, 'status': 'queued', 'progress': 0.0, 'message': 'Queued',
+                   'result': None, 'error': None, 'cache_key': cache_key, 'cached': False, 'owner': self._owner,
+                   'submitted_at': now, 'started_at': None, 'finished_at': None}
+            cached = self.cached_result(cache_key) if cache_key is not None else None
+            if cached is not None:
+                job.update(status='done', progress=1.0, message='Served from cache', result=cached, cached=True,
+                           started_at=now, finished_at=now)
+                self._write(job)
+                return job['id']
+            self._write(job)
+            if cache_key is not None:
+                path = self._active_path(cache_key)
+                tmp_path = temp_path(path)
+                with open(tmp_path, 'w') as f:
+                    json.dump({'job_id': job['id']}, f)
+                os.replace(tmp_path, path)
+        self.executor.submit(self._run, job, func, kwargs)
+        logging.info(f"Job {job['id']} ({name}) queued")
+        return job['id']
+
+    def _run(self, job, func, kwargs):
+        self._update(job, status='running', started_at=datetime.now().isoformat(), message='Started')
+
+        def progress(fraction, message):
+            self._update(job, progress=round(float(fraction), 3), message=message)
+
+        try:
+            result = func(progress, **kwargs)
+            if job['cache_key'] is not None:
+                path = self._result_path(job['cache_key'])
+                tmp_path = temp_path(path)
+                with open(tmp_path, 'w') as f:
+                    json.dump({'result': result, 'job_id': job['id']}, f, default=str)
+                os.replace(tmp_path, path)
+            self._update(job, status='done', progress=1.0, message='Finished', result=result,
+                         finished_at=datetime.now().isoformat())
+            logging.info(f"Job {job['id']} ({job['name']}) finished")
+        except Exception as e:
+            logging.error(f"Job {job['id']} ({job['name']}) failed: {str(e)}")
+            self._update(job, status='failed', error=str(e), message='Failed', finished_at=datetime.now().isoformat())
+        finally:
+            if job['cache_key'] is not None:
+                with self._store_lock():
+                    try:
+                        os.remove(self._active_path(job['cache_key']))
+                    except FileNotFoundError:
+                        pass
+
+    def stream(self, job_id, poll_interval=0.5, timeout=3600):
+        """
+        Server-sent events for a job: one event per state change, ending with the finished job.
+
+        :param job_id: Job id returned by submit
+        :param poll_interval: Seconds between state checks
+        :param timeout: Seconds after which the stream gives up
+        :return: Iterator of SSE-formatted strings
+        """
+        last = None
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'unknown job'})}\n\n"
+                return
+            snapshot = (job['status'], job['progress'], job['message'])
+            if snapshot != last:
+                last = snapshot
+                event = 'result' if job['status'] in TERMINAL_STATES else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(job, default=str)}\n\n"
+            if job['status'] in TERMINAL_STATES:
+                return
+            time.sleep(poll_interval)
@@ -2,18 +2,24 @@ import pandas as pd
 from textblob import TextBlob
 import logging
 
+from county_facts import load_county_facts, local_tables
+
 # Setting up logging
 logging.basicConfig(filename='local_transparency_report.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_analysis_results():
+def load_analysis_results(data_path='local_financial_data.csv'):
     """
     Load the results from the previous hidden corruption analysis.
     
+    County aggregates are read from the county fact table; the per-official
+    anomaly lists come from the hidden corruption analysis output files.
+    
+    :param data_path: Path to the local financial data file the facts were built from
     :return: Dictionary with analysis results
     """
-    results = {}
-    for file in ['salary_anomalies.csv', 'worth_anomalies.csv', 'fee_fine_vs_service.csv', 'liquor_commission_analysis.csv', 'cannabis_commission_analysis.csv']:
+    results = local_tables(load_county_facts(data_path))
+    for file in ['salary_anomalies.csv', 'worth_anomalies.csv']:
         try:
             results[file.replace('.csv', '')] = pd.read_csv(file)
         except FileNotFoundError:
@@ -59,4 +65,22 @@ def generate_transparency_report(results):
     # Basic sentiment analysis
     blob = TextBlob(full_report)
     sentiment = blob.sentiment.polarity
-    sentiment_text = "concerned" if sentiment < 0 else "neutral" if sentiment == 0 else "optimistic
+    sentiment_text = "concerned" if sentiment < 0 else "neutral" if sentiment == 0 else "optimistic"
+    
+    full_report += f"\n\nSentiment of this report: {sentiment_text}"
+    
+    logging.info("Transparency report generated")
+    return full_report
+
+def main():
+    results = load_analysis_results()
+    report = generate_transparency_report(results)
+    
+    # Save the report to a text file
+    with open('local_transparency_report.txt', 'w') as file:
+        file.write(report)
+    
+    logging.info("Transparency report saved to local_transparency_report.txt")
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,48 @@
 import pandas as pd
 import numpy as np
+import pyarrow.parquet as pq
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report
 from qiskit import Aer, execute, QuantumCircuit
-from qiskit.visualization import plot_histogram
-import matplotlib.pyplot as plt
-import seaborn as sns
 import schedule
 import time
 import logging
+import os
 from datetime import datetime
 
+from data_loader import load_data, iter_batches, iter_appended_rows, commit_watermark, ensure_cached
+from alert_store import record_alerts
+from olap_cube import update_cube
+from shared_dataset import publish_shared_dataset
+from preprocessing import FraudPreprocessor
+from correlation_analysis import correlation_summary
+from chart_rendering import chart_job, render_charts
+from model_registry import training_fingerprint, save_artifact, load_artifact
+
 # Setting up logging
 logging.basicConfig(filename='waste_fraud_abuse_detection.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
+MODEL_PARAMS = {'n_estimators': 100, 'random_state': 42}
+# Training data larger than this is trained out of core
+OUT_OF_CORE_THRESHOLD_BYTES = 2 * 1024 ** 3
 
-def preprocess_data(df):
+# measure_all() adds a 'meas' register next to the unused classical bit, so the
+# simulator reports outcomes as '<measured bit> <classical bit>'
+QUANTUM_OUTCOMES = np.array(['0 0', '1 0'])
+
+def preprocess_data(df, preprocessor=None):
     """
     Preprocess the data by handling missing values, encoding categorical variables, etc.
     
     :param df: Input DataFrame
-    :return: Preprocessed DataFrame
+    :param preprocessor: Fitted FraudPreprocessor; fitted on df if omitted
+    :return: Preprocessed DataFrame of model features
     """
-    # Handle missing values
-    df = df.fillna(df.mean())
-    
-    # Encode categorical variables
-    df = pd.get_dummies(df, columns=['category', 'department'])
-    
-    # Normalize numerical features
-    numerical_features = df.select_dtypes(include=[np.number]).columns
-    df[numerical_features] = (df[numerical_features] - df[numerical_features].mean()) / df[numerical_features].std()
+    if preprocessor is None:
+        preprocessor = FraudPreprocessor().fit(df)
+    df = preprocessor.transform(df)
     
     logging.info("Data preprocessing completed")
     return df
@@ -60,34 +56,35 @@ def analyze_data(df):
     # Basic statistics
     print(df.describe())
     
-    # Correlation heatmap
-    plt.figure(figsize=(10, 8))
-    sns.heatmap(df.corr(), annot=True, cmap='coolwarm')
-    plt.title('Correlation Heatmap of Features')
-    plt.savefig('correlation_heatmap.png')
-    plt.close()
+    # Strongest correlations, computed in blocks so wide one-hot frames stay cheap
+    correlations = correlation_summary(df)
+    correlations['top_pairs'].to_csv('top_correlations.csv', index=False)
+    correlations['clusters'].to_csv('correlation_clusters.csv', index=False)
+    
+    # Correlation heatmap, bounded to the clustered features of the top pairs
+    heatmap = correlations['heatmap']
+    jobs = [chart_job('heatmap', 'correlation_heatmap.png', heatmap, annot=len(heatmap) <= 20, vmin=-1, vmax=1,
+                      title='Correlation Heatmap of Most Correlated Features')]
     
     # Distribution plots for key features
     for feature in df.columns:
-        plt.figure(figsize=(10, 6))
-        sns.histplot(df[feature], kde=True)
-        plt.title(f'Distribution of {feature}')
-        plt.savefig(f'distribution_{feature}.png')
-        plt.close()
+        jobs.append(chart_job('histogram', f'distribution_{feature}.png', df[feature], title=f'Distribution of {feature}'))
+    render_charts(jobs)
     
     logging.info("Data analysis completed and visualizations saved")
 
-def train_ml_model(X, y):
+def train_ml_model(X, y, params=MODEL_PARAMS):
     """
     Train a machine learning model for fraud detection.
     
     :param X: Features
     :param y: Target variable
-    :return: Trained model
+    :param params: RandomForestClassifier hyperparameters
+    :return: Tuple of (trained model, dictionary of evaluation metrics)
     """
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    model = RandomForestClassifier(**params)
     model.fit(X_train, y_train)
     
     # Evaluate model
@@ -97,7 +94,91 @@ def train_ml_model(X, y):
     print(classification_report(y_test, y_pred))
     
     logging.info(f"Machine Learning model trained with accuracy: {accuracy}")
-    return model
+    metrics = {'accuracy': accuracy, 'classification_report': classification_report(y_test, y_pred, output_dict=True)}
+    return model, metrics
+
+def _update_reservoir(reservoir, candidates, capacity, rng):
+    """
+    Bottom-k reservoir update: every row seen so far has the same chance of being kept.
+    """
+    candidates = candidates.assign(_key=rng.random(len(candidates)))
+    merged = candidates if reservoir is None else pd.concat([reservoir, candidates])
+    return merged.nsmallest(capacity, '_key')
+
+def train_ml_model_chunked(data_path, preprocessor=None, params=MODEL_PARAMS, batch_size=100_000,
+                           holdout_fraction=0.2, holdout_size=200_000, target='fraud_flag'):
+    """
+    Train the fraud model out of core, one batch of rows at a time.
+    
+    The forest is grown with warm_start to the configured n_estimators, the same
+    size as the in-memory model: trees are handed out in proportion to the rows
+    read so far, so each batch fits its share of the budget. Rows of a batch
+    that gets no tree, or that misses a class, are carried into the next fit
+    through a bounded random sample. A uniform reservoir sample of held-out rows
+    is kept for evaluation, so every class appears in it at its true frequency
+    and memory stays flat however long the transaction history is.
+    
+    :param data_path: Path to the training data file
+    :param preprocessor: Fitted FraudPreprocessor; fitted in a first streaming pass if omitted
+    :param params: RandomForestClassifier hyperparameters
+    :param batch_size: Number of rows per batch; also the size of the carried-over sample
+    :param holdout_fraction: Fraction of each batch set aside as hold-out candidates
+    :param holdout_size: Maximum number of hold-out rows kept
+    :param target: Name of the target column
+    :return: Tuple of (trained model, dictionary of evaluation metrics, preprocessor)
+    """
+    if preprocessor is None:
+        preprocessor = FraudPreprocessor()
+        for batch in iter_batches(data_path, batch_size=batch_size):
+            preprocessor.partial_fit(batch)
+    
+    total_rows = pq.ParquetFile(ensure_cached(data_path)).metadata.num_rows
+    n_estimators = params.get('n_estimators', 100)
+    rng = np.random.default_rng(params.get('random_state'))
+    model = RandomForestClassifier(**dict(params, warm_start=True))
+    holdout = None
+    carry = None
+    n_classes = 0
+    rows_read = 0
+    
+    def fit_trees(train, n_trees):
+        model.set_params(n_estimators=(len(model.estimators_) if hasattr(model, 'estimators_') else 0) + n_trees)
+        model.fit(preprocessor.transform(train), train[target])
+        logging.info(f"Out-of-core training: forest grown to {len(model.estimators_)} of {n_estimators} trees")
+    
+    for batch in iter_batches(data_path, batch_size=batch_size):
+        rows_read += len(batch)
+        batch = batch.dropna(subset=[target])
+        is_holdout = rng.random(len(batch)) < holdout_fraction
+        holdout = _update_reservoir(holdout, batch[is_holdout], holdout_size, rng)
+        
+        train = batch[~is_holdout] if carry is None else pd.concat([carry.drop(columns='_key'), batch[~is_holdout]])
+        n_classes = max(n_classes, train[target].nunique())
+        fitted = len(model.estimators_) if hasattr(model, 'estimators_') else 0
+        n_trees = round(n_estimators * rows_read / total_rows) - fitted
+        # Every tree must see every class, so a batch missing one is carried into the next fit
+        if n_trees <= 0 or train[target].nunique() < max(n_classes, 2):
+            carry = _update_reservoir(None, train, batch_size, rng)
+            continue
+        carry = None
+        fit_trees(train, n_trees)
+    
+    fitted = len(model.estimators_) if hasattr(model, 'estimators_') else 0
+    if fitted < n_estimators and carry is not None and carry[target].nunique() >= 2:
+        fit_trees(carry.drop(columns='_key'), n_estimators - fitted)
+    elif fitted < n_estimators:
+        logging.warning(f"Out-of-core training fitted only {fitted} of {n_estimators} trees; the data does not cover every class")
+    
+    holdout = holdout.drop(columns='_key')
+    y_test = holdout[target]
+    y_pred = model.predict(preprocessor.transform(holdout))
+    accuracy = accuracy_score(y_test, y_pred)
+    print(f"Model Accuracy: {accuracy}")
+    print(classification_report(y_test, y_pred))
+    
+    logging.info(f"Out-of-core Machine Learning model trained with accuracy: {accuracy}")
+    metrics = {'accuracy': accuracy, 'classification_report': classification_report(y_test, y_pred, output_dict=True)}
+    return model, metrics, preprocessor
 
 def quantum_feature_map(feature):
     """
@@ -118,46 +199,129 @@ def quantum_feature_map(feature):
     # For simplicity, we're just returning the count of the most common outcome
     return max(counts, key=counts.get)
 
-def quantum_enhanced_analysis(df):
+def quantum_feature_map_vectorized(features, shots=None, seed=None):
+    """
+    Closed-form quantum_feature_map for a whole column at once.
+    
+    An RX(theta) rotation of |0> measures 1 with probability sin^2(theta / 2), so the
+    most common outcome follows directly without simulating any circuit.
+    
+    :param features: Array of numerical feature values
+    :param shots: If given, sample this many shots per value instead of using the exact distribution
+    :param seed: Seed for the shot sampling
+    :return: numpy array with the most common outcome for each value
+    """
+    p_one = np.sin(np.asarray(features, dtype=np.float64) / 2) ** 2
+    if shots is None:
+        ones = p_one > 0.5
+    else:
+        ones_count = np.random.default_rng(seed).binomial(shots, np.nan_to_num(p_one))
+        ones = ones_count > shots - ones_count
+    return QUANTUM_OUTCOMES[ones.astype(np.intp)]
+
+def quantum_feature_map_batch(features, shots=1000):
+    """
+    Run quantum_feature_map for a whole column as a single simulator job, for cross-checking.
+    
+    One circuit is built per distinct value, and all circuits are submitted together.
+    
+    :param features: Array of numerical feature values
+    :param shots: Number of shots per circuit
+    :return: numpy array with the most common outcome for each value
+    """
+    features = pd.Series(features)
+    values = features.dropna().unique()
+    circuits = []
+    for value in values:
+        qc = QuantumCircuit(1, 1)
+        qc.rx(float(value), 0)
+        qc.measure_all()
+        circuits.append(qc)
+    
+    backend = Aer.get_backend('qasm_simulator')
+    result = execute(circuits, backend, shots=shots).result()
+    outcomes = {}
+    for value, qc in zip(values, circuits):
+        counts = result.get_counts(qc)
+        outcomes[value] = max(counts, key=counts.get)
+    return features.map(outcomes).to_numpy()
+
+def quantum_enhanced_analysis(df, mode='analytic', shots=1000, seed=None):
     """
     Simulate a quantum-enhanced data analysis by mapping features to quantum states.
     
     :param df: Preprocessed DataFrame
+    :param mode: 'analytic' for exact probabilities, 'sampled' for seeded shot sampling,
+                 or 'simulator' to run each column as one batched simulator job
+    :param shots: Number of shots for the 'sampled' and 'simulator' modes
+    :param seed: Seed for the 'sampled' mode; each column samples from its own stream derived from it
     """
     quantum_features = {}
-    for feature in df.columns:
-        quantum_features[feature] = df[feature].apply(quantum_feature_map)
+    # Independent shot noise per column, reproducible from the one seed
+    column_seeds = np.random.SeedSequence(seed).spawn(len(df.columns))
+    for feature, column_seed in zip(df.columns, column_seeds):
+        if mode == 'simulator':
+            states = quantum_feature_map_batch(df[feature], shots=shots)
+        else:
+            states = quantum_feature_map_vectorized(df[feature], shots=shots if mode == 'sampled' else None, seed=column_seed)
+        quantum_features[feature] = pd.Series(states, index=df.index)
     
     # This would typically be where you would perform quantum analysis or quantum machine learning
     # For now, we'll just visualize the quantum state distributions
+    jobs = []
     for feature, quantum_states in quantum_features.items():
-        plt.figure(figsize=(10, 6))
-        plot_histogram(quantum_states.value_counts().to_dict())
-        plt.title(f'Quantum State Distribution for {feature}')
-        plt.savefig(f'quantum_distribution_{feature}.png')
-        plt.close()
+        counts = quantum_states.value_counts().sort_index().rename_axis('state').reset_index(name='count')
+        jobs.append(chart_job('bar', f'quantum_distribution_{feature}.png', counts, x='state', y='count', figsize=(10, 6),
+                              title=f'Quantum State Distribution for {feature}'))
+    render_charts(jobs)
     
     logging.info("Quantum-enhanced analysis performed")
 
-def automate_daily_checks(model, data_path):
+def score_new_records(model, preprocessor, data_path, state_name='daily_check'):
+    """
+    Score only the records appended to the data file since the last run.
+    
+    Flagged records are written to the alert table and the watermark is
+    committed after each batch, so an interrupted run resumes where it stopped.
+    
+    :param model: Trained machine learning model
+    :param preprocessor: FraudPreprocessor fitted at training time
+    :param data_path: Path to the daily data file
+    :param state_name: Name of the persisted watermark
+    :return: Number of records scored
+    """
+    scored = 0
+    for batch, watermark in iter_appended_rows(data_path, state_name):
+        if not batch.empty:
+            batch_preprocessed = preprocessor.transform(batch)
+            predictions = model.predict(batch_preprocessed)
+            
+            # Assuming 1 indicates fraud/waste/abuse
+            flagged = batch.index[np.asarray(predictions) == 1]
+            transaction_ids = batch.loc[flagged, 'transaction_id'] if 'transaction_id' in batch.columns else None
+            record_alerts(data_path, flagged, transaction_ids, generation=watermark['generation'])
+            for idx in flagged:
+                logging.warning(f"Potential issue detected in record {idx}")
+            scored += len(batch)
+        commit_watermark(state_name, watermark)
+    return scored
+
+def automate_daily_checks(model, preprocessor, data_path):
     """
     Schedule daily checks for new data and apply the trained model.
     
     :param model: Trained machine learning model
+    :param preprocessor: FraudPreprocessor fitted at training time
     :param data_path: Path to the daily data file
     """
     def daily_check():
         try:
-            new_data = load_data(data_path)
-            new_data_preprocessed = preprocess_data(new_data)
-            predictions = model.predict(new_data_preprocessed)
-            
-            # Log or act on predictions
-            for idx, prediction in enumerate(predictions):
-                if prediction == 1:  # Assuming 1 indicates fraud/waste/abuse
-                    logging.warning(f"Potential issue detected in record {idx}")
-            
-            logging.info("Daily check completed")
+            scored = score_new_records(model, preprocessor, data_path)
+            # Fold the same new rows into the dashboard's rollup cube and publish the
+            # refreshed data to the web workers
+            update_cube(data_path)
+            publish_shared_dataset(data_path)
+            logging.info(f"Daily check completed, {scored} new records scored")
         except Exception as e:
             logging.error(f"Error during daily check: {str(e)}")
     
@@ -169,28 +333,46 @@ def automate_daily_checks(model, data_path):
         time.sleep(60)  # Check every minute
 
 def main():
-    # Load the data
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
-    
-    # Preprocess the data
-    df_preprocessed = preprocess_data(df)
     
-    # Analyze the data
-    analyze_data(df_preprocessed)
+    # Reuse the saved model when neither the data nor the hyperparameters changed
+    fingerprint = training_fingerprint(data_path, MODEL_PARAMS)
+    artifact = load_artifact(fingerprint)
+    if artifact is not None:
+        model, preprocessor = artifact['model'], artifact['preprocessor']
     
-    # Prepare features and target for ML
-    X = df_preprocessed.drop('fraud_flag', axis=1)  # Assuming 'fraud_flag' is the target variable
-    y = df_preprocessed['fraud_flag']
-    
-    # Train the model
-    model = train_ml_model(X, y)
-    
-    # Quantum-enhanced analysis
-    quantum_enhanced_analysis(df_preprocessed)
+    if os.path.getsize(data_path) > OUT_OF_CORE_THRESHOLD_BYTES:
+        # Too large to hold in memory: train from the columnar cache in batches. The exploratory
+        # and quantum analyses need the whole frame in memory, so they are skipped for such files.
+        if artifact is None:
+            model, metrics, preprocessor = train_ml_model_chunked(data_path)
+            save_artifact(fingerprint, model, preprocessor, metrics, MODEL_PARAMS)
+        logging.info(f"{data_path} is too large to load; skipping analyze_data and quantum_enhanced_analysis")
+    else:
+        df = load_data(data_path)
+        
+        # Fit the preprocessing once; it is saved with the model for scoring
+        if artifact is None:
+            preprocessor = FraudPreprocessor().fit(df)
+        df_preprocessed = preprocess_data(df, preprocessor)
+        
+        # Analyze the data
+        analyze_data(df_preprocessed)
+        
+        if artifact is None:
+            # Prepare features and target for ML
+            X = df_preprocessed
+            y = df['fraud_flag']  # Assuming 'fraud_flag' is the target variable
+            
+            # Train the model
+            model, metrics = train_ml_model(X, y)
+            save_artifact(fingerprint, model, preprocessor, metrics, MODEL_PARAMS)
+        
+        # Quantum-enhanced analysis
+        quantum_enhanced_analysis(df_preprocessed)
     
     # Start automation
-    automate_daily_checks(model, data_path)
+    automate_daily_checks(model, preprocessor, data_path)
 
 if __name__ == "__main__":
     main()
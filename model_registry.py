@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import fcntl
+import shutil
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import joblib
+
+from data_loader import file_fingerprint, temp_path
+
+# Versioned store of trained fraud models. Each version holds the fitted
+# model, its preprocessing state and its metrics, keyed by a fingerprint of
+# the training data and hyperparameters so unchanged inputs are never retrained.
+
+REGISTRY_DIR = 'models'
+_INDEX_FILE = 'index.json'
+# Registrations from concurrent threads and processes number their versions one at a time
+_INDEX_LOCK = threading.Lock()
+
+
+def training_fingerprint(data_path, params):
+    """
+    Fingerprint a training run by the content of its data and its hyperparameters.
+
+    :param data_path: Path to the training data file
+    :param params: Dictionary of model hyperparameters
+    :return: Hex digest identifying the training run
+    """
+    payload = json.dumps({'data': file_fingerprint(data_path)['sha256'], 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _read_index(registry_dir):
+    try:
+        with open(os.path.join(registry_dir, _INDEX_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'versions': []}
+
+
+def _write_index(registry_dir, index):
+    path = os.path.join(registry_dir, _INDEX_FILE)
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_artifact(fingerprint, model, preprocessor, metrics, params, registry_dir=REGISTRY_DIR):
+    """
+    Save a trained model with its preprocessing state and metrics as a new version.
+
+    Arrays are dumped uncompressed so load_artifact can memory-map them.
+
+    :param fingerprint: Training fingerprint from training_fingerprint
+    :param model: Fitted model
+    :param preprocessor: Fitted FraudPreprocessor
+    :param metrics: Dictionary of evaluation metrics
+    :param params: Dictionary of model hyperparameters
+    :param registry_dir: Directory holding the registry
+    :return: Path of the saved version directory
+    """
+    os.makedirs(registry_dir, exist_ok=True)
+    # The model is written outside the lock; only numbering and publishing the version are serialized
+    tmp_dir = tempfile.mkdtemp(prefix=f'{fingerprint[:12]}.', suffix='.tmp', dir=registry_dir)
+    try:
+        joblib.dump(model, os.path.join(tmp_dir, 'model.joblib'))
+        joblib.dump(preprocessor, os.path.join(tmp_dir, 'preprocessor.joblib'))
+        with _INDEX_LOCK, open(os.path.join(registry_dir, f'{_INDEX_FILE}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = _read_index(registry_dir)
+                version = len(index['versions']) + 1
+                version_dir = os.path.join(registry_dir, f'v{version:04d}_{fingerprint[:12]}')
+                manifest = {
+                    'version': version,
+                    'fingerprint': fingerprint,
+                    'params': params,
+                    'metrics': metrics,
+                    'created_at': datetime.now().isoformat(),
+                }
+                with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+                    json.dump(manifest, f, indent=2)
+                os.replace(tmp_dir, version_dir)
+                index['versions'].append({'version': version, 'fingerprint': fingerprint,
+                                          'path': os.path.basename(version_dir)})
+                _write_index(registry_dir, index)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logging.info(f"Model version {version} saved to {version_dir}")
+    return version_dir
+
+
+def load_artifact(fingerprint, registry_dir=REGISTRY_DIR, mmap_mode='r'):
+    """
+    Load the most recent version saved under a training fingerprint.
+
+    :param fingerprint: Training fingerprint from training_fingerprint
+    :param registry_dir: Directory holding the registry
+    :param mmap_mode: joblib memory-map mode for the model arrays, or None to read them into memory
+    :return: Dictionary with 'model', 'preprocessor' and 'manifest', or None if no version matches
+    """
+    matches = [v for v in _read_index(registry_dir)['versions'] if v['fingerprint'] == fingerprint]
+    if not matches:
+        return None
+    version_dir = os.path.join(registry_dir, matches[-1]['path'])
+    try:
+        with open(os.path.join(version_dir, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        artifact = {
+            'model': joblib.load(os.path.join(version_dir, 'model.joblib'), mmap_mode=mmap_mode),
+            'preprocessor': joblib.load(os.path.join(version_dir, 'preprocessor.joblib')),
+            'manifest': manifest,
+        }
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logging.error(f"Model version in {version_dir} is incomplete: {str(e)}")
+        return None
+    logging.info(f"Loaded model version {manifest['version']} from {version_dir}")
+    return artifact
@@ -1,80 +1,315 @@
 import pandas as pd
+import numpy as np
+import scipy.sparse as sp
 import networkx as nx
-import matplotlib.pyplot as plt
+import heapq
+import json
+import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from data_loader import CACHE_DIR, temp_path
+from chart_rendering import render_chart
+from collusion_detection import detect_collusion
 
 # Setting up logging
 logging.basicConfig(filename='network_analysis.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
+LAYOUT_CACHE = os.path.join(CACHE_DIR, 'network_layout.json')
+MAX_LAYOUT_CACHE_NODES = 5000
+
+def build_edge_table(df):
     """
-    Load data from a CSV file into a pandas DataFrame.
+    Aggregate transactions into one row per department-vendor pair.
     
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
+    :param df: DataFrame with transaction details
+    :return: DataFrame with department, vendor, total_amount, transaction_count, max_amount
+             and, when dates are available, first_date and last_date
     """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
+    aggregations = {
+        'total_amount': ('amount', 'sum'),
+        'transaction_count': ('amount', 'size'),
+        'max_amount': ('amount', 'max'),
+    }
+    if 'date' in df.columns:
+        aggregations['first_date'] = ('date', 'min')
+        aggregations['last_date'] = ('date', 'max')
+    return df.groupby(['department', 'vendor'], sort=False, observed=True).agg(**aggregations).reset_index()
+
+def build_adjacency_matrix(edges, weight='total_amount'):
+    """
+    Build a symmetric sparse adjacency matrix from an edge table.
+    
+    :param edges: Edge table from build_edge_table
+    :param weight: Edge table column used as the edge weight
+    :return: Tuple of (scipy CSR matrix, pandas Index of node names)
+    """
+    nodes = pd.Index(pd.unique(pd.concat([edges['department'], edges['vendor']], ignore_index=True)))
+    rows = nodes.get_indexer(edges['department'])
+    cols = nodes.get_indexer(edges['vendor'])
+    values = edges[weight].to_numpy(dtype=np.float64)
+    matrix = sp.coo_matrix((np.concatenate([values, values]), (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+                           shape=(len(nodes), len(nodes))).tocsr()
+    return matrix, nodes
 
 def build_network(df):
     """
     Build a network graph from transaction data to find relationships.
     
+    Edges carry the aggregated totals of all transactions between a department
+    and a vendor; 'weight' is the total amount.
+    
     :param df: DataFrame with transaction details
     :return: NetworkX graph object
     """
-    G = nx.Graph()
-    
-    # Adding edges based on transactions between departments or entities
-    for _, row in df.iterrows():
-        G.add_edge(row['department'], row['vendor'], weight=row['amount'])
+    edges = build_edge_table(df)
+    edges['weight'] = edges['total_amount']
+    G = nx.from_pandas_edgelist(edges, 'department', 'vendor', edge_attr=True)
     
     logging.info(f"Network graph built with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
     return G
 
-def analyze_network(G):
+def _betweenness_partial(G, sources):
+    """
+    Unnormalized betweenness contributions of a set of pivot sources; runs in a worker process.
+    """
+    return nx.betweenness_centrality_subset(G, sources=sources, targets=list(G), normalized=False)
+
+def betweenness_error_bound(n, k, delta=0.1):
+    """
+    Hoeffding bound on the normalized betweenness error from k sampled pivots.
+    
+    With probability at least 1 - delta, every node's estimate is within the
+    returned bound of its exact normalized betweenness.
+    
+    :param n: Number of nodes
+    :param k: Number of pivots
+    :param delta: Failure probability across all nodes
+    :return: Maximum absolute error
+    """
+    if k >= n or n < 3:
+        return 0.0
+    return n / (n - 1) * np.sqrt(np.log(2 * n / delta) / (2 * k))
+
+def pivot_budget(n, epsilon, delta=0.1):
+    """
+    Number of pivots needed for betweenness_error_bound to fall below epsilon.
+    """
+    return min(n, int(np.ceil(np.log(2 * n / delta) / (2 * (epsilon * (n - 1) / n) ** 2))))
+
+def compute_betweenness(G, mode='approximate', k=None, epsilon=0.05, delta=0.1, scope='graph',
+                        ego_node=None, ego_radius=2, n_workers=None, seed=42):
+    """
+    Compute betweenness centrality within a budget.
+    
+    'approximate' samples k pivot sources (or enough for the epsilon bound) and
+    extrapolates. 'exact' uses every node as a source, so it is usually combined
+    with a restricted scope. Sources are split across a process pool and the
+    partial scores are summed.
+    
+    :param G: NetworkX graph object
+    :param mode: 'approximate' or 'exact'
+    :param k: Number of pivots; derived from epsilon and delta if omitted
+    :param epsilon: Target maximum error when k is omitted
+    :param delta: Failure probability of the error bound
+    :param scope: 'graph', 'largest_component', or 'ego' for the ego-subgraph of ego_node
+    :param ego_node: Center node for the 'ego' scope
+    :param ego_radius: Radius of the ego-subgraph
+    :param n_workers: Number of worker processes; computed in-process if None
+    :param seed: Seed for pivot sampling
+    :return: Tuple of (dictionary of normalized betweenness, error bound)
+    """
+    if scope == 'largest_component':
+        G = G.subgraph(max(nx.connected_components(G), key=len))
+    elif scope == 'ego':
+        G = nx.ego_graph(G, ego_node, radius=ego_radius)
+    
+    nodes = list(G)
+    n = len(nodes)
+    if n < 3:
+        return {node: 0.0 for node in nodes}, 0.0
+    if mode == 'exact':
+        k = n
+    elif k is None:
+        k = pivot_budget(n, epsilon, delta)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    pivots = nodes if k == n else [nodes[i] for i in rng.choice(n, size=k, replace=False)]
+    
+    if n_workers is None or n_workers <= 1:
+        partials = [_betweenness_partial(G, pivots)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            batches = [pivots[i::n_workers] for i in range(n_workers)]
+            partials = list(executor.map(_betweenness_partial, [G] * len(batches), batches))
+    
+    # The subset routine halves undirected scores; undo that, extrapolate from k pivots and normalize
+    scale = 2 * n / (k * (n - 1) * (n - 2))
+    betweenness = dict.fromkeys(nodes, 0.0)
+    for partial in partials:
+        for node, value in partial.items():
+            betweenness[node] += value * scale
+    
+    error_bound = betweenness_error_bound(n, k, delta)
+    logging.info(f"Betweenness computed with {k} of {n} pivots, error bound {error_bound:.4f}")
+    return betweenness, error_bound
+
+def select_render_subgraph(G, centrality, max_nodes=200, top_n=10, flagged_vendors=None):
+    """
+    Pick a bounded subgraph worth drawing.
+    
+    With flagged vendors, the communities containing them are drawn; otherwise the
+    top_n most central nodes with their strongest neighbours. Either way at most
+    max_nodes nodes are kept, preferring the most central ones.
+    
+    :param G: NetworkX graph object
+    :param centrality: Dictionary of node centrality used to rank nodes
+    :param max_nodes: Maximum number of nodes to draw
+    :param top_n: Number of central nodes whose ego-networks are drawn
+    :param flagged_vendors: Optional vendors whose communities should be drawn
+    :return: NetworkX subgraph view
+    """
+    flagged = [vendor for vendor in (flagged_vendors or []) if vendor in G]
+    if flagged:
+        nodes = set()
+        for community in nx.community.label_propagation_communities(G):
+            if not community.isdisjoint(flagged):
+                nodes |= community
+        if len(nodes) > max_nodes:
+            nodes = set(flagged[:max_nodes]) | set(heapq.nlargest(max_nodes - min(len(flagged), max_nodes), nodes - set(flagged), key=centrality.get))
+        return G.subgraph(nodes)
+    
+    top = heapq.nlargest(top_n, centrality, key=centrality.get)
+    nodes = set(top[:max_nodes])
+    for node in top:
+        neighbours = sorted(G[node], key=lambda v: G[node][v].get('weight', 1), reverse=True)
+        for neighbour in neighbours:
+            if len(nodes) >= max_nodes:
+                break
+            nodes.add(neighbour)
+    return G.subgraph(nodes)
+
+def _load_layout(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            return {node: tuple(xy) for node, xy in json.load(f).items()}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def layout_subgraph(H, cache_path=LAYOUT_CACHE, iterations=50, seed=42, max_cached_nodes=MAX_LAYOUT_CACHE_NODES):
+    """
+    Lay out a subgraph, reusing node positions persisted by earlier runs.
+    
+    Only nodes without a stored position are moved by the spring layout, so
+    layout cost depends on the number of new nodes. The cache is bounded to the
+    most recently drawn nodes.
+    
+    :param H: NetworkX graph to lay out
+    :param cache_path: JSON file with persisted node positions
+    :param iterations: Spring layout iterations for new nodes
+    :param seed: Seed for the spring layout
+    :param max_cached_nodes: Number of most recently drawn node positions kept in the cache
+    :return: Dictionary of node positions
+    """
+    cached = _load_layout(cache_path)
+    known = {node: cached[node] for node in H if node in cached}
+    if len(known) == H.number_of_nodes():
+        pos = known
+    elif known:
+        pos = nx.spring_layout(H, pos=known, fixed=list(known), iterations=iterations, seed=seed, weight=None)
+    else:
+        pos = nx.spring_layout(H, iterations=iterations, seed=seed, weight=None)
+    
+    # Nodes drawn now move to the end, so the cache keeps the most recently drawn ones
+    for node in H:
+        cached.pop(node, None)
+    cached.update({node: (float(x), float(y)) for node, (x, y) in pos.items()})
+    cached = dict(list(cached.items())[-max_cached_nodes:])
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = temp_path(cache_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(cached, f)
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Laid out {H.number_of_nodes() - len(known)} new nodes, reused {len(known)} cached positions")
+    return pos
+
+def draw_network(G, centrality, output_path='transaction_network.png', max_nodes=200, top_n=10, flagged_vendors=None):
+    """
+    Draw a bounded, readable view of the transaction network.
+    
+    :param G: NetworkX graph object
+    :param centrality: Dictionary of node centrality used to pick and label nodes
+    :param output_path: Path of the PNG to write
+    :param max_nodes: Maximum number of nodes to draw
+    :param top_n: Number of central nodes to label
+    :param flagged_vendors: Optional vendors whose communities should be drawn
+    """
+    H = select_render_subgraph(G, centrality, max_nodes, top_n, flagged_vendors)
+    pos = layout_subgraph(H)
+    positions = pd.DataFrame([(node, x, y) for node, (x, y) in pos.items()], columns=['node', 'x', 'y'])
+    edges = pd.DataFrame(list(H.edges()), columns=['source', 'target'])
+    labels = heapq.nlargest(top_n, H, key=centrality.get) + [v for v in (flagged_vendors or []) if v in H]
+    render_chart('network', output_path, {'positions': positions, 'edges': edges},
+                 labels=sorted(set(labels)), node_size=300,
+                 title=f'Network of Transactions ({H.number_of_nodes()} of {G.number_of_nodes()} nodes)')
+
+def analyze_network(G, betweenness_mode='approximate', k=None, epsilon=0.05, scope='graph', n_workers=None,
+                    flagged_vendors=None, max_render_nodes=200):
     """
     Analyze the network for potential collusion or unusual patterns.
     
     :param G: NetworkX graph object
+    :param betweenness_mode: 'approximate' (pivot sampling) or 'exact'
+    :param k: Number of betweenness pivots; derived from epsilon if omitted
+    :param epsilon: Target maximum betweenness error when k is omitted
+    :param scope: Betweenness scope: 'graph', 'largest_component' or 'ego'
+    :param n_workers: Number of worker processes for betweenness
+    :param flagged_vendors: Optional vendors whose communities are drawn
+    :param max_render_nodes: Maximum number of nodes drawn in the network plot
     """
     # Degree centrality - to find key players
     degree_centrality = nx.degree_centrality(G)
     
     # Betweenness centrality - to find nodes that control the flow
-    betweenness_centrality = nx.betweenness_centrality(G)
+    betweenness_centrality, error_bound = compute_betweenness(G, mode=betweenness_mode, k=k, epsilon=epsilon,
+                                                              scope=scope, n_workers=n_workers)
     
-    # Plot the network
-    plt.figure(figsize=(12, 12))
-    pos = nx.spring_layout(G)
-    nx.draw(G, pos, with_labels=True, node_color='lightblue', edge_color='gray', node_size=500, font_size=8, font_weight='bold')
-    plt.title('Network of Transactions')
-    plt.savefig('transaction_network.png')
-    plt.close()
+    # Plot a bounded subgraph around the most central or flagged nodes
+    draw_network(G, degree_centrality, max_nodes=max_render_nodes, flagged_vendors=flagged_vendors)
     
     # Log top 5 nodes by degree and betweenness centrality
-    top_degree = sorted(degree_centrality.items(), key=lambda x: x[1], reverse=True)[:5]
-    top_betweenness = sorted(betweenness_centrality.items(), key=lambda x: x[1], reverse=True)[:5]
+    log_top_nodes(degree_centrality, betweenness_centrality, error_bound)
+
+def log_top_nodes(degree_centrality, betweenness_centrality, error_bound=0.0, n=5):
+    """
+    Log the top nodes by degree and betweenness centrality.
     
-    logging.info("Top 5 nodes by degree centrality:")
+    :param degree_centrality: Dictionary of degree centrality
+    :param betweenness_centrality: Dictionary of betweenness centrality
+    :param error_bound: Maximum betweenness error to report
+    :param n: Number of nodes to log
+    """
+    top_degree = heapq.nlargest(n, degree_centrality.items(), key=lambda x: x[1])
+    top_betweenness = heapq.nlargest(n, betweenness_centrality.items(), key=lambda x: x[1])
+    
+    logging.info(f"Top {n} nodes by degree centrality:")
     for node, centrality in top_degree:
         logging.info(f"{node}: {centrality}")
     
-    logging.info("Top 5 nodes by betweenness centrality:")
+    logging.info(f"Top {n} nodes by betweenness centrality (error bound {error_bound:.4f}):")
     for node, centrality in top_betweenness:
         logging.info(f"{node}: {centrality}")
 
 def main():
+    # graph_store builds on this module, so it is imported here rather than at the top
+    from graph_store import update_graph_store, analyze_graph_store
+
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
-    G = build_network(df)
-    analyze_network(G)
+    # Only the rows appended since the last run are read; the stored graph covers the rest
+    store = update_graph_store(data_path)
+    analyze_graph_store(store)
+    detect_collusion(store['edges'])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,334 @@
+import json
+import os
+import glob
+import fcntl
+import shutil
+import logging
+from datetime import datetime
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CACHE_DIR, iter_appended_rows, read_watermark, commit_watermark, reset_watermark, temp_path
+from alert_store import publish_event
+
+# Setting up logging
+logging.basicConfig(filename='olap_cube.log', level=logging.INFO,
+                    format='%(asctime)s:%(levelname)s:%(message)s')
+
+# Pre-aggregated rollup cube over the spending data that the dashboard reads
+# instead of the transactions. Each materialized cuboid is the transactions
+# grouped by a subset of DIMENSIONS, holding additive measures only, so rows
+# appended to the data file are folded in by adding their own rollup to every
+# cuboid. A slice is answered by an index lookup on the smallest materialized
+# cuboid that covers it.
+
+CUBE_DIR = os.path.join(CACHE_DIR, 'olap_cube')
+DIMENSIONS = ['year', 'month', 'department', 'category', 'vendor']
+MEASURES = ['rows', 'amount', 'fraud_count', 'fraud_amount']
+# Every combination of the low-cardinality dimensions, plus the vendor cuboids
+# the dashboard drills into; vendor is kept out of the other combinations, as
+# each of those would be nearly as large as the transactions themselves
+CUBOIDS = [dims for size in range(5) for dims in combinations(DIMENSIONS[:4], size)] + [
+    ('vendor',), ('department', 'vendor'), tuple(DIMENSIONS)]
+# Number of update notes kept for the dashboard's update list
+UPDATE_HISTORY = 20
+
+
+def cuboid_name(dims):
+    """
+    File-safe name of a cuboid.
+    """
+    return '-'.join(dims) or 'all'
+
+
+def _empty_cuboid(dims):
+    frame = pd.DataFrame({measure: pd.Series(dtype=np.float64 if 'amount' in measure else np.int64) for measure in MEASURES})
+    if len(dims) > 1:
+        frame.index = pd.MultiIndex.from_arrays([[] for _ in dims], names=list(dims))
+    elif dims:
+        frame.index = pd.Index([], name=dims[0])
+    else:
+        frame.loc['*'] = 0
+    return frame
+
+
+def _empty_cube():
+    return {
+        'cuboids': {dims: _empty_cuboid(dims) for dims in CUBOIDS},
+        'meta': {'version': 0, 'watermark': None, 'updated_at': None, 'updates': []},
+    }
+
+
+def base_rollup(batch):
+    """
+    Aggregate transactions to the finest cube grain.
+
+    :param batch: DataFrame of transactions with date, department, category, vendor, amount and fraud_flag
+    :return: DataFrame indexed by DIMENSIONS with the MEASURES columns
+    """
+    dates = pd.to_datetime(batch['date'], errors='coerce')
+    fraud = batch['fraud_flag'].fillna(0).astype(bool) if 'fraud_flag' in batch.columns else pd.Series(False, index=batch.index)
+    amount = batch['amount'].fillna(0.0)
+    work = pd.DataFrame({
+        'year': dates.dt.year.fillna(-1).astype(np.int64),
+        'month': dates.dt.month.fillna(-1).astype(np.int64),
+        'department': batch['department'].fillna('Unknown').astype(str),
+        'category': batch['category'].fillna('Unknown').astype(str),
+        'vendor': batch['vendor'].fillna('Unknown').astype(str),
+        'rows': np.ones(len(batch), dtype=np.int64),
+        'amount': amount,
+        'fraud_count': fraud.astype(np.int64),
+        'fraud_amount': amount.where(fraud, 0.0),
+    })
+    return work.groupby(DIMENSIONS, sort=False).sum()
+
+
+def apply_delta(cube, base):
+    """
+    Fold the base rollup of new transactions into every cuboid.
+
+    :param cube: Cube dictionary, updated in place
+    :param base: DataFrame from base_rollup
+    """
+    for dims in CUBOIDS:
+        if dims:
+            delta = base.groupby(level=list(dims), sort=False).sum()
+        else:
+            delta = base.sum().to_frame('*').T
+        current = cube['cuboids'][dims]
+        merged = current.add(delta, fill_value=0) if len(current) else delta
+        cube['cuboids'][dims] = merged.astype(current.dtypes.to_dict()).sort_index()
+
+
+def load_cube(cube_dir=CUBE_DIR):
+    """
+    Load the persisted cube.
+
+    :param cube_dir: Directory holding the cube
+    :return: Dictionary with 'cuboids' by dimension tuple and 'meta', whose 'version' is the version
+             loaded; empty with version 0 if nothing was stored yet
+    """
+    try:
+        with open(os.path.join(cube_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return _empty_cube()
+    version_dir = os.path.join(cube_dir, f"v{meta['version']}")
+    cuboids = {}
+    for dims in CUBOIDS:
+        path = os.path.join(version_dir, f'{cuboid_name(dims)}.parquet')
+        cuboids[dims] = pd.read_parquet(path) if os.path.exists(path) else _empty_cuboid(dims)
+    return {'cuboids': cuboids, 'meta': meta}
+
+
+def save_cube(cube, cube_dir=CUBE_DIR):
+    """
+    Persist the cube as a new version directory. meta.json is replaced last, so readers never see a mixed version.
+
+    The previous version is kept for readers still loading it and removed by
+    the next save.
+
+    :param cube: Cube dictionary
+    :param cube_dir: Directory holding the cube
+    """
+    meta = dict(cube['meta'])
+    previous = meta.get('version', 0)
+    meta['version'] = previous + 1
+    version_dir = os.path.join(cube_dir, f"v{meta['version']}")
+    os.makedirs(version_dir, exist_ok=True)
+    for dims, cuboid in cube['cuboids'].items():
+        cuboid.to_parquet(os.path.join(version_dir, f'{cuboid_name(dims)}.parquet'))
+    meta_path = os.path.join(cube_dir, 'meta.json')
+    tmp_path = temp_path(meta_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+    cube['meta'] = meta
+    keep = {f"v{meta['version']}", f'v{previous}'}
+    for path in glob.glob(os.path.join(cube_dir, 'v*')):
+        if os.path.basename(path) not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def update_cube(data_path, cube_dir=CUBE_DIR, state_name='olap_cube'):
+    """
+    Fold the transactions appended since the last run into the cube.
+
+    Updates are serialized across processes with a lock file in the cube
+    directory, so a dashboard building a missing cube and the daily check
+    never write versions at the same time.
+
+    :param data_path: Path to the transaction data file
+    :param cube_dir: Directory holding the cube
+    :param state_name: Name of the persisted watermark
+    :return: Updated cube dictionary
+    """
+    os.makedirs(cube_dir, exist_ok=True)
+    with open(os.path.join(cube_dir, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return _update_cube(data_path, cube_dir, state_name)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_cube(data_path, cube_dir, state_name):
+    cube = load_cube(cube_dir)
+    # The cube records the watermark it includes; catch up if the last run stopped before committing it
+    stored_watermark = cube['meta'].get('watermark')
+    watermark = read_watermark(state_name)
+    if stored_watermark and (watermark is None or stored_watermark['offset'] > watermark['offset']):
+        commit_watermark(state_name, stored_watermark)
+    elif not stored_watermark and watermark is not None:
+        # No cube holds the rows before the watermark (e.g. the cube directory was removed): start over
+        reset_watermark(state_name)
+
+    added = 0
+    last_watermark = None
+    rebuilt = False
+    categories, departments = set(), set()
+    try:
+        for batch, last_watermark in iter_appended_rows(data_path, state_name):
+            if len(batch) and batch.index[0] == 0 and cube['meta'].get('watermark'):
+                # The data file was replaced, so the stored cube no longer describes it
+                logging.warning(f"{data_path} was rewritten; rebuilding the cube from scratch")
+                cube = dict(_empty_cube(), meta=cube['meta'])
+                added = 0
+                rebuilt = True
+            if len(batch):
+                base = base_rollup(batch)
+                apply_delta(cube, base)
+                categories.update(base.index.unique(level='category'))
+                departments.update(base.index.unique(level='department'))
+                added += len(batch)
+    except Exception as e:
+        logging.error(f"Error updating the cube from {data_path}: {str(e)}")
+        raise
+    if last_watermark is None:
+        logging.info("Cube is up to date")
+        return cube
+
+    now = datetime.now().isoformat()
+    note = f"{now}: {added:,} new transactions added to the cube"
+    cube['meta'].update(watermark=last_watermark, updated_at=now,
+                        updates=([note] + cube['meta'].get('updates', []))[:UPDATE_HISTORY])
+    save_cube(cube, cube_dir)
+    commit_watermark(state_name, last_watermark)
+    # Open dashboards get only the aggregates this update changed; after a rebuild they reload everything
+    if rebuilt:
+        publish_event('reset', {'lastUpdate': now})
+    else:
+        publish_event('summary', summary_delta(cube, categories, departments))
+    logging.info(f"Cube updated with {added} transactions")
+    return cube
+
+
+def _covering_cuboid(dims):
+    # Smallest materialized cuboid holding every requested dimension
+    candidates = [c for c in CUBOIDS if set(dims) <= set(c)]
+    return min(candidates, key=len)
+
+
+def query_cube(cube, filters=None, group_by=()):
+    """
+    Measures of a slice of the cube, optionally broken down by further dimensions.
+
+    The slice is read by index lookup on the smallest materialized cuboid
+    covering the filtered and grouped dimensions; only when no cuboid matches
+    exactly are that cuboid's matching cells summed.
+
+    :param cube: Cube dictionary
+    :param filters: Dictionary of dimension to value, e.g. {'year': 2024, 'department': 'Defense'}
+    :param group_by: Dimensions to break the slice down by
+    :return: DataFrame of MEASURES, indexed by group_by (one row labelled '*' if group_by is empty)
+    """
+    filters = {dim: value for dim, value in (filters or {}).items() if value is not None}
+    group_by = list(group_by)
+    unknown = [dim for dim in list(filters) + group_by if dim not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown cube dimensions: {', '.join(unknown)}")
+
+    needed = [dim for dim in DIMENSIONS if dim in filters or dim in group_by]
+    dims = _covering_cuboid(needed)
+    cuboid = cube['cuboids'][dims]
+    if not dims:
+        return cuboid
+    selected = cuboid
+    if filters:
+        levels = [dim for dim in dims if dim in filters]
+        try:
+            if len(dims) > 1:
+                selected = cuboid.xs(tuple(filters[dim] for dim in levels), level=levels, drop_level=False)
+            else:
+                selected = cuboid.loc[[filters[dims[0]]]]
+        except KeyError:
+            selected = cuboid.iloc[:0]
+    if not group_by:
+        return selected[MEASURES].sum().to_frame('*').T
+    if list(selected.index.names) == group_by:
+        return selected
+    return selected.groupby(level=group_by, sort=True).sum()
+
+
+def dashboard_summary(cube, filters=None):
+    """
+    Fields the dashboard widgets expect, computed from the cube for one slice.
+
+    :param cube: Cube dictionary
+    :param filters: Dictionary of dimension to value selecting the slice
+    :return: Dictionary with totalRecords, fraudulentCases, wasteAmount, categories, fraudCounts, wasteData, lastUpdate and updates
+    """
+    total = query_cube(cube, filters).iloc[0]
+    by_category = query_cube(cube, filters, ['category'])
+    by_department = query_cube(cube, filters, ['department']).sort_values('fraud_amount', ascending=False)
+    return {
+        'totalRecords': int(total['rows']),
+        'fraudulentCases': int(total['fraud_count']),
+        'wasteAmount': round(float(total['fraud_amount']), 2),
+        'totalAmount': round(float(total['amount']), 2),
+        'categories': [str(c) for c in by_category.index],
+        'fraudCounts': [int(v) for v in by_category['fraud_count']],
+        'wasteData': [{'department': str(d), 'amount': round(float(a), 2)}
+                      for d, a in by_department['fraud_amount'].items()],
+        'lastUpdate': cube['meta'].get('updated_at'),
+        'updates': list(cube['meta'].get('updates', [])),
+    }
+
+
+def summary_delta(cube, categories, departments):
+    """
+    Dashboard fields changed by an update, for pushing to open dashboards.
+
+    Values are the new totals rather than increments, so applying a delta twice is harmless.
+    They describe the whole cube, so dashboards showing a slice reload it instead.
+
+    :param cube: Updated cube dictionary
+    :param categories: Categories the update touched
+    :param departments: Departments the update touched
+    :return: Dictionary with the overall totals, fraudCounts by category and wasteData by department
+    """
+    total = cube['cuboids'][()].iloc[0]
+    by_category = cube['cuboids'][('category',)].loc[sorted(categories)]
+    by_department = cube['cuboids'][('department',)].loc[sorted(departments)]
+    return {
+        'totalRecords': int(total['rows']),
+        'fraudulentCases': int(total['fraud_count']),
+        'wasteAmount': round(float(total['fraud_amount']), 2),
+        'totalAmount': round(float(total['amount']), 2),
+        'fraudCounts': {str(c): int(v) for c, v in by_category['fraud_count'].items()},
+        'wasteData': {str(d): round(float(a), 2) for d, a in by_department['fraud_amount'].items()},
+        'lastUpdate': cube['meta'].get('updated_at'),
+        'update': cube['meta']['updates'][0],
+    }
+
+
+def main():
+    cube = update_cube('government_spending_data.csv')
+    summary = dashboard_summary(cube)
+    logging.info(f"Cube covers {summary['totalRecords']} transactions, {summary['fraudulentCases']} flagged")
+
+
+if __name__ == "__main__":
+    main()
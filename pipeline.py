@@ -0,0 +1,185 @@
+import glob
+import hashlib
+import json
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import joblib
+import pandas as pd
+
+from data_loader import CACHE_DIR, load_data, temp_path
+
+# Runner for analysis stages declared as a DAG. Each stage names the dataset
+# columns it reads and the upstream stages whose outputs it takes; stages run
+# concurrently as soon as their inputs are ready, all on one loaded dataset,
+# and each stage's output is memoized under a hash of exactly those inputs.
+
+PIPELINE_CACHE_DIR = os.path.join(CACHE_DIR, 'pipeline')
+# Memoized outputs kept per stage; the least recently used ones beyond this are deleted
+MEMO_VERSIONS = 3
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    The stage function is called as func(data, *upstream_outputs, **params),
+    where data holds only the declared columns (None if no columns are
+    declared) and upstream outputs follow the order of inputs.
+    """
+
+    def __init__(self, name, func, columns=(), inputs=(), params=None, cache=True, version=1):
+        """
+        :param name: Unique stage name
+        :param func: Stage function
+        :param columns: Dataset columns the stage reads
+        :param inputs: Names of the stages whose outputs the stage takes
+        :param params: Keyword parameters passed to the stage function; part of the memo key
+        :param cache: Memoize the stage's output; disable for stages run for their side effects
+        :param version: Bump when the stage's code changes so memoized outputs are discarded
+        """
+        self.name = name
+        self.func = func
+        self.columns = list(columns)
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.cache = cache
+        self.version = version
+
+
+class Pipeline:
+    """
+    A DAG of stages run with memoization.
+    """
+
+    def __init__(self, stages, cache_dir=PIPELINE_CACHE_DIR, keep_versions=MEMO_VERSIONS):
+        """
+        :param stages: List of Stage objects
+        :param cache_dir: Directory holding the memoized stage outputs
+        :param keep_versions: Number of memoized outputs kept per stage
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self.cache_dir = cache_dir
+        self.keep_versions = keep_versions
+        self.order = self._topological_order()
+
+    def _topological_order(self):
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline has a cycle through stage '{name}'")
+            if name not in self.stages:
+                raise ValueError(f"Unknown pipeline stage '{name}'")
+            visiting.add(name)
+            for upstream in self.stages[name].inputs:
+                visit(upstream)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def columns(self):
+        """
+        Union of the columns read by all stages, in declaration order.
+        """
+        return list(dict.fromkeys(col for name in self.order for col in self.stages[name].columns))
+
+    def _stage_key(self, stage, column_hashes, upstream_keys):
+        payload = json.dumps({
+            'stage': stage.name,
+            'version': stage.version,
+            'columns': {col: column_hashes[col] for col in stage.columns},
+            'params': stage.params,
+            'inputs': upstream_keys,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _cache_path(self, stage, key):
+        return os.path.join(self.cache_dir, f'{stage.name}-{key[:16]}.joblib')
+
+    def _evict(self, stage):
+        # Keep the most recently used outputs of a stage; another run may be removing the same files
+        paths = []
+        for path in glob.glob(os.path.join(self.cache_dir, f"{glob.escape(stage.name)}-{'?' * 16}.joblib")):
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(paths, reverse=True)[self.keep_versions:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _execute(self, stage, data, upstream, key):
+        path = self._cache_path(stage, key)
+        if stage.cache:
+            try:
+                output = joblib.load(path)
+                # Mark the output as recently used so eviction keeps it
+                os.utime(path)
+                logging.info(f"Pipeline stage {stage.name} reused from cache")
+                return output, True
+            except FileNotFoundError:
+                pass
+        stage_data = data[stage.columns] if stage.columns else None
+        output = stage.func(stage_data, *upstream, **stage.params)
+        if stage.cache:
+            tmp_path = temp_path(path)
+            joblib.dump(output, tmp_path)
+            os.replace(tmp_path, path)
+            self._evict(stage)
+        logging.info(f"Pipeline stage {stage.name} computed")
+        return output, False
+
+    def run(self, data, max_workers=None, progress=None):
+        """
+        Run every stage, reusing memoized outputs whose inputs are unchanged.
+
+        :param data: Path to the dataset, or an already loaded DataFrame
+        :param max_workers: Number of stages run at the same time; defaults to one per CPU
+        :param progress: Optional callback progress(fraction, message) called as stages finish
+        :return: Dictionary of stage outputs by stage name
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if not isinstance(data, pd.DataFrame):
+            data = load_data(data, columns=self.columns() or None)
+        # Each column is hashed once and shared by every stage that reads it
+        column_hashes = {col: hashlib.sha256(pd.util.hash_pandas_object(data[col], index=False).to_numpy().tobytes()).hexdigest()
+                         for col in self.columns()}
+
+        keys, outputs, reused = {}, {}, []
+        remaining = list(self.order)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+            while remaining or running:
+                for name in [n for n in remaining if all(u in outputs for u in self.stages[n].inputs)]:
+                    stage = self.stages[name]
+                    keys[name] = self._stage_key(stage, column_hashes, [keys[u] for u in stage.inputs])
+                    upstream = [outputs[u] for u in stage.inputs]
+                    running[executor.submit(self._execute, stage, data, upstream, keys[name])] = name
+                    remaining.remove(name)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        outputs[name], was_cached = future.result()
+                    except Exception as e:
+                        logging.error(f"Pipeline stage {name} failed: {str(e)}")
+                        raise
+                    if was_cached:
+                        reused.append(name)
+                    if progress is not None:
+                        progress(len(outputs) / len(self.order), f"Finished {name}")
+
+        logging.info(f"Pipeline ran {len(self.order) - len(reused)} stages, {len(reused)} reused from cache")
+        return outputs
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import joblib
+import logging
+
+
+class FraudPreprocessor:
+    """
+    Preprocessing learned once at training time and reused at scoring time.
+
+    Stores the imputation means, scaling parameters and categorical
+    vocabularies of the training data, so new batches are transformed into
+    exactly the feature columns the model was trained on.
+    """
+
+    def __init__(self, categorical_columns=('category', 'department'), exclude_columns=('fraud_flag', 'transaction_id')):
+        self.categorical_columns = list(categorical_columns)
+        self.exclude_columns = list(exclude_columns)
+
+    def fit(self, df):
+        """
+        Learn preprocessing parameters from training data.
+
+        :param df: Training DataFrame
+        :return: self
+        """
+        for attr in ('numeric_columns_', '_counts', '_means', '_m2', '_category_values'):
+            self.__dict__.pop(attr, None)
+        self.partial_fit(df)
+        logging.info(f"Preprocessor fitted with {len(self.feature_names_)} features")
+        return self
+
+    def partial_fit(self, df):
+        """
+        Update preprocessing parameters with one batch of training data.
+
+        Means and variances are merged across batches with Chan's parallel
+        update, so fitting batch by batch gives the same parameters as fit().
+
+        :param df: Batch of training data
+        :return: self
+        """
+        if not hasattr(self, 'numeric_columns_'):
+            skip = set(self.categorical_columns) | set(self.exclude_columns)
+            self.numeric_columns_ = [col for col in df.select_dtypes(include=[np.number]).columns if col not in skip]
+            self._counts = np.zeros(len(self.numeric_columns_))
+            self._means = np.zeros(len(self.numeric_columns_))
+            self._m2 = np.zeros(len(self.numeric_columns_))
+            self._category_values = {col: pd.Index([]) for col in self.categorical_columns if col in df.columns}
+
+        numeric = df[self.numeric_columns_]
+        counts = numeric.count().to_numpy(dtype=np.float64)
+        means = np.nan_to_num(numeric.mean().to_numpy(dtype=np.float64))
+        m2 = np.nan_to_num(numeric.var(ddof=0).to_numpy(dtype=np.float64)) * counts
+        total = self._counts + counts
+        delta = means - self._means
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._means = np.where(total > 0, self._means + delta * counts / total, 0.0)
+            self._m2 = np.where(total > 0, self._m2 + m2 + delta ** 2 * self._counts * counts / total, 0.0)
+        self._counts = total
+
+        for col in self._category_values:
+            self._category_values[col] = self._category_values[col].union(pd.Index(df[col].dropna().unique()))
+
+        self._finalize()
+        return self
+
+    def _finalize(self):
+        self.means_ = self._means.copy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stds = np.sqrt(self._m2 / (self._counts - 1))
+        # Constant or empty columns scale to zero instead of dividing by zero
+        self.stds_ = np.where((stds > 0) & np.isfinite(stds), stds, 1.0)
+        self.categories_ = {col: values.sort_values() for col, values in self._category_values.items()}
+        self.feature_names_ = list(self.numeric_columns_)
+        for col, categories in self.categories_.items():
+            # Same naming as pd.get_dummies so feature names stay familiar
+            self.feature_names_.extend(f'{col}_{category}' for category in categories)
+
+    def transform(self, df):
+        """
+        Transform a batch into the fitted feature space in one vectorized pass.
+
+        Missing numeric values are imputed with the training mean, which is
+        zero after scaling. Unseen categories map to all-zero indicators.
+
+        :param df: DataFrame to transform
+        :return: float32 DataFrame with columns feature_names_
+        """
+        n_numeric = len(self.numeric_columns_)
+        out = np.zeros((len(df), len(self.feature_names_)), dtype=np.float32)
+
+        numeric = out[:, :n_numeric]
+        # Fill column by column so no full-frame intermediate copy is made
+        for i, col in enumerate(self.numeric_columns_):
+            numeric[:, i] = df[col].to_numpy(dtype=np.float32, na_value=np.nan)
+        numeric -= self.means_.astype(np.float32)
+        numeric /= self.stds_.astype(np.float32)
+        np.nan_to_num(numeric, copy=False, nan=0.0)
+
+        offset = n_numeric
+        for col, categories in self.categories_.items():
+            codes = pd.Categorical(df[col], categories=categories).codes
+            rows = np.flatnonzero(codes >= 0)
+            out[rows, offset + codes[rows]] = 1.0
+            offset += len(categories)
+
+        return pd.DataFrame(out, columns=self.feature_names_, index=df.index, copy=False)
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def save(self, path):
+        """
+        Persist the fitted preprocessor.
+
+        :param path: Destination file path
+        """
+        joblib.dump(self, path)
+        logging.info(f"Preprocessor saved to {path}")
+
+    @staticmethod
+    def load(path):
+        """
+        Load a fitted preprocessor saved with save().
+
+        :param path: File path of the saved preprocessor
+        :return: FraudPreprocessor
+        """
+        return joblib.load(path)
@@ -27,7 +27,7 @@ function displaySummaryStats(data) {
 // Function to create and display a chart for fraud detection
 function displayFraudDetectionChart(data) {
     const ctx = document.getElementById('fraud-detection-chart').getContext('2d');
-    new Chart(ctx, {
+    return new Chart(ctx, {
         type: 'bar',
         data: {
             labels: data.categories,
@@ -92,26 +92,102 @@ function displayRealTimeUpdates(data) {
     `;
 }
 
+// Merge a pushed delta into the dashboard state; deltas carry new values, not increments
+function applySummaryDelta(state, delta) {
+    ['totalRecords', 'fraudulentCases', 'wasteAmount', 'totalAmount', 'lastUpdate'].forEach(key => {
+        if (key in delta) {
+            state[key] = delta[key];
+        }
+    });
+    Object.entries(delta.fraudCounts || {}).forEach(([category, count]) => {
+        const index = state.categories.indexOf(category);
+        if (index === -1) {
+            state.categories.push(category);
+            state.fraudCounts.push(count);
+        } else {
+            state.fraudCounts[index] = count;
+        }
+    });
+    Object.entries(delta.wasteData || {}).forEach(([department, amount]) => {
+        const item = state.wasteData.find(entry => entry.department === department);
+        if (item) {
+            item.amount = amount;
+        } else {
+            state.wasteData.push({ department, amount });
+        }
+    });
+    state.wasteData.sort((a, b) => b.amount - a.amount);
+    if (delta.update) {
+        state.updates = [delta.update, ...state.updates].slice(0, 20);
+    }
+}
+
+function applyAlertsDelta(state, delta) {
+    state.abuseIncidents = delta.abuseIncidents;
+    state.abuseEvents = [...delta.abuseEvents, ...state.abuseEvents].slice(0, 20);
+}
+
 // Main function to initialize dashboard
 function initDashboard() {
-    // Assuming data is served from a local server or file for this example
-    fetchData('data.json') // or 'http://localhost:5000/data' if using a server
-        .then(data => {
-            displaySummaryStats(data);
-            displayFraudDetectionChart(data);
-            displayWasteAnalysis(data);
-            displayAbuseMonitoring(data);
-            displayRealTimeUpdates(data);
-            
-            // Simulate real-time updates
-            setInterval(() => {
-                fetchData('data.json') // or real-time API endpoint
-                    .then(newData => {
-                        const updatesList = document.getElementById('updates-list');
-                        updatesList.innerHTML += `<li>New update: ${new Date().toLocaleString()}</li>`;
-                    });
-            }, 60000); // Update every minute
+    // Summary figures are served pre-aggregated by the dashboard server (interactive_dashboard.py),
+    // for the slice named in the page's query string (year, month, department, category, vendor)
+    const slice = new URLSearchParams();
+    new URLSearchParams(window.location.search).forEach((value, key) => {
+        if (['year', 'month', 'department', 'category', 'vendor'].includes(key)) {
+            slice.append(key, value);
+        }
+    });
+    const isSlice = slice.toString() !== '';
+    const summaryUrl = isSlice ? `/summary?${slice}` : '/summary';
+    let state = null;
+    let chart = null;
+
+    function render() {
+        displaySummaryStats(state);
+        displayWasteAnalysis(state);
+        displayAbuseMonitoring(state);
+        displayRealTimeUpdates(state);
+        if (chart) {
+            chart.data.labels = state.categories;
+            chart.data.datasets[0].data = state.fraudCounts;
+            chart.update();
+        } else {
+            chart = displayFraudDetectionChart(state);
+        }
+    }
+
+    function load() {
+        return fetchData(summaryUrl).then(data => {
+            if (data) {
+                state = data;
+                render();
+            }
+            return data;
         });
+    }
+
+    load().then(data => {
+        // Changes are pushed as small deltas. The browser resends the last event id when it
+        // reconnects, so the stream resumes where it stopped without reloading the summary.
+        const events = new EventSource(`/events?since=${data ? data.eventSeq : 0}`);
+        events.addEventListener('summary', event => {
+            // Pushed deltas hold overall totals, so a slice is fetched again instead
+            if (!state || isSlice) {
+                return load();
+            }
+            applySummaryDelta(state, JSON.parse(event.data));
+            render();
+        });
+        events.addEventListener('alerts', event => {
+            if (!state) {
+                return load();
+            }
+            applyAlertsDelta(state, JSON.parse(event.data));
+            render();
+        });
+        // The server no longer has the deltas this client missed
+        events.addEventListener('reset', () => load());
+    });
 }
 
 // Initialize the dashboard when the DOM is fully loaded
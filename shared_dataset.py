@@ -0,0 +1,176 @@
+import json
+import os
+import glob
+import fcntl
+import logging
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_loader import CACHE_DIR, ensure_cached, file_fingerprint, temp_path
+
+# One copy of a dataset shared by every web worker process. The dataset is
+# published as an uncompressed Arrow IPC file, which each worker memory-maps:
+# the column buffers live in the OS page cache once, however many workers read
+# them, and pandas frames are built over those buffers without copying. A
+# small CURRENT pointer file names the live version; a refresh writes a new
+# version and swaps the pointer with os.replace, so readers switch atomically.
+# Publishing is left to the daily check; web workers only follow the pointer.
+
+SHARED_DIR = os.path.join(CACHE_DIR, 'shared')
+# Versions kept on disk; the previous one stays for workers still reading it
+KEEP_VERSIONS = 2
+# Publishers in one process take turns; a lock file does the same across processes
+_PUBLISH_LOCK = threading.Lock()
+
+
+def _pointer_path(data_path, shared_dir):
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    return os.path.join(shared_dir, f'{stem}.CURRENT')
+
+
+def read_pointer(data_path, shared_dir=SHARED_DIR):
+    """
+    Live version of a shared dataset.
+
+    :param data_path: Path to the source data file
+    :param shared_dir: Directory holding the shared datasets
+    :return: Pointer dictionary with 'file', 'sha256' and 'rows', or None if nothing was published
+    """
+    try:
+        with open(_pointer_path(data_path, shared_dir), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def publish_shared_dataset(data_path, dataset=None, shared_dir=SHARED_DIR):
+    """
+    Publish the current content of a data file as a memory-mappable Arrow file and point readers at it.
+
+    The Arrow file is written batch by batch from the Parquet cache. Publishers
+    are serialized with a thread lock and a lock file, so concurrent callers
+    publish a version once and never clean up each other's files.
+
+    :param data_path: Path to the source data file
+    :param dataset: Schema name, inferred from the file name if omitted
+    :param shared_dir: Directory holding the shared datasets
+    :return: Pointer dictionary of the published version
+    """
+    os.makedirs(shared_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    with _PUBLISH_LOCK, open(os.path.join(shared_dir, f'{stem}.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            return _publish(data_path, dataset, shared_dir, stem)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _publish(data_path, dataset, shared_dir, stem):
+    sha256 = file_fingerprint(data_path)['sha256']
+    pointer = read_pointer(data_path, shared_dir)
+    if pointer is not None and pointer['sha256'] == sha256:
+        return pointer
+
+    file_name = f'{stem}-{sha256[:16]}.arrow'
+    path = os.path.join(shared_dir, file_name)
+    tmp_path = temp_path(path)
+    try:
+        parquet_file = pq.ParquetFile(ensure_cached(data_path, dataset))
+        # No compression, so readers map the buffers as they are instead of decoding them
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, parquet_file.schema_arrow) as writer:
+            for batch in parquet_file.iter_batches():
+                writer.write_batch(batch)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Error publishing shared dataset for {data_path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    pointer = {'file': file_name, 'sha256': sha256, 'rows': parquet_file.metadata.num_rows}
+    pointer_path = _pointer_path(data_path, shared_dir)
+    tmp_path = temp_path(pointer_path)
+    with open(tmp_path, 'w') as f:
+        json.dump(pointer, f)
+    os.replace(tmp_path, pointer_path)
+
+    # Unlinking a mapped file is safe on POSIX: workers still reading it keep their mapping
+    versions = []
+    for version_path in glob.glob(os.path.join(shared_dir, f'{stem}-*.arrow')):
+        try:
+            versions.append((os.path.getmtime(version_path), version_path))
+        except FileNotFoundError:
+            pass
+    for _, old_path in sorted(versions, reverse=True)[KEEP_VERSIONS:]:
+        if old_path == path:
+            continue
+        try:
+            os.remove(old_path)
+        except FileNotFoundError:
+            pass
+    logging.info(f"Published shared dataset {file_name} with {pointer['rows']} rows")
+    return pointer
+
+
+class SharedDataset:
+    """
+    A worker's view of a shared dataset, following the published version.
+    """
+
+    def __init__(self, data_path, dataset=None, shared_dir=SHARED_DIR, publish=False):
+        """
+        :param data_path: Path to the source data file
+        :param dataset: Schema name, inferred from the file name if omitted
+        :param shared_dir: Directory holding the shared datasets
+        :param publish: Check the source file on every access and publish a new version when it changed,
+                        instead of following what another process (the daily check) published
+        """
+        self.data_path = data_path
+        self.dataset = dataset
+        self.shared_dir = shared_dir
+        self.publish = publish
+        self._lock = threading.Lock()
+        self._pointer = None
+        self._table = None
+        self._frame = None
+
+    def table(self):
+        """
+        The live version as an Arrow table over the memory-mapped file.
+
+        :return: Tuple of (pyarrow Table, content hash of the source file it was published from)
+        """
+        pointer = None if self.publish else read_pointer(self.data_path, self.shared_dir)
+        if pointer is None:
+            # Also on a fresh deployment, before the daily check published a first version
+            pointer = publish_shared_dataset(self.data_path, self.dataset, self.shared_dir)
+        with self._lock:
+            if self._pointer is None or self._pointer['file'] != pointer['file']:
+                source = pa.memory_map(os.path.join(self.shared_dir, pointer['file']), 'r')
+                self._table = pa.ipc.open_file(source).read_all()
+                self._frame = None
+                self._pointer = pointer
+                logging.info(f"Mapped shared dataset {pointer['file']}")
+            return self._table, self._pointer['sha256']
+
+    def frame(self, columns=None):
+        """
+        The live version as a pandas DataFrame backed by the mapped Arrow buffers.
+
+        Columns use pandas' Arrow-backed dtypes, so no column is copied into
+        process memory until an operation needs a converted copy. Text columns
+        are string[pyarrow], so consumers select them with select_dtypes(include=['object', 'string']).
+
+        :param columns: Columns to include; all columns if omitted
+        :return: Tuple of (DataFrame, content hash of the source file it was published from)
+        """
+        table, sha256 = self.table()
+        with self._lock:
+            if self._frame is None or self._table is not table:
+                self._frame = table.to_pandas(types_mapper=pd.ArrowDtype)
+            frame = self._frame
+        return (frame if columns is None else frame[list(columns)]), sha256
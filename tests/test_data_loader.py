@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from data_loader import stratified_sample
+
+
+def _write_spending(path, sizes):
+    departments = np.concatenate([np.full(size, name, dtype=object) for name, size in sizes.items()])
+    df = pd.DataFrame({
+        'transaction_id': np.arange(len(departments)),
+        'department': departments,
+        'amount': np.random.default_rng(0).gamma(2.0, 500.0, len(departments)),
+    })
+    df.to_csv(path, index=False)
+
+
+def test_stratified_sample_meets_total_and_quotas(tmp_path):
+    sizes = {'Energy': 20_231, 'Health': 51_007, 'Defense': 28_388, 'Parks': 260, 'Arts': 114}
+    data_path = tmp_path / 'government_spending_data.csv'
+    _write_spending(data_path, sizes)
+
+    sample, counts = stratified_sample(str(data_path), ['transaction_id', 'amount'], 'department', sample_size=1000,
+                                       min_per_stratum=100, batch_size=7_000, cache_dir=str(tmp_path / 'cache'))
+
+    assert len(sample) == 1000
+    assert counts.to_dict() == sizes
+    sampled = sample['department'].value_counts().to_dict()
+    # Parks and Arts are lifted to the minimum; the other 800 rows are split by size
+    assert sampled['Parks'] == 100
+    assert sampled['Arts'] == 100
+    rest = {name: sizes[name] for name in ('Energy', 'Health', 'Defense')}
+    total = sum(rest.values())
+    for name, size in rest.items():
+        assert abs(sampled[name] - size * 800 / total) < 1
+    assert sample['transaction_id'].is_unique
+
+
+def test_stratified_sample_keeps_small_files_whole(tmp_path):
+    sizes = {'Energy': 30, 'Health': 50}
+    data_path = tmp_path / 'government_spending_data.csv'
+    _write_spending(data_path, sizes)
+
+    sample, _ = stratified_sample(str(data_path), ['transaction_id', 'amount'], 'department', sample_size=1000,
+                                  cache_dir=str(tmp_path / 'cache'))
+
+    assert sample['department'].value_counts().to_dict() == sizes
@@ -1,28 +1,15 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 from statsmodels.tsa.seasonal import seasonal_decompose
 from statsmodels.tsa.stattools import adfuller
 import logging
 
+from data_loader import load_data
+from chart_rendering import render_chart
+
 # Setting up logging
 logging.basicConfig(filename='time_series_analysis.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path, parse_dates=['date'])
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
-
 def perform_time_series_analysis(df, target_column='amount'):
     """
     Perform time series analysis on the specified column.
@@ -43,18 +30,13 @@ def perform_time_series_analysis(df, target_column='amount'):
     decomposition = seasonal_decompose(monthly_data, model='additive', period=12)
     
     # Plot decomposition
-    fig, (ax1, ax2, ax3, ax4) = plt.subplots(4, 1, figsize=(12, 16))
-    decomposition.observed.plot(ax=ax1)
-    ax1.set_title('Observed')
-    decomposition.trend.plot(ax=ax2)
-    ax2.set_title('Trend')
-    decomposition.seasonal.plot(ax=ax3)
-    ax3.set_title('Seasonal')
-    decomposition.resid.plot(ax=ax4)
-    ax4.set_title('Residual')
-    plt.tight_layout()
-    plt.savefig('time_series_decomposition.png')
-    plt.close()
+    components = pd.DataFrame({
+        'Observed': decomposition.observed,
+        'Trend': decomposition.trend,
+        'Seasonal': decomposition.seasonal,
+        'Residual': decomposition.resid,
+    })
+    render_chart('decomposition', 'time_series_decomposition.png', components)
     
     # Test for stationarity
     result = adfuller(monthly_data)
@@ -69,7 +51,7 @@ def perform_time_series_analysis(df, target_column='amount'):
 
 def main():
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
+    df = load_data(data_path, columns=['date', 'amount'])
     perform_time_series_analysis(df)
 
 if __name__ == "__main__":
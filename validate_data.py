@@ -1,27 +1,16 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import logging
+import pyarrow as pa
+
+from data_loader import SPENDING_SCHEMA, resolve_schema
 
 # Setting up logging
 logging.basicConfig(filename='data_validation.log', level=logging.INFO,
                     format='%(asctime)s:%(levelname)s:%(message)s')
 
-def load_data(file_path):
-    """
-    Load data from a CSV file into a pandas DataFrame.
-    
-    :param file_path: Path to the CSV file
-    :return: pandas DataFrame
-    """
-    try:
-        data = pd.read_csv(file_path)
-        logging.info(f"Data loaded successfully from {file_path}")
-        return data
-    except Exception as e:
-        logging.error(f"Failed to load data: {str(e)}")
-        raise
-
 def validate_data(df):
     """
     Perform various validations on the data to ensure its integrity.
@@ -56,7 +45,7 @@ def validate_data(df):
             validation_results[f'{col}_negative_values'] = 0
     
     # Check categorical data for unexpected values
-    categorical_columns = df.select_dtypes(include=['object']).columns
+    categorical_columns = df.select_dtypes(include=['object', 'string']).columns
     for col in categorical_columns:
         unique_values = df[col].unique()
         validation_results[f'{col}_unexpected_values'] = len(unique_values)
@@ -64,6 +53,211 @@ def validate_data(df):
     logging.info("Data validation completed")
     return validation_results
 
+class HyperLogLog:
+    """
+    Mergeable HyperLogLog sketch for approximate distinct counts.
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        """
+        Add 64-bit hash values to the sketch.
+
+        :param hashes: numpy array of uint64 hashes
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if hashes.size == 0:
+            return
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # The rank is taken from the next 32 bits so the bit length is exact in float64
+        rest = ((hashes << np.uint64(self.precision)) >> np.uint64(32)).astype(np.float64)
+        _, bit_length = np.frexp(rest)
+        rank = (33 - bit_length).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = self.registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over 64-bit row hashes.
+    """
+
+    def __init__(self, capacity=10_000_000, error_rate=0.001):
+        self.size = int(-capacity * np.log(error_rate) / (np.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.size / capacity * np.log(2))))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes):
+        h1 = (hashes & np.uint64(0xFFFFFFFF)).astype(np.uint64)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return ((h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.size)).astype(np.int64)
+
+    def add_and_check(self, hashes):
+        """
+        Add hashes to the filter and report which ones were (probably) already present.
+
+        :param hashes: numpy array of uint64 hashes, unique within the call
+        :return: Boolean numpy array, True where the hash was seen before
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if hashes.size == 0:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(hashes)
+        byte_index, bit_index = positions >> 3, (positions & 7).astype(np.uint8)
+        masks = np.left_shift(np.uint8(1), bit_index)
+        seen = ((self.bits[byte_index] & masks) != 0).all(axis=1)
+        np.bitwise_or.at(self.bits, byte_index.ravel(), masks.ravel())
+        return seen
+
+
+class ValidationAccumulator:
+    """
+    Mergeable per-column validation state for chunked validation.
+    """
+
+    def __init__(self, hll_precision=14):
+        self.hll_precision = hll_precision
+        self.missing_values = 0
+        self.invalid_dates = 0
+        self.negative_counts = {}
+        self.distinct_sketches = {}
+
+    def update(self, chunk):
+        """
+        Fold one chunk of rows into the accumulator.
+
+        :param chunk: DataFrame chunk
+        """
+        self.missing_values += int(chunk.isnull().sum().sum())
+
+        if 'date' in chunk.columns:
+            parsed = pd.to_datetime(chunk['date'], errors='coerce')
+            self.invalid_dates += int((parsed.isnull() & chunk['date'].notnull()).sum())
+            chunk = chunk.drop(columns='date')
+
+        for col in chunk.select_dtypes(include=[np.number]).columns:
+            self.negative_counts[col] = self.negative_counts.get(col, 0) + int((chunk[col] < 0).sum())
+
+        for col in chunk.select_dtypes(include=['object', 'string']).columns:
+            sketch = self.distinct_sketches.setdefault(col, HyperLogLog(self.hll_precision))
+            sketch.add_hashes(pd.util.hash_pandas_object(chunk[col], index=False).to_numpy())
+        return self
+
+    def merge(self, other):
+        """
+        Merge another accumulator into this one.
+
+        :param other: ValidationAccumulator built from other chunks
+        """
+        self.missing_values += other.missing_values
+        self.invalid_dates += other.invalid_dates
+        for col, count in other.negative_counts.items():
+            self.negative_counts[col] = self.negative_counts.get(col, 0) + count
+        for col, sketch in other.distinct_sketches.items():
+            if col in self.distinct_sketches:
+                self.distinct_sketches[col].merge(sketch)
+            else:
+                self.distinct_sketches[col] = sketch
+        return self
+
+    def results(self, duplicates, has_date):
+        validation_results = {'missing_values': self.missing_values, 'duplicates': duplicates}
+        if has_date:
+            validation_results['date_format_valid'] = self.invalid_dates == 0
+        for col, count in self.negative_counts.items():
+            validation_results[f'{col}_negative_values'] = count
+        for col, sketch in self.distinct_sketches.items():
+            validation_results[f'{col}_unexpected_values'] = sketch.count()
+        return validation_results
+
+
+def _chunk_dtypes(file_path):
+    # Fixed dtypes for every chunk: inferred dtypes can differ between chunks, and then
+    # the same row hashes differently and cross-chunk duplicates are missed. Numeric
+    # columns are read as float64 so missing values never change their type; dates
+    # stay text so invalid ones can be counted.
+    schema = resolve_schema(file_path) or SPENDING_SCHEMA
+    return {col: np.float64 if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) else str
+            for col, arrow_type in schema.items()}
+
+def _validate_chunk(chunk, hll_precision=14):
+    """
+    Validate one chunk; runs in a worker process when a pool is used.
+
+    :return: Tuple of (ValidationAccumulator, uint64 row hashes)
+    """
+    accumulator = ValidationAccumulator(hll_precision).update(chunk)
+    row_hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+    return accumulator, row_hashes
+
+
+def validate_data_streaming(file_path, chunksize=100_000, n_workers=None, expected_rows=10_000_000, hll_precision=14):
+    """
+    Validate a CSV file chunk by chunk with bounded memory.
+
+    Produces the same dictionary as validate_data, with distinct counts
+    approximated by HyperLogLog and duplicates detected with a Bloom filter.
+
+    :param file_path: Path to the CSV file
+    :param chunksize: Number of rows per chunk
+    :param n_workers: Number of worker processes; chunks are validated in-process if None
+    :param expected_rows: Capacity used to size the duplicate Bloom filter
+    :param hll_precision: HyperLogLog precision (number of index bits)
+    :return: Dictionary with validation results
+    """
+    accumulator = ValidationAccumulator(hll_precision)
+    bloom = BloomFilter(capacity=expected_rows)
+    duplicates = 0
+    has_date = False
+
+    def consume(result):
+        nonlocal duplicates
+        chunk_accumulator, row_hashes = result
+        accumulator.merge(chunk_accumulator)
+        # Duplicates are checked in file order in the parent so cross-chunk repeats are counted
+        row_hashes = pd.Series(row_hashes)
+        in_chunk = row_hashes.duplicated()
+        unique_hashes = row_hashes[~in_chunk].to_numpy()
+        duplicates += int(in_chunk.sum()) + int(bloom.add_and_check(unique_hashes).sum())
+
+    header = pd.read_csv(file_path, nrows=0).columns
+    dtypes = {col: dtype for col, dtype in _chunk_dtypes(file_path).items() if col in header}
+    reader = pd.read_csv(file_path, chunksize=chunksize, dtype=dtypes)
+    if n_workers is None:
+        for chunk in reader:
+            has_date = has_date or 'date' in chunk.columns
+            consume(_validate_chunk(chunk, hll_precision))
+    else:
+        # Keep a bounded number of chunks in flight so memory stays flat
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            pending = []
+            for chunk in reader:
+                has_date = has_date or 'date' in chunk.columns
+                pending.append(executor.submit(_validate_chunk, chunk, hll_precision))
+                if len(pending) >= 2 * n_workers:
+                    consume(pending.pop(0).result())
+            for future in pending:
+                consume(future.result())
+
+    logging.info(f"Streaming data validation completed for {file_path}")
+    return accumulator.results(duplicates, has_date)
+
 def generate_validation_report(validation_results, output_file='validation_report.csv'):
     """
     Generate a CSV report of the validation results.
@@ -78,10 +272,9 @@ def generate_validation_report(validation_results, output_file='validation_repor
 def main():
     # Load the data
     data_path = 'government_spending_data.csv'
-    df = load_data(data_path)
     
-    # Validate the data
-    results = validate_data(df)
+    # Validate the data in fixed-size chunks so memory stays bounded on large files
+    results = validate_data_streaming(data_path)
     
     # Generate report
     generate_validation_report(results)